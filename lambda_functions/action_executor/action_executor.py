@@ -2,6 +2,7 @@ import json
 import boto3
 import os
 import time
+import action_registry
 
 s3_client = boto3.client('s3')
 BUCKET_NAME = os.environ['STORAGE_BUCKET']
@@ -57,18 +58,15 @@ def lambda_handler(event, context):
 def execute_action(action, session_id):
     """Execute the specified action"""
     
-    if action == 'restart_stb':
-        return restart_set_top_box(session_id)
-    elif action == 'reprovision_service':
-        return reprovision_service(session_id)
-    elif action == 'check_subscription':
-        return check_subscription_status(session_id)
-    else:
+    action_handler = action_registry.HANDLERS.get(action)
+    if action_handler is None:
         return {
             'success': False,
             'message': f'Unknown action: {action}'
         }
+    return action_handler(session_id)
 
+@action_registry.handler('restart_stb')
 def restart_set_top_box(session_id):
     """Simulate restarting a set-top box"""
     # In a real implementation, this would call the actual provisioning API
@@ -78,11 +76,12 @@ def restart_set_top_box(session_id):
         'success': True,
         'message': 'Set-top box restart command sent successfully',
         'details': {
-            'action_type': 'device_restart',
+            'action_type': action_registry.ACTIONS['restart_stb']['action_type'],
             'estimated_completion': '2-3 minutes'
         }
     }
 
+@action_registry.handler('reprovision_service')
 def reprovision_service(session_id):
     """Simulate reprovisioning Unifi TV service"""
     # In a real implementation, this would call the actual provisioning API
@@ -92,11 +91,12 @@ def reprovision_service(session_id):
         'success': True,
         'message': 'Service reprovisioning initiated successfully',
         'details': {
-            'action_type': 'service_reprovision',
+            'action_type': action_registry.ACTIONS['reprovision_service']['action_type'],
             'estimated_completion': '5-10 minutes'
         }
     }
 
+@action_registry.handler('check_subscription')
 def check_subscription_status(session_id):
     """Simulate checking subscription status"""
     # In a real implementation, this would call the actual billing/subscription API
@@ -107,7 +107,7 @@ def check_subscription_status(session_id):
         'success': True,
         'message': 'Subscription status checked successfully',
         'details': {
-            'action_type': 'subscription_check',
+            'action_type': action_registry.ACTIONS['check_subscription']['action_type'],
             'status': 'active',
             'expiry_date': '2024-12-31',
             'package': 'Unifi TV Ultimate'
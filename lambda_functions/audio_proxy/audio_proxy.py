@@ -2,6 +2,7 @@ import json
 import boto3
 import base64
 import os
+import re
 from botocore.exceptions import ClientError
 
 s3_client = boto3.client('s3')
@@ -10,7 +11,18 @@ BUCKET_NAME = os.environ['STORAGE_BUCKET']
 def lambda_handler(event, context):
     try:
         session_id = event['pathParameters']['session_id']
-        audio_key = f"sessions/{session_id}/response.mp3"
+        
+        # Streaming responses publish a manifest of partial text/audio chunks
+        if event.get('resource', '').startswith('/stream'):
+            return get_stream_manifest(session_id)
+        
+        params = event.get('queryStringParameters') or {}
+        if params.get('chunk') is not None:
+            audio_key = stream_chunk_key(session_id, params['chunk'])
+        elif params.get('tts'):
+            audio_key = tts_cache_key(params['tts'])
+        else:
+            audio_key = resolve_session_audio_key(session_id)
         
         response = s3_client.get_object(Bucket=BUCKET_NAME, Key=audio_key)
         audio_data = response['Body'].read()
@@ -26,6 +38,13 @@ def lambda_handler(event, context):
             'isBase64Encoded': True
         }
         
+    except ValueError as e:
+        return {
+            'statusCode': 400,
+            'headers': {'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': str(e)})
+        }
+        
     except ClientError as e:
         if e.response['Error']['Code'] == 'NoSuchKey':
             return {
@@ -40,4 +59,47 @@ def lambda_handler(event, context):
             'statusCode': 500,
             'headers': {'Access-Control-Allow-Origin': '*'},
             'body': json.dumps({'error': str(e)})
-        }
\ No newline at end of file
+        }
+
+def stream_chunk_key(session_id, chunk):
+    """Map a stream chunk index to its object, rejecting anything that is not a small integer"""
+    if not re.match(r'^[0-9]{1,3}$', chunk):
+        raise ValueError("Invalid chunk index")
+    return f"sessions/{session_id}/stream/{int(chunk):03d}.mp3"
+
+def tts_cache_key(digest):
+    """Map a TTS cache digest to its shared object, rejecting anything that is not a sha256"""
+    if not re.match(r'^[0-9a-f]{64}$', digest):
+        raise ValueError("Invalid audio reference")
+    return f"tts-cache/{digest}.mp3"
+
+def resolve_session_audio_key(session_id):
+    """Find the audio object a session references (shared TTS cache or legacy response.mp3)"""
+    try:
+        response = s3_client.get_object(Bucket=BUCKET_NAME, Key=f"sessions/{session_id}/troubleshooting.json")
+        return json.loads(response['Body'].read())['audio_key']
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'NoSuchKey':
+            raise
+        return f"sessions/{session_id}/response.mp3"
+
+def get_stream_manifest(session_id):
+    """Return the current stream manifest so clients can play chunks as they arrive"""
+    try:
+        response = s3_client.get_object(Bucket=BUCKET_NAME, Key=f"sessions/{session_id}/stream.json")
+        manifest = response['Body'].read().decode('utf-8')
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'NoSuchKey':
+            raise
+        # Nothing synthesized yet
+        manifest = json.dumps({'chunks': [], 'complete': False, 'status': 'pending'})
+    
+    return {
+        'statusCode': 200,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*',
+            'Cache-Control': 'no-store'
+        },
+        'body': manifest
+    }
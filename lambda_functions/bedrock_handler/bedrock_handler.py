@@ -3,123 +3,121 @@ import boto3
 import os
 from botocore.exceptions import ClientError
 import re
+import time
+import copy
+import threading
+import uuid
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+import streaming
+import tts
+import tts_cache
+import response_cache
+import kb_cache
+import local_retriever
+import model_router
+import prompt_budget
+import model_invoker
+import action_registry
+from botocore.config import Config
 
-bedrock_runtime = boto3.client('bedrock-runtime')
+# Bounded socket timeouts; per-request deadlines are enforced by model_invoker
+# read_timeout stays under API Gateway's 29s so abandoned attempts release their worker
+bedrock_runtime = boto3.client('bedrock-runtime', config=Config(connect_timeout=5, read_timeout=25, retries={'max_attempts': 2}))
 bedrock_agent = boto3.client('bedrock-agent-runtime')
 polly_client = boto3.client('polly')
 s3_client = boto3.client('s3')
 BUCKET_NAME = os.environ['STORAGE_BUCKET']
 KNOWLEDGE_BASE_ID = "HU9V8VBZBI"
 
+DEFAULT_TRANSCRIPT = {'text': 'refer to the context provided'}
+DEFAULT_ANALYSIS = {'labels': [], 'extracted_text': [], 'custom_labels': []}
+SESSION_ID_PATTERN = re.compile(r'^[a-zA-Z0-9-]+$')
+
+class InvalidRequest(Exception):
+    """Bad client input; the only error the handler reports as 400"""
+
+# Reused across warm invocations; boto3 clients are safe to share between threads
+io_executor = ThreadPoolExecutor(max_workers=8)
+tts_audio_cache = tts_cache.TTSCache(s3_client, BUCKET_NAME)
+answer_cache = response_cache.ResponseCache()
+kb_retrieval_cache = kb_cache.RetrievalCache(s3_client, BUCKET_NAME, KNOWLEDGE_BASE_ID)
+local_kb_retriever = local_retriever.load_local_retriever()
+tier_stats = model_router.TierStats()
+# Model attempts get their own pool: timed-out and hedged attempts keep running until
+# read_timeout and must not starve the S3/Polly work on io_executor
+model_executor = ThreadPoolExecutor(max_workers=4)
+model_calls = model_invoker.ModelInvoker(model_executor)
+
 def lambda_handler(event, context):
+    started_at = time.monotonic()
+    # Requests through API Gateway must answer within its integration timeout
+    api_started_at = started_at if 'requestContext' in event or 'httpMethod' in event else None
     try:
         body = json.loads(event['body'])
-        session_id = body['session_id']
-        
-        # Get transcript and image analysis (if they exist)
-        transcript_data = {'text': 'refer to the context provided'}
-        analysis_data = {'labels': [], 'extracted_text': [], 'custom_labels': []}
+        timings = {}
+        inline = 'text' in body
         
-        try:
-            transcript_obj = s3_client.get_object(
-                Bucket=BUCKET_NAME,
-                Key=f"sessions/{session_id}/transcript.json"
-            )
-            transcript_data = json.loads(transcript_obj['Body'].read())
-        except ClientError as e:
-            if e.response['Error']['Code'] != 'NoSuchKey':
-                raise
-            print(f"No transcript found for session {session_id}")
-        
-        try:
-            analysis_obj = s3_client.get_object(
-                Bucket=BUCKET_NAME,
-                Key=f"sessions/{session_id}/image_analysis.json"
+        if inline:
+            # Text-only fast path: the question arrives in the request, no session artifacts are read
+            session_id = body.get('session_id') or str(uuid.uuid4())
+            if not SESSION_ID_PATTERN.match(session_id):
+                raise InvalidRequest("Invalid session ID format")
+            transcript_data, analysis_data = inline_troubleshooting_context(body)
+            kb_context = None
+            if not should_defer_kb(transcript_data['text']):
+                kb_context = timed(timings, 'kb_ms', get_knowledge_base_context, transcript_data['text'])
+        else:
+            session_id = body['session_id']
+            # Fetch transcript, image analysis and KB context concurrently.
+            # KB retrieval is deferred when a cached or template answer is likely to be used.
+            transcript_data, analysis_data, kb_context = fetch_troubleshooting_context(
+                session_id, timings, defer_kb=should_defer_kb
             )
-            analysis_data = json.loads(analysis_obj['Body'].read())
-        except ClientError as e:
-            if e.response['Error']['Code'] != 'NoSuchKey':
-                raise
-            print(f"No image analysis found for session {session_id}")
-        
-        # Analyze query complexity and get knowledge base context
         query_complexity = analyze_query_complexity(transcript_data['text'])
-        kb_context = get_knowledge_base_context(transcript_data['text'], analysis_data)
-        
-        # Call Bedrock with adaptive prompt
-        try:
-            prompt = build_adaptive_prompt(transcript_data['text'], analysis_data, query_complexity, kb_context)
-
-            max_tokens = 512 if query_complexity == 'simple' else 1024
-            native_request = {
-                "messages": [
-                    {"role": "system", "content": "You are a helpful assistant that is able to solve Unifi TV customer issues. Expected response should be concise and not ambiguous. Common issues faced are screen loading issues and overdue bills."},
-                    {"role": "user", "content": prompt}
-                ],
-                "max_completion_tokens": max_tokens,
-                "temperature": 0.2,
-            }
-
-            request = json.dumps(native_request)
-
-            try:
-                model_id = "openai.gpt-oss-120b-1:0"
-                response = bedrock_runtime.invoke_model(modelId=model_id, body=request)
-            except Exception as e:
-                print(f"ERROR: Can't invoke '{model_id}'. Reason: {e}")
-                exit(1)
-
-            model_response = json.loads(response["body"].read())
-
-            # ✅ Extract only the model-generated text
-            agent_response = model_response["choices"][0]["message"]["content"]
-            agent_response = re.sub(r"<reasoning>.*?</reasoning>", "", agent_response, flags=re.DOTALL).strip()
-
-            
-        except Exception as e:
-            print(f"Bedrock Llama call failed: {e}")
-            agent_response = generate_fallback_response(transcript_data['text'], analysis_data)
         
-        # Generate TTS audio
-        try:
-            tts_response = polly_client.synthesize_speech(
-                Text=agent_response,
-                OutputFormat='mp3',
-                VoiceId='Joanna'
-            )
-        except ClientError as e:
-            error_code = e.response.get('Error', {}).get('Code')
-            if error_code == 'TextLengthExceededException':
-                truncated_text = agent_response[:2500]
-                print(f"WARNING: Text length exceeded, retrying with truncated text ({len(truncated_text)} chars)")
-                tts_response = polly_client.synthesize_speech(
-                    Text=truncated_text,
-                    OutputFormat='mp3',
-                    VoiceId='Joanna'
-                )
+        # Near-duplicate questions with the same image context reuse a cached answer
+        audio_bytes = None
+        stream_chunks = []
+        agent_response = answer_cache.lookup(transcript_data['text'], analysis_data)
+        if agent_response is not None:
+            response_source = 'cache'
+        else:
+            # Well-known intents get a template, the rest go to the smallest model that fits
+            route = model_router.route(transcript_data['text'], analysis_data, query_complexity)
+            start = time.perf_counter()
+            if route['tier'] == model_router.TIER_TEMPLATE:
+                agent_response, response_source = route['template'], 'template'
             else:
-                raise
+                if kb_context is None:
+                    kb_context = timed(timings, 'kb_ms', get_knowledge_base_context, transcript_data['text'])
+                agent_response, audio_bytes, stream_chunks, response_source = generate_agent_response(
+                    body, session_id, transcript_data, analysis_data, query_complexity, kb_context,
+                    route['model_id'], model_invoker.deadline_seconds(context, api_started_at), timings
+                )
+                if response_source == 'model':
+                    answer_cache.store(transcript_data['text'], analysis_data, agent_response)
+            timings['answer_ms'] = round((time.perf_counter() - start) * 1000, 1)
+            tier_stats.record(route['tier'], timings['answer_ms'])
+            timings['tier'] = route['tier']
+            print(f"Routing for session {session_id}: tier={route['tier']} intent={route['intent']} "
+                  f"model={route['model_id']} answer_ms={timings['answer_ms']} tiers={json.dumps(tier_stats.summary())}")
+        print(f"Response source {response_source} for session {session_id}: {json.dumps(answer_cache.stats)}")
+        
+        # Generate TTS audio; identical answers share one content-addressed object
+        if audio_bytes is None:
+            audio_key, tts_source = tts_audio_cache.get_or_create(agent_response, synthesize_response_audio)
+        else:
+            audio_key, tts_source = tts_audio_cache.store(agent_response, audio_bytes), 'stream'
+        print(f"TTS cache {tts_source} for session {session_id}: {json.dumps(tts_audio_cache.stats)} hit_rate={tts_audio_cache.hit_rate()}")
         
         # Format response for better readability
         formatted_response = format_markdown_response(agent_response)
         
-        # Store audio response with proper headers
-        audio_key = f"sessions/{session_id}/response.mp3"
-        s3_client.put_object(
-            Bucket=BUCKET_NAME,
-            Key=audio_key,
-            Body=tts_response['AudioStream'].read(),
-            ContentType='audio/mpeg',
-            CacheControl='max-age=3600',
-            Metadata={
-                'Content-Type': 'audio/mpeg'
-            }
-        )
-        
         # Use environment variable for API URL (will be set after deployment)
         api_base_url = os.environ.get('API_BASE_URL')
         if api_base_url:
-            audio_url = f"{api_base_url}/audio/{session_id}"
+            audio_url = f"{api_base_url}/audio/{session_id}?tts={tts_cache.digest_from_key(audio_key)}"
         else:
             # Fallback to presigned URL if API URL not available
             audio_url = s3_client.generate_presigned_url(
@@ -132,8 +130,17 @@ def lambda_handler(event, context):
         troubleshooting_data = {
             'response_text': formatted_response,
             'audio_key': audio_key,
-            'recommended_actions': extract_actions(agent_response)
+            'tts_cache': tts_source,
+            'response_source': response_source,
+            'recommended_actions': extract_actions(agent_response),
+            'timings': timings
         }
+        if stream_chunks:
+            troubleshooting_data['stream_key'] = f"sessions/{session_id}/stream.json"
+        if inline:
+            # The whole session record goes out in this single write
+            troubleshooting_data['transcript'] = transcript_data
+            troubleshooting_data['image_analysis'] = analysis_data
         
         s3_client.put_object(
             Bucket=BUCKET_NAME,
@@ -151,10 +158,21 @@ def lambda_handler(event, context):
                 'response': formatted_response,
                 'audio_url': audio_url,
                 'actions': troubleshooting_data['recommended_actions'],
+                'chunks': stream_chunks,
                 'session_id': session_id
             })
         }
         
+    except InvalidRequest as e:
+        return {
+            'statusCode': 400,
+            'headers': {
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({
+                'error': str(e)
+            })
+        }
     except Exception as e:
         return {
             'statusCode': 500,
@@ -166,6 +184,226 @@ def lambda_handler(event, context):
             })
         }
 
+def generate_agent_response(body, session_id, transcript_data, analysis_data, query_complexity, kb_context,
+                            model_id, deadline, timings):
+    """Call Bedrock with the adaptive prompt, falling back to a canned answer on failure.
+
+    Calls are bounded by deadline seconds and skipped outright while the model's circuit
+    breaker is open.
+
+    Returns (text, audio bytes or None, stream chunks, source) where source is 'model' or 'fallback'.
+    """
+    audio_bytes = None
+    stream_chunks = []
+    try:
+        prompt_tokens = {}
+        prompt = build_adaptive_prompt(transcript_data['text'], analysis_data, query_complexity, kb_context, prompt_tokens)
+        timings['prompt_tokens'] = prompt_tokens
+        print(f"Prompt tokens per section for session {session_id}: {json.dumps(prompt_tokens)}")
+
+        max_tokens = 512 if query_complexity == 'simple' else 1024
+        native_request = {
+            "messages": [
+                {"role": "system", "content": "You are a helpful assistant that is able to solve Unifi TV customer issues. Expected response should be concise and not ambiguous. Common issues faced are screen loading issues and overdue bills."},
+                {"role": "user", "content": prompt}
+            ],
+            "max_completion_tokens": max_tokens,
+            "temperature": 0.2,
+        }
+
+        request = json.dumps(native_request)
+
+        if body.get('stream'):
+            # Sentences are sent to Polly while the model keeps generating
+            # The stream paces itself: it runs inline and stops once the deadline has passed
+            agent_response, audio_bytes, stream_chunks = model_calls.invoke(
+                model_id, lambda: generate_streaming_response(session_id, model_id, request, timings, deadline)
+            )
+        else:
+            def call_model():
+                response = bedrock_runtime.invoke_model(modelId=model_id, body=request)
+                return json.loads(response["body"].read())
+
+            # Never exit() here: a dead container turns one Bedrock hiccup into cold starts
+            model_response = model_calls.invoke(model_id, call_model, deadline)
+
+            # ✅ Extract only the model-generated text
+            agent_response = model_response["choices"][0]["message"]["content"]
+            agent_response = re.sub(r"<reasoning>.*?</reasoning>", "", agent_response, flags=re.DOTALL).strip()
+    except Exception as e:
+        print(f"Bedrock call to '{model_id}' failed ({model_calls.breaker(model_id).state}): {e}")
+        return generate_fallback_response(transcript_data['text'], analysis_data), None, [], 'fallback'
+    
+    return agent_response, audio_bytes, stream_chunks, 'model'
+
+def should_defer_kb(query):
+    """Skip eager KB retrieval when the answer will probably not need it"""
+    return answer_cache.has_candidate(query) or model_router.is_template_candidate(query)
+
+def synthesize_response_audio(text):
+    """Synthesize the full response with Polly as concurrent sentence-aligned chunks"""
+    return tts.synthesize_long_text(polly_client, io_executor, text)
+
+def generate_streaming_response(session_id, model_id, request, timings, deadline=None):
+    """Stream the model response and synthesize each finished sentence while generation continues.
+
+    Every audio chunk is written to sessions/{id}/stream/NNN.mp3 as soon as it is ready and
+    sessions/{id}/stream.json is updated, so clients can poll /stream/{session_id} and start
+    playback before the model has finished. A stream still running after deadline seconds
+    is abandoned and stream.json marked failed. Returns (text, full audio, chunk descriptors).
+    """
+    chunks = []
+    manifest_key = f"sessions/{session_id}/stream.json"
+
+    def synthesize(index, text):
+        # Already running on the executor, so oversized sentences are synthesized in sequence
+        audio = tts.join_mp3([
+            tts.synthesize_speech(polly_client, chunk)
+            for chunk in tts.split_for_polly(text, tts.POLLY_MAX_CHARS)
+        ])
+        s3_client.put_object(
+            Bucket=BUCKET_NAME,
+            Key=f"sessions/{session_id}/stream/{index:03d}.mp3",
+            Body=audio,
+            ContentType='audio/mpeg',
+            CacheControl='max-age=3600'
+        )
+        return audio
+
+    def write_manifest(status, error=None):
+        manifest = {'chunks': chunks, 'complete': status == 'complete', 'status': status}
+        if error is not None:
+            manifest['error'] = error
+        s3_client.put_object(
+            Bucket=BUCKET_NAME,
+            Key=manifest_key,
+            Body=json.dumps(manifest),
+            ContentType='application/json'
+        )
+
+    def on_chunk(index, text, audio):
+        chunks.append({
+            'index': index,
+            'text': text,
+            'audio_key': f"sessions/{session_id}/stream/{index:03d}.mp3"
+        })
+        write_manifest('streaming')
+
+    start = time.perf_counter()
+    pipeline = streaming.SpeechPipeline(io_executor, synthesize, on_chunk)
+    try:
+        text, audio_chunks = streaming.stream_and_speak(
+            streaming.stream_model_text(bedrock_runtime, model_id, request), pipeline, deadline
+        )
+        if not text:
+            raise ValueError("Model stream returned no visible text")
+    except Exception as e:
+        # Chunks already published stay playable, but clients must stop waiting for more
+        write_manifest('failed', str(e))
+        raise
+
+    write_manifest('complete')
+    timings['first_audio_ms'] = pipeline.first_audio_ms
+    timings['stream_ms'] = round((time.perf_counter() - start) * 1000, 1)
+    print(f"Streamed {len(chunks)} audio chunks for session {session_id}, first audio after {pipeline.first_audio_ms} ms")
+
+    # MP3 frames concatenate cleanly, so the full response.mp3 needs no re-encoding
+    return text, tts.join_mp3(audio_chunks), chunks
+
+def timed(timings, stage, func, *args):
+    """Run func(*args) and record its wall time in milliseconds under timings[stage]"""
+    start = time.perf_counter()
+    try:
+        return func(*args)
+    finally:
+        timings[stage] = round((time.perf_counter() - start) * 1000, 1)
+
+def load_session_artifact(session_id, name, default, description):
+    """Load a JSON artifact from the session prefix, returning default if it does not exist"""
+    try:
+        obj = s3_client.get_object(
+            Bucket=BUCKET_NAME,
+            Key=f"sessions/{session_id}/{name}"
+        )
+        return json.loads(obj['Body'].read())
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'NoSuchKey':
+            raise
+        print(f"No {description} found for session {session_id}")
+        return copy.deepcopy(default)
+
+def fetch_troubleshooting_context(session_id, timings, defer_kb=None):
+    """Fetch transcript, image analysis and KB context concurrently.
+
+    Media sessions cost two reads, transcript.json and image_analysis.json. The session
+    manifest is only read, once, when one of those files does not exist: text-only
+    uploads carry their artifacts inline in it. The KB query only depends on the transcript, so retrieval starts as soon
+    as the transcript is known while the image analysis read is still in flight. If
+    defer_kb returns True for the transcript text, retrieval is skipped and kb_context
+    is None.
+    """
+    start = time.perf_counter()
+    manifest_lock = threading.Lock()
+    manifest = []
+
+    def session_manifest():
+        with manifest_lock:
+            if not manifest:
+                manifest.append(timed(
+                    timings, 'manifest_ms', load_session_artifact, session_id, 'session.json', {}, 'session manifest'
+                ))
+            return manifest[0]
+
+    def load_or_inline(stage, name, manifest_field, default, description):
+        artifact = timed(timings, stage, load_session_artifact, session_id, name, None, description)
+        if artifact is None:
+            artifact = session_manifest().get(manifest_field) or copy.deepcopy(default)
+        return artifact
+
+    def transcript_and_kb():
+        transcript = load_or_inline('transcript_ms', 'transcript.json', 'transcript', DEFAULT_TRANSCRIPT, 'transcript')
+        if defer_kb and defer_kb(transcript['text']):
+            return transcript, None
+        kb_context = timed(timings, 'kb_ms', get_knowledge_base_context, transcript['text'])
+        return transcript, kb_context
+
+    def analysis():
+        return load_or_inline('analysis_ms', 'image_analysis.json', 'image_analysis', DEFAULT_ANALYSIS, 'image analysis')
+
+    analysis_future = io_executor.submit(analysis)
+    transcript_future = io_executor.submit(transcript_and_kb)
+    
+    transcript_data, kb_context = transcript_future.result()
+    analysis_data = analysis_future.result()
+    timings['fetch_ms'] = round((time.perf_counter() - start) * 1000, 1)
+    print(f"Context fetch timings for session {session_id}: {json.dumps(timings)}")
+    
+    return transcript_data, analysis_data, kb_context
+
+def is_label_list(value):
+    """Labels as image_analysis_handler stores them: dicts with a str Name and an optional numeric Confidence"""
+    return isinstance(value, list) and all(
+        isinstance(label, dict) and isinstance(label.get('Name'), str)
+        and isinstance(label.get('Confidence', 0), (int, float))
+        for label in value
+    )
+
+def inline_troubleshooting_context(body):
+    """Build transcript and image analysis from a request that carries them inline"""
+    analysis = body.get('analysis') or {}
+    if not isinstance(body['text'], str) or not body['text'].strip() or not isinstance(analysis, dict):
+        raise InvalidRequest("Inline requests need non-empty text and an analysis object")
+    for key in ('labels', 'custom_labels'):
+        if key in analysis and not is_label_list(analysis[key]):
+            raise InvalidRequest(f"analysis.{key} must be a list of objects with a string Name")
+    extracted_text = analysis.get('extracted_text', [])
+    if not isinstance(extracted_text, list) or not all(isinstance(text, str) for text in extracted_text):
+        raise InvalidRequest("analysis.extracted_text must be a list of strings")
+    transcript_data = {'text': body['text'], 'timestamp': datetime.utcnow().isoformat()}
+    analysis_data = copy.deepcopy(DEFAULT_ANALYSIS)
+    analysis_data.update({key: analysis[key] for key in DEFAULT_ANALYSIS if key in analysis})
+    return transcript_data, analysis_data
+
 def generate_fallback_response(transcript, analysis):
     """Generate a basic troubleshooting response when Bedrock agent is not available"""
     detected_text = analysis.get('extracted_text', [])
@@ -199,10 +437,26 @@ def analyze_query_complexity(query_text):
         return 'complex'
     return 'simple'
 
-def get_knowledge_base_context(query, analysis_data):
-    """Retrieve relevant context using Bedrock Knowledge Base semantic search"""
+def get_knowledge_base_context(query):
+    """Retrieve relevant context using Bedrock Knowledge Base semantic search.
+
+    Retrieval is driven by the customer's query text only. With LOCAL_KB_ENABLED, a
+    local index built from the KB export answers confident matches in-process; the
+    rest are cached per normalized query and KB generation in front of the remote
+    retrieve call.
+    """
     try:
-        final_query = query + " " + " ".join([l['Name'] for l in analysis_data.get('labels', [])])
+        if local_kb_retriever is not None:
+            local_context = local_kb_retriever.context_for(query)
+            if local_context is not None:
+                print("KB context served by local index")
+                return local_context
+        
+        cached = cached_kb_context(query)
+        if cached is not None:
+            print(f"KB cache hit: {json.dumps(kb_retrieval_cache.stats)}")
+            return cached
+        
         response = bedrock_agent.retrieve(
             knowledgeBaseId=KNOWLEDGE_BASE_ID,
             retrievalQuery={'text': query},
@@ -217,82 +471,136 @@ def get_knowledge_base_context(query, analysis_data):
         for result in response['retrievalResults']:
             context += result['content']['text'] + "\n"
         
-        return context.strip()
+        context = context.strip()
+        # The S3 cache write is off the critical path; the context is returned either way
+        store_kb_context(query, context)
+        print(f"KB cache miss: {json.dumps(kb_retrieval_cache.stats)}")
+        return context
     except Exception as e:
         print(f"KB retrieval failed: {e}")
         return ""
 
+def cached_kb_context(query):
+    """Best-effort KB cache read; a cache failure is treated as a miss"""
+    try:
+        return kb_retrieval_cache.get(query)
+    except Exception as e:
+        print(f"KB cache read failed: {e}")
+        return None
+
+def store_kb_context(query, context):
+    """Best-effort KB cache write: memory tier now, S3 tier on io_executor"""
+    def persist(entry):
+        try:
+            kb_retrieval_cache.persist(*entry)
+        except Exception as e:
+            print(f"KB cache write failed: {e}")
+
+    try:
+        io_executor.submit(persist, kb_retrieval_cache.put_memory(query, context))
+    except Exception as e:
+        print(f"KB cache write failed: {e}")
 
 
-def build_adaptive_prompt(query, analysis_data, complexity, kb_context):
-    """Build prompt based on complexity and available context"""
+
+def build_adaptive_prompt(query, analysis_data, complexity, kb_context, report=None):
+    """Build prompt based on complexity and available context.
+
+    Each section is deduplicated and trimmed to its token budget; if report is given
+    it is filled with the estimated prompt tokens per section.
+    """
+    budgets = prompt_budget.SECTION_BUDGETS
+    query = prompt_budget.truncate_to_tokens(query, budgets['query'])
+    labels = prompt_budget.fit_items(
+        prompt_budget.rank_label_names(analysis_data.get('labels', [])), budgets['labels']
+    )
+    extracted_text = prompt_budget.fit_items(
+        prompt_budget.dedupe_near_duplicates(analysis_data.get('extracted_text', [])), budgets['extracted_text']
+    )
+    custom_labels = prompt_budget.fit_items(
+        prompt_budget.rank_label_names(analysis_data.get('custom_labels', [])), budgets['custom_labels']
+    )
+    kb_chunks = prompt_budget.fit_items(
+        prompt_budget.dedupe_near_duplicates(kb_context.split("\n") if kb_context else []),
+        budgets['kb_context']['simple' if complexity == 'simple' else 'complex']
+    )
+    
     base_prompt = f"""You are a Unifi TV customer service agent.
 
 Customer Issue: {query}
 
 Image Analysis:
-- Labels: {[l['Name'] for l in analysis_data.get('labels', [])]}
-- Text: {analysis_data.get('extracted_text', [])}
-- Custom: {[l['Name'] for l in analysis_data.get('custom_labels', [])]}
+- Labels: {labels}
+- Text: {extracted_text}
+- Custom: {custom_labels}
 
 Instructions: 
 If the user's query is ambiguous, prompt user for asking again.
 Utilize Knowledge Base context only if user's issue is clear..
 """
     
-    if kb_context:
-        base_prompt += f"\n\nKnowledge Base Context:\n{kb_context}"
+    if kb_chunks:
+        base_prompt += "\n\nKnowledge Base Context:\n" + "\n".join(kb_chunks)
     
     if complexity == 'simple':
         base_prompt += "\n\nProvide a concise, direct solution with 2-3 key steps."
     else:
         base_prompt += "\n\nProvide detailed troubleshooting with explanations, multiple options, and preventive measures."
     
+    if report is not None:
+        report.update({
+            'query': prompt_budget.count_tokens(query),
+            'labels': prompt_budget.count_tokens(str(labels)),
+            'extracted_text': prompt_budget.count_tokens(str(extracted_text)),
+            'custom_labels': prompt_budget.count_tokens(str(custom_labels)),
+            'kb_context': prompt_budget.count_tokens("\n".join(kb_chunks)),
+            'total': prompt_budget.count_tokens(base_prompt)
+        })
+    
     return base_prompt
 
-def format_markdown_response(text):
-    """Format response text for better markdown readability"""
-    # Clean up the text
-    text = text.strip()
-    
-    # Add proper spacing around numbered lists
-    text = re.sub(r'(\d+\.)\s*', r'\n\1 ', text)
-    
-    # Add proper spacing around bullet points
-    text = re.sub(r'([•-])\s*', r'\n\1 ', text)
-    
-    # Add spacing around bold text
-    text = re.sub(r'\*\*(.*?)\*\*', r'\n**\1**\n', text)
-    
-    # Clean up multiple newlines
-    text = re.sub(r'\n{3,}', '\n\n', text)
-    
-    # Ensure proper paragraph spacing
-    sentences = text.split('. ')
-    formatted_sentences = []
-    
-    for i, sentence in enumerate(sentences):
-        sentence = sentence.strip()
-        if sentence:
-            if i < len(sentences) - 1:
-                sentence += '.'
-            formatted_sentences.append(sentence)
-    
-    # Join with proper spacing
-    result = ' '.join(formatted_sentences)
+# Every formatting rule is one alternative, so the response is scanned exactly once.
+# All branches share a one-character prefix class, which lets the regex engine skip
+# ordinary text quickly. List markers only break the line after a sentence or colon
+# (checked in _format_token), leaving decimals ("2.5"), prices ("RM 10.") and
+# hyphenated words ("set-top") alone.
+MARKDOWN_TOKENS = re.compile(r"""
+    [ \t\n?*]
+    (?:
+        (?P<newlines>(?<=\n)[ \t\n]*|(?<=[ \t])[ \t]*\n[ \t\n]*)
+      | (?P<marker>(?<=[ \t])[ \t]*(?:\d{1,2}\.|[-*•])[ \t]+(?=\S))
+      | (?P<heading>(?<=[ \t])[ \t]*\*\*[^*\n]+?\*\*:?[ \t]*|(?<=\*)\*[^*\n]+?\*\*:?[ \t]*)
+      | (?P<question>(?<=\?)[ \t]+(?=[A-Z]))
+    )
+""", re.VERBOSE)
+
+def _format_token(match):
+    kind = match.lastgroup
+    if kind == 'newlines':
+        return "\n\n" if match.group().count("\n") > 1 else "\n"
+    if kind == 'question':
+        return "?\n\n"
     
-    # Add line breaks before questions
-    result = re.sub(r'(\?\s*)([A-Z])', r'\1\n\n\2', result)
+    token = match.group()
+    start = match.start()
+    previous = match.string[start - 1] if start else "\n"
+    if kind == 'marker':
+        marker = token.strip()
+        if marker == '•' or previous in '.:!?':
+            return f"\n{marker} "
+        return token
     
-    return result.strip()
+    # Only "**Title:**" / "**Title**:" become their own line; inline bold is left as is
+    heading = token.strip()
+    if not heading.endswith(':') and not heading.endswith(':**'):
+        return token
+    prefix = "" if previous == "\n" and token[0] == '*' else "\n\n"
+    return f"{prefix}{heading}\n"
+
+def format_markdown_response(text):
+    """Format response text for better markdown readability in a single pass"""
+    return MARKDOWN_TOKENS.sub(_format_token, text.strip()).strip()
 
 def extract_actions(response_text):
     """Extract actionable items from the response"""
-    actions = []
-    if 'restart' in response_text.lower():
-        actions.append('restart_stb')
-    if 'provision' in response_text.lower():
-        actions.append('reprovision_service')
-    if 'subscription' in response_text.lower():
-        actions.append('check_subscription')
-    return actions
+    return action_registry.extract_actions(response_text)
\ No newline at end of file
@@ -0,0 +1,127 @@
+import hashlib
+import json
+import os
+import re
+import time
+from collections import OrderedDict
+from botocore.exceptions import ClientError
+
+KB_CACHE_PREFIX = 'kb-cache/'
+# Rewritten by scripts/invalidate_kb_cache.py after every Knowledge Base sync
+KB_GENERATION_KEY = f"{KB_CACHE_PREFIX}generation.json"
+KB_CACHE_TTL_SECONDS = int(os.environ.get('KB_CACHE_TTL_SECONDS', '21600'))
+KB_CACHE_MAX_ENTRIES = int(os.environ.get('KB_CACHE_MAX_ENTRIES', '256'))
+# How often a warm container checks whether the Knowledge Base was re-synced
+KB_GENERATION_REFRESH_SECONDS = int(os.environ.get('KB_GENERATION_REFRESH_SECONDS', '60'))
+
+def normalize_kb_query(text, labels=None):
+    """Normalize retrieval text so trivially different phrasings share a cache entry"""
+    normalized = ' '.join(re.findall(r"[a-z0-9]+", text.lower()))
+    if labels:
+        normalized += ' | ' + ' '.join(sorted(set(l.lower() for l in labels)))
+    return normalized
+
+class RetrievalCache:
+    """Cache of Knowledge Base retrieval context: in-process LRU backed by kb-cache/ in S3.
+
+    Entries live under the current KB generation, so bumping the generation marker after
+    a re-sync invalidates every container's memory tier and the persistent tier at once.
+    """
+
+    def __init__(self, s3_client, bucket, knowledge_base_id, ttl_seconds=KB_CACHE_TTL_SECONDS,
+                 max_entries=KB_CACHE_MAX_ENTRIES):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.knowledge_base_id = knowledge_base_id
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.current_generation = None
+        self.generation_checked_at = 0.0
+        self.stats = {'memory_hits': 0, 's3_hits': 0, 'misses': 0}
+
+    def generation(self):
+        now = time.time()
+        if self.current_generation is not None and now - self.generation_checked_at < KB_GENERATION_REFRESH_SECONDS:
+            return self.current_generation
+
+        try:
+            obj = self.s3_client.get_object(Bucket=self.bucket, Key=KB_GENERATION_KEY)
+            generation = str(json.loads(obj['Body'].read())['generation'])
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'NoSuchKey':
+                raise
+            generation = '0'
+
+        if generation != self.current_generation:
+            self.entries.clear()
+            self.current_generation = generation
+        self.generation_checked_at = now
+        return generation
+
+    def object_key(self, normalized):
+        digest = hashlib.sha256(f"{self.knowledge_base_id}\0{normalized}".encode('utf-8')).hexdigest()
+        return f"{KB_CACHE_PREFIX}{self.knowledge_base_id}/{self.generation()}/{digest}.json"
+
+    def remember(self, normalized, context, stored_at):
+        self.entries[normalized] = (context, stored_at)
+        self.entries.move_to_end(normalized)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def get(self, query, labels=None):
+        """Return cached context for the query, or None on a miss"""
+        normalized = normalize_kb_query(query, labels)
+        key = self.object_key(normalized)
+        now = time.time()
+
+        entry = self.entries.get(normalized)
+        if entry and now - entry[1] <= self.ttl_seconds:
+            self.entries.move_to_end(normalized)
+            self.stats['memory_hits'] += 1
+            return entry[0]
+
+        try:
+            obj = self.s3_client.get_object(Bucket=self.bucket, Key=key)
+            cached = json.loads(obj['Body'].read())
+            if now - cached['stored_at'] <= self.ttl_seconds:
+                self.remember(normalized, cached['context'], cached['stored_at'])
+                self.stats['s3_hits'] += 1
+                return cached['context']
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'NoSuchKey':
+                raise
+
+        self.stats['misses'] += 1
+        return None
+
+    def put(self, query, context, labels=None):
+        """Store context in the memory tier and in S3"""
+        self.persist(*self.put_memory(query, context, labels))
+
+    def put_memory(self, query, context, labels=None):
+        """Store context in the memory tier only; returns the arguments for persist()"""
+        normalized = normalize_kb_query(query, labels)
+        stored_at = time.time()
+        self.remember(normalized, context, stored_at)
+        return normalized, context, stored_at
+
+    def persist(self, normalized, context, stored_at):
+        """Write an entry to the persistent tier shared by all containers"""
+        self.s3_client.put_object(
+            Bucket=self.bucket,
+            Key=self.object_key(normalized),
+            Body=json.dumps({'query': normalized, 'context': context, 'stored_at': stored_at}),
+            ContentType='application/json'
+        )
+
+def invalidate(s3_client, bucket, generation=None):
+    """Start a new cache generation, e.g. after a Knowledge Base ingestion job completes"""
+    generation = generation or str(int(time.time()))
+    s3_client.put_object(
+        Bucket=bucket,
+        Key=KB_GENERATION_KEY,
+        Body=json.dumps({'generation': generation}),
+        ContentType='application/json'
+    )
+    return generation
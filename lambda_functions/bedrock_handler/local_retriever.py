@@ -0,0 +1,120 @@
+import json
+import math
+import os
+import re
+from collections import Counter
+
+# Off by default: enable only once kb_index.json is built from the real Knowledge Base export
+LOCAL_KB_ENABLED = os.environ.get('LOCAL_KB_ENABLED', 'false').lower() == 'true'
+# Packaged next to the handler by scripts/build_kb_index.py
+LOCAL_KB_INDEX_PATH = os.environ.get(
+    'LOCAL_KB_INDEX_PATH', os.path.join(os.path.dirname(__file__), 'kb_index.json')
+)
+# Below this confidence the remote Knowledge Base is queried instead
+LOCAL_KB_MIN_CONFIDENCE = float(os.environ.get('LOCAL_KB_MIN_CONFIDENCE', '0.6'))
+LOCAL_KB_TOP_K = 3
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset([
+    'a', 'an', 'the', 'is', 'are', 'am', 'was', 'be', 'my', 'i', 'me', 'it', 'its', 'to', 'of',
+    'and', 'or', 'on', 'in', 'for', 'with', 'if', 'at', 'by', 'this', 'that', 'not', 'do', 'does',
+    'please', 'can', 'you', 'help', 'what', 'how', 'why', 'there', 'has', 'have', 'after'
+])
+
+def tokenize(text):
+    """Lowercase word tokens with a light plural strip so 'cables' matches 'cable'"""
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        if len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+def build_index(documents):
+    """Build a BM25 index from [{'id', 'title', 'content'}] documents"""
+    docs = []
+    postings = {}
+    for doc_idx, document in enumerate(documents):
+        tokens = tokenize(f"{document['title']} {document['content']}")
+        docs.append({
+            'id': document['id'],
+            'title': document['title'],
+            'text': document['content'],
+            'length': len(tokens)
+        })
+        for term, tf in Counter(tokens).items():
+            postings.setdefault(term, []).append([doc_idx, tf])
+
+    n_docs = len(docs)
+    idf = {
+        term: math.log(1 + (n_docs - len(plist) + 0.5) / (len(plist) + 0.5))
+        for term, plist in postings.items()
+    }
+    return {
+        'version': 1,
+        'avgdl': sum(d['length'] for d in docs) / max(n_docs, 1),
+        'docs': docs,
+        'postings': postings,
+        'idf': idf
+    }
+
+class LocalRetriever:
+    """In-process BM25 retriever over the packaged troubleshooting documents"""
+
+    def __init__(self, index):
+        self.docs = index['docs']
+        self.postings = index['postings']
+        self.idf = index['idf']
+        self.avgdl = index['avgdl'] or 1.0
+        # Document length normalisation is fixed per document, so precompute it once
+        self.norms = [BM25_K1 * (1 - BM25_B + BM25_B * d['length'] / self.avgdl) for d in self.docs]
+
+    def search(self, query, top_k=LOCAL_KB_TOP_K):
+        """Return (results, confidence) where results are (score, doc) best first.
+
+        Confidence is the share of the query's IDF mass that the best document covers,
+        so a query with unknown or only generic terms scores low.
+        """
+        terms = set(tokenize(query))
+        scores = {}
+        matched_terms = {}
+        for term in terms:
+            plist = self.postings.get(term)
+            if not plist:
+                continue
+            idf = self.idf[term]
+            for doc_idx, tf in plist:
+                scores[doc_idx] = scores.get(doc_idx, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + self.norms[doc_idx])
+                matched_terms.setdefault(doc_idx, []).append(idf)
+
+        if not scores:
+            return [], 0.0
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+        # Query terms missing from the corpus count against confidence at the highest IDF
+        max_idf = max(self.idf.values())
+        query_mass = sum(self.idf.get(term, max_idf) for term in terms)
+        confidence = sum(matched_terms[ranked[0][0]]) / query_mass if query_mass else 0.0
+
+        return [(score, self.docs[doc_idx]) for doc_idx, score in ranked], round(confidence, 3)
+
+    def context_for(self, query, min_confidence=LOCAL_KB_MIN_CONFIDENCE):
+        """Return KB context text if the local index is confident enough, otherwise None"""
+        results, confidence = self.search(query)
+        if not results or confidence < min_confidence:
+            return None
+        best = results[0][0]
+        # Weak tail matches add prompt tokens without adding signal
+        return "\n".join(doc['text'] for score, doc in results if score >= best * 0.5)
+
+def load_local_retriever(path=LOCAL_KB_INDEX_PATH, enabled=LOCAL_KB_ENABLED):
+    """Load the packaged index once per container; returns None if disabled or no index is packaged"""
+    if not enabled or not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return LocalRetriever(json.load(f))
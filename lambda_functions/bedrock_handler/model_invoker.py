@@ -0,0 +1,166 @@
+import os
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, wait
+
+# Time kept back from the Lambda deadline for TTS, S3 writes and the response
+RESPONSE_RESERVE_SECONDS = float(os.environ.get('MODEL_RESPONSE_RESERVE_SECONDS', '10'))
+MODEL_MAX_SECONDS = float(os.environ.get('MODEL_MAX_SECONDS', '20'))
+# API Gateway gives up on the integration after 29s, whatever the Lambda timeout is
+API_GATEWAY_TIMEOUT_SECONDS = 29.0
+# Used when there is no Lambda context (local runs, tests)
+DEFAULT_DEADLINE_SECONDS = 20.0
+
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get('MODEL_BREAKER_FAILURES', '3'))
+BREAKER_RESET_SECONDS = float(os.environ.get('MODEL_BREAKER_RESET_SECONDS', '30'))
+
+HEDGE_ENABLED = os.environ.get('MODEL_HEDGE_ENABLED', 'false').lower() == 'true'
+# Hedge only once enough latencies are known for p95 to mean something
+HEDGE_MIN_SAMPLES = 20
+
+class ModelUnavailable(Exception):
+    """Raised instead of calling the model while its circuit breaker is open"""
+
+def deadline_seconds(context, api_started_at=None):
+    """Per-call model deadline derived from the Lambda's remaining execution time.
+
+    For requests through API Gateway, api_started_at is the time.monotonic() at which
+    the handler started; the deadline then also leaves room for the response within
+    the gateway's integration timeout, so the client gets the fallback and not a 504.
+    """
+    get_remaining = getattr(context, 'get_remaining_time_in_millis', None)
+    if get_remaining is None:
+        deadline = DEFAULT_DEADLINE_SECONDS
+    else:
+        deadline = min(MODEL_MAX_SECONDS, get_remaining() / 1000 - RESPONSE_RESERVE_SECONDS)
+    if api_started_at is not None:
+        elapsed = time.monotonic() - api_started_at
+        deadline = min(deadline, API_GATEWAY_TIMEOUT_SECONDS - elapsed - RESPONSE_RESERVE_SECONDS)
+    return max(1.0, deadline)
+
+class CircuitBreaker:
+    """Closed -> open after consecutive failures; one trial call is let through after the reset time"""
+
+    def __init__(self, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_seconds=BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return 'half_open'
+        return 'open'
+
+    def allow(self):
+        state = self.state
+        if state == 'closed':
+            return True
+        if state == 'half_open' and not self.trial_in_flight:
+            self.trial_in_flight = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.trial_in_flight = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+class LatencyTracker:
+    """Rolling window of successful call latencies in seconds"""
+
+    def __init__(self, size=100):
+        self.samples = deque(maxlen=size)
+
+    def record(self, seconds):
+        self.samples.append(seconds)
+
+    def p95(self):
+        if len(self.samples) < HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[int(0.95 * (len(ordered) - 1))]
+
+def call_with_deadline(executor, call, deadline, hedge_after=None):
+    """Run call() on the executor and return its result within deadline seconds.
+
+    If hedge_after is set and the first attempt is still running by then, a second
+    identical attempt is started and whichever succeeds first wins. Abandoned
+    attempts finish in the background; their results are ignored.
+    """
+    start = time.monotonic()
+    futures = [executor.submit(call)]
+    hedged = False
+    last_error = None
+
+    while futures:
+        remaining = deadline - (time.monotonic() - start)
+        if remaining <= 0:
+            break
+        timeout = remaining
+        if hedge_after is not None and not hedged:
+            timeout = min(remaining, max(0.0, hedge_after - (time.monotonic() - start)))
+
+        done, _ = wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+        for future in done:
+            futures.remove(future)
+            try:
+                return future.result()
+            except Exception as e:
+                last_error = e
+
+        if hedge_after is not None and not hedged and time.monotonic() - start >= hedge_after:
+            hedged = True
+            futures.append(executor.submit(call))
+        elif not futures and last_error is not None:
+            raise last_error
+
+    raise TimeoutError(f"Model call exceeded {deadline:.1f}s deadline")
+
+class ModelInvoker:
+    """Deadline, circuit breaker and optional hedging around Bedrock model calls, per model id"""
+
+    def __init__(self, executor, hedge_enabled=HEDGE_ENABLED):
+        self.executor = executor
+        self.hedge_enabled = hedge_enabled
+        self.breakers = {}
+        self.latencies = {}
+
+    def breaker(self, model_id):
+        return self.breakers.setdefault(model_id, CircuitBreaker())
+
+    def invoke(self, model_id, call, deadline=None):
+        """Return call()'s result, raising ModelUnavailable while the model's breaker is open.
+
+        Without a deadline the call runs inline (used for streaming, which manages its own
+        pacing) and only the breaker applies.
+        """
+        breaker = self.breaker(model_id)
+        if not breaker.allow():
+            raise ModelUnavailable(f"Circuit open for {model_id}")
+
+        latencies = self.latencies.setdefault(model_id, LatencyTracker())
+        start = time.monotonic()
+        try:
+            if deadline is None:
+                result = call()
+            else:
+                hedge_after = latencies.p95() if self.hedge_enabled else None
+                result = call_with_deadline(self.executor, call, deadline, hedge_after)
+        except Exception:
+            breaker.record_failure()
+            raise
+        breaker.record_success()
+        if deadline is not None:
+            latencies.record(time.monotonic() - start)
+        return result
@@ -0,0 +1,93 @@
+import os
+import re
+
+LARGE_MODEL_ID = os.environ.get('LARGE_MODEL_ID', 'openai.gpt-oss-120b-1:0')
+SMALL_MODEL_ID = os.environ.get('SMALL_MODEL_ID', 'openai.gpt-oss-20b-1:0')
+
+# Longer questions usually carry detail a canned answer would ignore
+TEMPLATE_MAX_WORDS = 12
+
+TIER_TEMPLATE = 'template'
+TIER_SMALL = 'small'
+TIER_LARGE = 'large'
+
+# Well-known intents: (name, pattern matched against the query and on-screen text, answer)
+INTENT_TEMPLATES = [
+    ('no_signal', re.compile(r'\bno signal\b'),
+     "It looks like your TV is not receiving a picture from the set-top box. "
+     "1. Make sure the set-top box is powered on. "
+     "2. Check that the HDMI cable is firmly connected to both the set-top box and the TV. "
+     "3. Use your TV remote to select the correct HDMI input. "
+     "If the screen still shows No Signal, restart the set-top box by unplugging it for 30 seconds."),
+    ('overdue_bill', re.compile(r'\b(overdue|unpaid|outstanding)\b.*\bbill|\bbill\b.*\b(overdue|unpaid|outstanding)\b|\bpay (my|the) bill\b'),
+     "Channels can stop working when a bill is overdue. "
+     "1. Check your subscription status and outstanding balance in the Unifi app. "
+     "2. Pay the overdue amount through the app, online banking or card. "
+     "3. Service is restored automatically within a few hours of payment. "
+     "If channels are still blocked after that, restart your set-top box."),
+    ('restart', re.compile(r'\b(restart|reboot)\b'),
+     "To restart your Unifi TV set-top box: "
+     "1. Unplug the power cable from the set-top box. "
+     "2. Wait 30 seconds, then plug it back in. "
+     "3. Wait for the front light to turn on and the home screen to load. "
+     "If the problem continues after the restart, let us know what you see on screen."),
+]
+
+# Negated or already-tried requests ("restart didn't fix it", "already restarted, still no signal")
+# mean the canned steps have failed or do not apply, so they need a model answer
+NOT_TEMPLATE_PATTERN = re.compile(
+    r"\b(not|never|cannot|already|still|again|tried|even after|despite|anymore"
+    r"|dont|cant|didnt|wont|isnt|doesnt)\b|n['’]t\b"
+)
+
+def match_intent(text):
+    text = text.lower()
+    for name, pattern, template in INTENT_TEMPLATES:
+        if pattern.search(text):
+            return name, template
+    return None, None
+
+def template_for(query):
+    """Return (intent, template) if the query alone is a short, well-known request"""
+    if len(query.split()) > TEMPLATE_MAX_WORDS or NOT_TEMPLATE_PATTERN.search(query.lower()):
+        return None, None
+    return match_intent(query)
+
+def is_template_candidate(query):
+    """Cheap text-only check used to defer KB retrieval before image analysis arrives"""
+    return template_for(query)[0] is not None
+
+def route(query, analysis_data, complexity):
+    """Pick a tier for the request.
+
+    Returns {'tier', 'intent', 'model_id', 'template'}; template is set only for the
+    template tier, model_id only for the model tiers.
+    """
+    intent, template = template_for(query) if complexity == 'simple' else (None, None)
+    if intent:
+        # On-screen text that points at a different problem needs a real answer
+        screen_text = ' '.join(analysis_data.get('extracted_text', []))
+        screen_intent = match_intent(screen_text)[0] if screen_text else None
+        if screen_intent in (None, intent):
+            return {'tier': TIER_TEMPLATE, 'intent': intent, 'model_id': None, 'template': template}
+
+    if complexity == 'simple':
+        return {'tier': TIER_SMALL, 'intent': intent, 'model_id': SMALL_MODEL_ID, 'template': None}
+    return {'tier': TIER_LARGE, 'intent': intent, 'model_id': LARGE_MODEL_ID, 'template': None}
+
+class TierStats:
+    """Per-container request count and latency per routing tier"""
+
+    def __init__(self):
+        self.tiers = {}
+
+    def record(self, tier, elapsed_ms):
+        stats = self.tiers.setdefault(tier, {'count': 0, 'total_ms': 0.0})
+        stats['count'] += 1
+        stats['total_ms'] += elapsed_ms
+
+    def summary(self):
+        return {
+            tier: {'count': s['count'], 'avg_ms': round(s['total_ms'] / s['count'], 1)}
+            for tier, s in self.tiers.items()
+        }
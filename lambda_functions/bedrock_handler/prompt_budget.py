@@ -0,0 +1,68 @@
+import math
+import re
+
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+
+# Per-section token budgets for build_adaptive_prompt
+SECTION_BUDGETS = {
+    'query': 200,
+    'labels': 40,
+    'extracted_text': 120,
+    'custom_labels': 40,
+    'kb_context': {'simple': 400, 'complex': 800},
+}
+MAX_LABELS = 8
+# Token-set overlap above which two chunks or lines count as the same content
+NEAR_DUPLICATE_JACCARD = 0.8
+
+def count_tokens(text):
+    """Estimate BPE tokens: one per punctuation mark, one per ~4 characters of each word"""
+    return sum(max(1, math.ceil(len(piece) / 4)) for piece in TOKEN_PATTERN.findall(text))
+
+def truncate_to_tokens(text, budget):
+    """Cut text at a word boundary so it fits the budget, marking the cut with an ellipsis"""
+    if count_tokens(text) <= budget:
+        return text
+    used = 0
+    for match in TOKEN_PATTERN.finditer(text):
+        used += max(1, math.ceil(len(match.group()) / 4))
+        if used > budget - 1:
+            return text[:match.start()].rstrip() + '…'
+    return text
+
+def dedupe_near_duplicates(items):
+    """Drop items whose word set nearly matches an earlier item, keeping the first occurrence"""
+    kept = []
+    kept_sets = []
+    for item in items:
+        words = set(WORD_PATTERN.findall(item.lower()))
+        if not words:
+            continue
+        if any(len(words & other) / len(words | other) >= NEAR_DUPLICATE_JACCARD for other in kept_sets):
+            continue
+        kept.append(item)
+        kept_sets.append(words)
+    return kept
+
+def fit_items(items, budget, separator_tokens=1):
+    """Keep items in order while they fit the budget; the first item is truncated if it alone does not"""
+    kept = []
+    used = 0
+    for item in items:
+        tokens = count_tokens(item) + separator_tokens
+        if used + tokens > budget:
+            if not kept:
+                kept.append(truncate_to_tokens(item, budget - separator_tokens))
+            break
+        kept.append(item)
+        used += tokens
+    return kept
+
+def rank_label_names(labels, limit=MAX_LABELS):
+    """Unique label names ordered by confidence, highest first"""
+    names = []
+    for label in sorted(labels, key=lambda l: l.get('Confidence', 0), reverse=True):
+        if label['Name'] not in names:
+            names.append(label['Name'])
+    return names[:limit]
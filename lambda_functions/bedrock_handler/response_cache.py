@@ -0,0 +1,117 @@
+import math
+import os
+import re
+import time
+import zlib
+from collections import OrderedDict
+
+RESPONSE_CACHE_TTL_SECONDS = int(os.environ.get('RESPONSE_CACHE_TTL_SECONDS', '3600'))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', '256'))
+RESPONSE_CACHE_SIMILARITY = float(os.environ.get('RESPONSE_CACHE_SIMILARITY', '0.85'))
+
+# Hashed feature space for the local text embedding
+EMBEDDING_DIMENSIONS = 4096
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+STOPWORDS = frozenset([
+    'a', 'an', 'the', 'is', 'are', 'am', 'was', 'be', 'my', 'i', 'me', 'it', 'its', 'to', 'of',
+    'and', 'or', 'on', 'in', 'for', 'with', 'please', 'can', 'you', 'help', 'hi', 'hello', 'this',
+    'that', 'there', 'do', 'does', 'just', 'so'
+])
+
+def normalize_query(text):
+    """Lowercase, drop punctuation and collapse whitespace"""
+    return ' '.join(TOKEN_PATTERN.findall(text.lower()))
+
+def context_signature(analysis_data):
+    """Order-independent signature of the Rekognition labels and extracted text"""
+    labels = [l['Name'].lower() for l in analysis_data.get('labels', [])]
+    labels += [l['Name'].lower() for l in analysis_data.get('custom_labels', [])]
+    lines = [normalize_query(t) for t in analysis_data.get('extracted_text', [])]
+    return (frozenset(labels), frozenset(line for line in lines if line))
+
+def embed(normalized_text):
+    """Hashing-vectorizer embedding of word unigrams and bigrams, L2 normalized (sparse dict)"""
+    words = [w for w in normalized_text.split() if w not in STOPWORDS]
+    features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+    vector = {}
+    for feature in features:
+        bucket = zlib.crc32(feature.encode('utf-8')) % EMBEDDING_DIMENSIONS
+        vector[bucket] = vector.get(bucket, 0.0) + 1.0
+
+    norm = math.sqrt(sum(v * v for v in vector.values()))
+    if norm:
+        for bucket in vector:
+            vector[bucket] /= norm
+    return vector
+
+def cosine(a, b):
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(value * b.get(bucket, 0.0) for bucket, value in a.items())
+
+class ResponseCache:
+    """In-process cache of model answers for near-duplicate questions.
+
+    Exact tier: normalized query + image context signature.
+    Similarity tier: same image context and cosine similarity of the query embeddings
+    at or above the threshold. Entries expire after the TTL and are evicted LRU.
+    """
+
+    def __init__(self, ttl_seconds=RESPONSE_CACHE_TTL_SECONDS, max_entries=RESPONSE_CACHE_MAX_ENTRIES,
+                 threshold=RESPONSE_CACHE_SIMILARITY):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.entries = OrderedDict()
+        self.stats = {'exact_hits': 0, 'similar_hits': 0, 'misses': 0}
+
+    def expire(self, now):
+        for key in [k for k, entry in self.entries.items() if now - entry['stored_at'] > self.ttl_seconds]:
+            del self.entries[key]
+
+    def best_match(self, query, signature=None):
+        """Return (key, similarity) of the closest live entry, optionally restricted to one image context"""
+        normalized = normalize_query(query)
+        if signature is not None and (normalized, signature) in self.entries:
+            return (normalized, signature), 1.0
+
+        vector = embed(normalized)
+        best_key, best_score = None, 0.0
+        for key, entry in self.entries.items():
+            if signature is not None and key[1] != signature:
+                continue
+            score = 1.0 if key[0] == normalized else cosine(vector, entry['vector'])
+            if score > best_score:
+                best_key, best_score = key, score
+        return best_key, best_score
+
+    def has_candidate(self, query):
+        """Whether any cached answer is close to query, regardless of image context"""
+        self.expire(time.time())
+        return self.best_match(query)[1] >= self.threshold
+
+    def lookup(self, query, analysis_data):
+        """Return the cached answer for query and image context, or None"""
+        self.expire(time.time())
+        key, score = self.best_match(query, context_signature(analysis_data))
+        if key is None or score < self.threshold:
+            self.stats['misses'] += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.stats['exact_hits' if key[0] == normalize_query(query) else 'similar_hits'] += 1
+        return self.entries[key]['response']
+
+    def store(self, query, analysis_data, response):
+        normalized = normalize_query(query)
+        key = (normalized, context_signature(analysis_data))
+        self.entries[key] = {
+            'vector': embed(normalized),
+            'response': response,
+            'stored_at': time.time()
+        }
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
@@ -0,0 +1,182 @@
+import json
+import re
+import time
+
+REASONING_OPEN = '<reasoning>'
+REASONING_CLOSE = '</reasoning>'
+
+# Sentence terminator followed by whitespace; digits before '.' are list markers, not sentence ends
+SENTENCE_END = re.compile(r'(?<!\d)[.!?](?=\s)|\n')
+
+# Very short sentences are merged so Polly is not called for every "Okay."
+MIN_SENTENCE_CHARS = 40
+
+def partial_tag_length(text, tag):
+    """Length of the longest suffix of text that is a proper prefix of tag"""
+    for size in range(min(len(tag) - 1, len(text)), 0, -1):
+        if text.endswith(tag[:size]):
+            return size
+    return 0
+
+class ReasoningFilter:
+    """Incrementally drop <reasoning>...</reasoning> blocks from streamed model text.
+
+    Tags may be split across stream chunks, so any suffix that could still become
+    a tag is held back until the next chunk arrives.
+    """
+
+    def __init__(self):
+        self.inside = False
+        self.pending = ''
+
+    def feed(self, text):
+        self.pending += text
+        visible = []
+        while self.pending:
+            tag = REASONING_CLOSE if self.inside else REASONING_OPEN
+            idx = self.pending.find(tag)
+            if idx >= 0:
+                if not self.inside:
+                    visible.append(self.pending[:idx])
+                self.pending = self.pending[idx + len(tag):]
+                self.inside = not self.inside
+                continue
+
+            keep = partial_tag_length(self.pending, tag)
+            if not self.inside:
+                visible.append(self.pending[:len(self.pending) - keep])
+            self.pending = self.pending[len(self.pending) - keep:]
+            break
+        return ''.join(visible)
+
+    def flush(self):
+        # An unterminated reasoning block is never shown to the customer
+        text = '' if self.inside else self.pending
+        self.pending = ''
+        return text
+
+class SentenceSplitter:
+    """Accumulate streamed text and return complete sentences as soon as they end"""
+
+    def __init__(self, min_chars=MIN_SENTENCE_CHARS):
+        self.min_chars = min_chars
+        self.buffer = ''
+        self.scan_from = 0
+
+    def feed(self, text):
+        self.buffer += text
+        sentences = []
+        while True:
+            match = SENTENCE_END.search(self.buffer, self.scan_from)
+            if not match:
+                break
+            end = match.end()
+            if len(self.buffer[:end].strip()) < self.min_chars:
+                self.scan_from = end
+                continue
+            sentences.append(self.buffer[:end].strip())
+            self.buffer = self.buffer[end:]
+            self.scan_from = 0
+        return sentences
+
+    def flush(self):
+        text = self.buffer.strip()
+        self.buffer = ''
+        self.scan_from = 0
+        return [text] if text else []
+
+def stream_model_text(bedrock_runtime, model_id, request):
+    """Yield customer-visible text deltas from invoke_model_with_response_stream"""
+    response = bedrock_runtime.invoke_model_with_response_stream(modelId=model_id, body=request)
+    reasoning = ReasoningFilter()
+
+    try:
+        for event in response['body']:
+            chunk = event.get('chunk')
+            if not chunk:
+                continue
+            payload = json.loads(chunk['bytes'])
+            for choice in payload.get('choices', []):
+                delta = (choice.get('delta') or {}).get('content')
+                if delta:
+                    visible = reasoning.feed(delta)
+                    if visible:
+                        yield visible
+    finally:
+        # Abandoning the generator early (e.g. on a deadline) releases the connection
+        close = getattr(response['body'], 'close', None)
+        if close is not None:
+            close()
+
+    tail = reasoning.flush()
+    if tail:
+        yield tail
+
+class SpeechPipeline:
+    """Synthesize sentences concurrently and emit finished audio chunks in order.
+
+    synthesize(index, text) runs on the executor and returns the chunk's audio bytes;
+    on_chunk(index, text, audio) is called on the caller's thread, strictly in order.
+    """
+
+    def __init__(self, executor, synthesize, on_chunk):
+        self.executor = executor
+        self.synthesize = synthesize
+        self.on_chunk = on_chunk
+        self.chunks = []
+        self.emitted = 0
+        self.started = time.perf_counter()
+        self.first_audio_ms = None
+
+    def add(self, text):
+        index = len(self.chunks)
+        self.chunks.append((text, self.executor.submit(self.synthesize, index, text)))
+
+    def drain(self, wait=False, timeout=None):
+        """Emit every chunk whose audio is ready, blocking on them only if wait is set.
+
+        A timeout in seconds bounds the whole wait and raises TimeoutError when exceeded.
+        """
+        until = None if timeout is None else time.perf_counter() + timeout
+        while self.emitted < len(self.chunks):
+            text, future = self.chunks[self.emitted]
+            if not wait and not future.done():
+                break
+            audio = future.result(None if until is None else max(0.0, until - time.perf_counter()))
+            if self.first_audio_ms is None:
+                self.first_audio_ms = round((time.perf_counter() - self.started) * 1000, 1)
+            self.on_chunk(self.emitted, text, audio)
+            self.emitted += 1
+
+    def finish(self, timeout=None):
+        self.drain(wait=True, timeout=timeout)
+        return [future.result() for _, future in self.chunks]
+
+def stream_and_speak(text_deltas, pipeline, deadline=None):
+    """Feed model text into the sentence splitter and queue each sentence for synthesis.
+
+    With a deadline in seconds, the stream is abandoned and TimeoutError raised once it
+    passes; it is checked as each delta arrives and bounds the wait for the last audio.
+    """
+    splitter = SentenceSplitter()
+    parts = []
+
+    def remaining():
+        return None if deadline is None else deadline - (time.perf_counter() - pipeline.started)
+
+    for delta in text_deltas:
+        if deadline is not None and remaining() <= 0:
+            close = getattr(text_deltas, 'close', None)
+            if close is not None:
+                close()
+            raise TimeoutError(f"Model stream exceeded {deadline:.1f}s deadline")
+        parts.append(delta)
+        for sentence in splitter.feed(delta):
+            pipeline.add(sentence)
+        pipeline.drain()
+
+    for sentence in splitter.flush():
+        pipeline.add(sentence)
+    audio_chunks = pipeline.finish(None if deadline is None else max(0.0, remaining()))
+
+    return ''.join(parts).strip(), audio_chunks
@@ -0,0 +1,74 @@
+import os
+import re
+
+VOICE_ID = 'Joanna'
+OUTPUT_FORMAT = 'mp3'
+
+# Polly rejects plain text over 3000 characters; stay well under it
+POLLY_MAX_CHARS = 2500
+# Smaller chunks synthesize in parallel, so long answers finish in about one chunk's time
+TTS_CHUNK_CHARS = min(int(os.environ.get('TTS_CHUNK_CHARS', '800')), POLLY_MAX_CHARS)
+
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?])\s+|\n+')
+
+def split_for_polly(text, max_chars=TTS_CHUNK_CHARS):
+    """Split text into chunks under max_chars, breaking at sentence boundaries where possible"""
+    chunks = []
+    current = ''
+
+    for sentence in SENTENCE_BOUNDARY.split(text.strip()):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+
+        # A single sentence longer than the limit is broken at word boundaries
+        while len(sentence) > max_chars:
+            cut = sentence.rfind(' ', 0, max_chars)
+            if cut <= 0:
+                cut = max_chars
+            if current:
+                chunks.append(current)
+                current = ''
+            chunks.append(sentence[:cut].strip())
+            sentence = sentence[cut:].strip()
+
+        if current and len(current) + 1 + len(sentence) > max_chars:
+            chunks.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}" if current else sentence
+
+    if current:
+        chunks.append(current)
+    return chunks
+
+def strip_id3(audio):
+    """Drop a leading ID3v2 tag so MP3 chunks can be concatenated frame to frame"""
+    if len(audio) >= 10 and audio[:3] == b'ID3':
+        size = (audio[6] << 21) | (audio[7] << 14) | (audio[8] << 7) | audio[9]
+        return audio[10 + size:]
+    return audio
+
+def synthesize_speech(polly_client, text):
+    """Synthesize a single chunk of text and return the MP3 bytes"""
+    response = polly_client.synthesize_speech(
+        Text=text,
+        OutputFormat=OUTPUT_FORMAT,
+        VoiceId=VOICE_ID
+    )
+    return response['AudioStream'].read()
+
+def join_mp3(chunks):
+    """Concatenate MP3 chunks without re-encoding"""
+    if not chunks:
+        return b''
+    return chunks[0] + b''.join(strip_id3(chunk) for chunk in chunks[1:])
+
+def synthesize_long_text(polly_client, executor, text):
+    """Synthesize arbitrarily long text as concurrent sentence-aligned chunks joined into one MP3"""
+    chunks = split_for_polly(text)
+    if len(chunks) <= 1:
+        return synthesize_speech(polly_client, text)
+
+    futures = [executor.submit(synthesize_speech, polly_client, chunk) for chunk in chunks]
+    return join_mp3([future.result() for future in futures])
@@ -0,0 +1,82 @@
+import hashlib
+import os
+from collections import OrderedDict
+from botocore.exceptions import ClientError
+
+import tts
+
+TTS_CACHE_PREFIX = 'tts-cache/'
+TTS_CACHE_MAX_ENTRIES = int(os.environ.get('TTS_CACHE_MAX_ENTRIES', '512'))
+
+def cache_key(text, voice_id=tts.VOICE_ID, output_format=tts.OUTPUT_FORMAT):
+    """Content-addressed S3 key for the audio of (text, voice, format)"""
+    digest = hashlib.sha256(f"{voice_id}\0{output_format}\0{text}".encode('utf-8')).hexdigest()
+    return f"{TTS_CACHE_PREFIX}{digest}.{output_format}"
+
+def digest_from_key(key):
+    return key[len(TTS_CACHE_PREFIX):].rsplit('.', 1)[0]
+
+class TTSCache:
+    """Two-level TTS cache: an in-memory LRU of keys known to exist, backed by tts-cache/ in S3.
+
+    Audio is stored once per distinct text and sessions reference the shared object,
+    so a hit costs no Polly call and no S3 write.
+    """
+
+    def __init__(self, s3_client, bucket, max_entries=TTS_CACHE_MAX_ENTRIES):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.max_entries = max_entries
+        self.known = OrderedDict()
+        self.stats = {'memory_hits': 0, 's3_hits': 0, 'misses': 0}
+
+    def remember(self, key):
+        self.known[key] = True
+        self.known.move_to_end(key)
+        while len(self.known) > self.max_entries:
+            self.known.popitem(last=False)
+
+    def exists_in_s3(self, key):
+        try:
+            self.s3_client.head_object(Bucket=self.bucket, Key=key)
+            return True
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+
+    def store(self, text, audio):
+        """Write audio for text into the shared cache and return its key"""
+        key = cache_key(text)
+        self.s3_client.put_object(
+            Bucket=self.bucket,
+            Key=key,
+            Body=audio,
+            ContentType='audio/mpeg',
+            # Content-addressed objects never change
+            CacheControl='max-age=31536000, immutable'
+        )
+        self.remember(key)
+        return key
+
+    def get_or_create(self, text, synthesize):
+        """Return (key, source) for text, calling synthesize(text) only on a miss"""
+        key = cache_key(text)
+        if key in self.known:
+            self.known.move_to_end(key)
+            self.stats['memory_hits'] += 1
+            return key, 'memory'
+
+        if self.exists_in_s3(key):
+            self.remember(key)
+            self.stats['s3_hits'] += 1
+            return key, 's3'
+
+        self.stats['misses'] += 1
+        return self.store(text, synthesize(text)), 'miss'
+
+    def hit_rate(self):
+        lookups = sum(self.stats.values())
+        if not lookups:
+            return 0.0
+        return round((self.stats['memory_hits'] + self.stats['s3_hits']) / lookups, 3)
@@ -0,0 +1,33 @@
+SCHEMA_VERSION = 2
+
+# LINE detections below this confidence are too noisy to quote in a troubleshooting prompt
+TEXT_LINE_CONFIDENCE = 80
+
+def extract_text(text_detections):
+    """High-confidence LINE text, in reading order; WORD detections repeat the same text"""
+    return [
+        detection['DetectedText'] for detection in text_detections
+        if detection['Type'] == 'LINE' and detection['Confidence'] > TEXT_LINE_CONFIDENCE
+    ]
+
+def compact_labels(labels):
+    """Name and confidence only; instances, parents, aliases and categories are never read downstream"""
+    return [{'Name': label['Name'], 'Confidence': round(label.get('Confidence', 0), 1)} for label in labels]
+
+def project(results, metadata, debug=False):
+    """image_analysis.json (schema v2) from raw Rekognition results and per-request metadata.
+
+    v1 stored the raw text_detections and full label objects. v2 keeps the fields
+    bedrock_handler reads (labels and custom_labels Name/Confidence, extracted_text);
+    the raw results are kept under 'raw' only when debug is set.
+    """
+    analysis = {
+        'schema_version': SCHEMA_VERSION,
+        'labels': compact_labels(results.get('labels', [])),
+        'custom_labels': compact_labels(results.get('custom_labels', [])),
+        'extracted_text': extract_text(results.get('text_detections', []))
+    }
+    analysis.update(metadata)
+    if debug:
+        analysis['raw'] = results
+    return analysis
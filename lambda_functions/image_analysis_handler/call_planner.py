@@ -0,0 +1,160 @@
+import io
+import os
+import re
+from analysis_schema import TEXT_LINE_CONFIDENCE
+
+try:
+    from PIL import Image
+except ImportError:
+    # Without Pillow the planner decides from aspect ratio and transcript alone
+    Image = None
+
+PLAN_SCREEN = 'screen'
+PLAN_DEVICE = 'device'
+PLAN_FULL = 'full'
+
+IMAGE_CALL_PLANNER = os.environ.get('IMAGE_CALL_PLANNER', 'true').lower() == 'true'
+# Combined signal score a scene needs, and its lead over the other scene, before calls are skipped
+PLAN_MIN_SCORE = float(os.environ.get('PLAN_MIN_SCORE', '1.5'))
+PLAN_MIN_MARGIN = 1.0
+# Custom label confidence that settles a device photo on its own
+PLAN_CUSTOM_LABEL_CONFIDENCE = float(os.environ.get('PLAN_CUSTOM_LABEL_CONFIDENCE', '85'))
+
+SCREEN_KEYWORDS = {
+    'screen', 'tv', 'television', 'display', 'error', 'code', 'message', 'says', 'shows',
+    'showing', 'signal', 'channel', 'popup', 'app', 'decoder', 'stb', 'unifi tv'
+}
+DEVICE_KEYWORDS = {
+    'router', 'modem', 'ont', 'light', 'lights', 'led', 'blinking', 'blink', 'red', 'orange',
+    'cable', 'port', 'plug', 'wire', 'box', 'los', 'pon', 'antenna'
+}
+# Widescreen TVs and phone screenshots; camera photos are 4:3 or close to it
+SCREEN_ASPECT_RATIO = 1.6
+
+# Hand-set weights for the pixel classifier over features of a 32x32 grayscale thumbnail.
+# Screens with messages are dark or flat backgrounds with sharp bright strokes; device
+# photos are mid-toned with softer edges.
+CLASSIFIER_WEIGHTS = {'dark': 2.0, 'bright': 1.0, 'contrast': 2.0, 'edges': 3.0, 'midtone': -2.0}
+CLASSIFIER_BIAS = -1.2
+# The classifier only votes when it is this far from the decision boundary
+CLASSIFIER_MIN_MARGIN = 0.5
+
+def keyword_hits(text, keywords):
+    words = re.findall(r"[a-z]+", (text or '').lower())
+    joined = ' '.join(words)
+    return sum(1 for keyword in keywords if (keyword in joined if ' ' in keyword else keyword in words))
+
+def image_features(image_bytes):
+    """Brightness and edge statistics of a 32x32 grayscale thumbnail, each in [0, 1]"""
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        pixels = list(image.convert('L').resize((32, 32)).getdata())
+    count = len(pixels)
+    mean = sum(pixels) / count
+    variance = sum((p - mean) ** 2 for p in pixels) / count
+    edges = sum(
+        1 for row in range(32) for col in range(31)
+        if abs(pixels[row * 32 + col] - pixels[row * 32 + col + 1]) > 48
+    )
+    return {
+        'dark': sum(1 for p in pixels if p < 40) / count,
+        'bright': sum(1 for p in pixels if p > 215) / count,
+        'midtone': sum(1 for p in pixels if 80 <= p <= 175) / count,
+        'contrast': min(1.0, variance ** 0.5 / 128),
+        'edges': edges / (32 * 31)
+    }
+
+def classify_screen(features):
+    """Linear screen-vs-device score; positive means screen"""
+    return CLASSIFIER_BIAS + sum(CLASSIFIER_WEIGHTS[name] * value for name, value in features.items())
+
+class CallPlanner:
+    """Chooses which Rekognition calls an image needs, and in what order, from cheap signals.
+
+    A plan is a list of stages; calls within a stage run concurrently and later stages
+    only run when the earlier ones did not gather enough signal. Per-plan call counts
+    and latencies accumulate in stats for the lifetime of the container.
+    """
+
+    def __init__(self, enabled=IMAGE_CALL_PLANNER):
+        self.enabled = enabled
+        self.stats = {}
+
+    def signals(self, preprocessing=None, transcript=None, image_bytes=None):
+        """Scene scores from aspect ratio, transcript keywords and the pixel classifier"""
+        scores = {PLAN_SCREEN: 0.0, PLAN_DEVICE: 0.0}
+        reasons = []
+
+        width, height = (preprocessing or {}).get('width'), (preprocessing or {}).get('height')
+        if width and height:
+            aspect = max(width, height) / min(width, height)
+            if aspect >= SCREEN_ASPECT_RATIO:
+                scores[PLAN_SCREEN] += 1.0
+                reasons.append(f"aspect {aspect:.2f}")
+
+        for plan, keywords in ((PLAN_SCREEN, SCREEN_KEYWORDS), (PLAN_DEVICE, DEVICE_KEYWORDS)):
+            hits = keyword_hits(transcript, keywords)
+            if hits:
+                scores[plan] += min(hits, 2)
+                reasons.append(f"{hits} {plan} keyword(s)")
+
+        if Image is not None and image_bytes is not None:
+            try:
+                score = classify_screen(image_features(image_bytes))
+                if abs(score) >= CLASSIFIER_MIN_MARGIN:
+                    scores[PLAN_SCREEN if score > 0 else PLAN_DEVICE] += 1.0
+                    reasons.append(f"classifier {score:+.2f}")
+            except Exception as e:
+                print(f"Image classifier failed: {e}")
+
+        return {'scores': scores, 'reasons': reasons}
+
+    def plan(self, signals, available_calls):
+        """Return (plan name, stages of call names) restricted to the calls that are configured"""
+        available = [name for name in ('custom_labels', 'labels', 'text_detections') if name in available_calls]
+        name = PLAN_FULL
+        if self.enabled:
+            scores = signals['scores']
+            best = max(scores, key=scores.get)
+            other = PLAN_DEVICE if best == PLAN_SCREEN else PLAN_SCREEN
+            if scores[best] >= PLAN_MIN_SCORE and scores[best] - scores[other] >= PLAN_MIN_MARGIN:
+                name = best
+
+        if name == PLAN_SCREEN:
+            # The error message on screen is what matters; labels only if no text was read
+            stages = [['text_detections'], ['labels', 'custom_labels']]
+        elif name == PLAN_DEVICE and 'custom_labels' in available:
+            # The trained model knows the router states; generic calls only if it is unsure
+            stages = [['custom_labels'], ['labels', 'text_detections']]
+        else:
+            stages = [available]
+
+        stages = [[call for call in stage if call in available] for stage in stages]
+        return name, [stage for stage in stages if stage]
+
+    def enough(self, plan_name, results):
+        """Whether the results so far carry enough signal to skip the remaining stages"""
+        if plan_name == PLAN_SCREEN:
+            return any(
+                detection['Type'] == 'LINE' and detection['Confidence'] > TEXT_LINE_CONFIDENCE
+                for detection in results.get('text_detections', [])
+            )
+        if plan_name == PLAN_DEVICE:
+            return any(
+                label['Confidence'] >= PLAN_CUSTOM_LABEL_CONFIDENCE
+                for label in results.get('custom_labels', [])
+            )
+        return False
+
+    def record(self, plan_name, calls_made, latency_ms, early_exit):
+        """Accumulate per-plan stats; returns the running summary for this plan"""
+        stats = self.stats.setdefault(plan_name, {'requests': 0, 'calls': 0, 'early_exits': 0, 'total_ms': 0.0})
+        stats['requests'] += 1
+        stats['calls'] += calls_made
+        stats['early_exits'] += int(early_exit)
+        stats['total_ms'] += latency_ms
+        return {
+            'requests': stats['requests'],
+            'avg_calls': round(stats['calls'] / stats['requests'], 2),
+            'avg_ms': round(stats['total_ms'] / stats['requests'], 1),
+            'early_exit_rate': round(stats['early_exits'] / stats['requests'], 2)
+        }
@@ -2,16 +2,44 @@ import json
 import boto3
 import os
 import re
+import time
 import logging
+from concurrent.futures import ThreadPoolExecutor, wait
+from botocore.config import Config
+from botocore.exceptions import ClientError
+import analysis_schema
+import call_planner
+import image_cache
+import image_preprocess
 
 # Configure logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-rekognition_client = boto3.client('rekognition')
+# One deadline shared by all Rekognition calls of a request
+REKOGNITION_DEADLINE_SECONDS = float(os.environ.get('REKOGNITION_DEADLINE_SECONDS', '10'))
+# Time kept back from the Lambda deadline for storing results
+RESPONSE_RESERVE_SECONDS = 3
+
+# A single attempt whose socket timeout matches the deadline, so a call abandoned by
+# run_rekognition_calls gives its worker back shortly after the request that made it
+rekognition_client = boto3.client('rekognition', config=Config(
+    connect_timeout=3, read_timeout=REKOGNITION_DEADLINE_SECONDS, retries={'max_attempts': 1}
+))
 s3_client = boto3.client('s3')
 BUCKET_NAME = os.environ['STORAGE_BUCKET']
 REKOGNITION_PROJECT_ARN = os.environ.get('REKOGNITION_PROJECT_ARN')
+KEEP_ORIGINAL_IMAGE = os.environ.get('KEEP_ORIGINAL_IMAGE', 'false').lower() == 'true'
+# Also store the raw Rekognition responses in image_analysis.json (requests can opt in with "debug": true)
+IMAGE_ANALYSIS_DEBUG = os.environ.get('IMAGE_ANALYSIS_DEBUG', 'false').lower() == 'true'
+
+# Reused across warm invocations; boto3 clients are safe to share between threads.
+# Three calls per request, with room for the abandoned calls of the two requests before it
+rekognition_executor = ThreadPoolExecutor(max_workers=9)
+# S3 reads never queue behind Rekognition calls
+io_executor = ThreadPoolExecutor(max_workers=2)
+analysis_cache = image_cache.AnalysisCache(s3_client, BUCKET_NAME, REKOGNITION_PROJECT_ARN)
+planner = call_planner.CallPlanner()
 
 def sanitize_session_id(session_id):
     """Sanitize session_id to prevent path traversal attacks"""
@@ -20,6 +48,167 @@ def sanitize_session_id(session_id):
         raise ValueError("Invalid session ID format")
     return session_id
 
+def preprocess_session_image(session_id, image_key):
+    """Rewrite the session image in place with its normalized version; returns (report, image bytes, ETag).
+
+    Only the header is read first. Images that would not change (no Pillow to resize
+    with and no JPEG metadata to strip) are analysed as uploaded: image bytes is None
+    and the ETag of the stored object identifies the image instead.
+    """
+    head = s3_client.get_object(Bucket=BUCKET_NAME, Key=image_key, Range=f"bytes=0-{image_preprocess.HEADER_BYTES - 1}")
+    header = head['Body'].read()
+    # 'bytes 0-65535/1234567': the total size follows the slash
+    content_range = head.get('ContentRange') or ''
+    total_bytes = int(content_range.rsplit('/', 1)[1]) if '/' in content_range else None
+    
+    if not image_preprocess.needs_normalizing(header):
+        report = image_preprocess.passthrough_report(header, total_bytes)
+        content_type = image_preprocess.CONTENT_TYPES.get(report['source_format'])
+        if content_type and head.get('ContentType') != content_type:
+            # e.g. a PNG screenshot uploaded as image.jpg: relabel it without moving the bytes
+            s3_client.copy_object(
+                Bucket=BUCKET_NAME,
+                Key=image_key,
+                CopySource={'Bucket': BUCKET_NAME, 'Key': image_key},
+                MetadataDirective='REPLACE',
+                ContentType=content_type
+            )
+            report['content_type_fixed'] = True
+        logger.info(f"Image preprocessing skipped for session {session_id}: {json.dumps(report)}")
+        # Bytes Rekognition cannot read are never cached
+        return report, None, head.get('ETag') if report['source_format'] else None
+    
+    if total_bytes is not None and total_bytes <= len(header):
+        original = header
+    else:
+        original = s3_client.get_object(Bucket=BUCKET_NAME, Key=image_key)['Body'].read()
+    data, image_format, report = image_preprocess.normalize_image(original)
+    
+    if data != original:
+        if KEEP_ORIGINAL_IMAGE:
+            extension = image_preprocess.EXTENSIONS.get(report['source_format'], 'bin')
+            s3_client.put_object(
+                Bucket=BUCKET_NAME,
+                Key=f"sessions/{session_id}/image_original.{extension}",
+                Body=original,
+                ContentType=image_preprocess.CONTENT_TYPES.get(report['source_format'], 'application/octet-stream')
+            )
+        s3_client.put_object(
+            Bucket=BUCKET_NAME,
+            Key=image_key,
+            Body=data,
+            ContentType=image_preprocess.CONTENT_TYPES.get(image_format, 'application/octet-stream')
+        )
+    
+    logger.info(f"Image preprocessing for session {session_id}: {json.dumps(report)}")
+    return report, data, None
+
+def session_transcript(session_id, body):
+    """Transcript text for planning: passed in the request, else the session's transcript.json"""
+    if body.get('transcript'):
+        return body['transcript']
+    try:
+        obj = s3_client.get_object(Bucket=BUCKET_NAME, Key=f"sessions/{session_id}/transcript.json")
+        return json.loads(obj['Body'].read()).get('text', '')
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'NoSuchKey':
+            raise
+        return ''
+
+def rekognition_calls(image_key):
+    """Independent Rekognition reads of the session image, by result name"""
+    image = {'S3Object': {'Bucket': BUCKET_NAME, 'Name': image_key}}
+    calls = {
+        'labels': lambda: rekognition_client.detect_labels(
+            Image=image, MaxLabels=20, MinConfidence=70
+        ).get('Labels', []),
+        # Text detection for error messages
+        'text_detections': lambda: rekognition_client.detect_text(Image=image).get('TextDetections', []),
+    }
+    # Custom labels only if the project is trained
+    if REKOGNITION_PROJECT_ARN and REKOGNITION_PROJECT_ARN != "PLACEHOLDER_PROJECT_ARN":
+        calls['custom_labels'] = lambda: rekognition_client.detect_custom_labels(
+            ProjectVersionArn=REKOGNITION_PROJECT_ARN, Image=image, MinConfidence=70
+        ).get('CustomLabels', [])
+    return calls
+
+def rekognition_deadline(context):
+    """Shared deadline in seconds, bounded by the Lambda's remaining execution time"""
+    get_remaining = getattr(context, 'get_remaining_time_in_millis', None)
+    if get_remaining is None:
+        return REKOGNITION_DEADLINE_SECONDS
+    return max(1.0, min(REKOGNITION_DEADLINE_SECONDS, get_remaining() / 1000 - RESPONSE_RESERVE_SECONDS))
+
+def timed_call(call):
+    start = time.perf_counter()
+    try:
+        return call(), None, round((time.perf_counter() - start) * 1000, 1)
+    except Exception as e:
+        return None, str(e), round((time.perf_counter() - start) * 1000, 1)
+
+def run_rekognition_calls(calls, deadline):
+    """Run calls concurrently and wait at most deadline seconds for all of them.
+
+    Returns (results, timings, errors). A call that fails or misses the deadline only
+    loses its own result; calls still running are abandoned and finish in the background.
+    """
+    start = time.perf_counter()
+    futures = {name: rekognition_executor.submit(timed_call, call) for name, call in calls.items()}
+    done, _ = wait(futures.values(), timeout=deadline)
+    
+    results, timings, errors = {}, {}, {}
+    for name, future in futures.items():
+        if future not in done:
+            errors[name] = f"deadline of {deadline:.1f}s exceeded"
+            continue
+        result, error, elapsed_ms = future.result()
+        timings[f"{name}_ms"] = elapsed_ms
+        if error is None:
+            results[name] = result
+        else:
+            errors[name] = error
+    timings['rekognition_ms'] = round((time.perf_counter() - start) * 1000, 1)
+    
+    logger.info(f"Rekognition timings: {json.dumps(timings)} errors: {json.dumps(errors)}")
+    return results, timings, errors
+
+def run_call_plan(plan_name, stages, calls, deadline):
+    """Run the plan's stages in order under one shared deadline, stopping once the planner has enough.
+
+    Returns (results, timings, errors, plan report).
+    """
+    start = time.perf_counter()
+    results, timings, errors = {}, {}, {}
+    calls_made, early_exit = [], False
+    for index, stage in enumerate(stages):
+        if index > 0 and planner.enough(plan_name, results):
+            early_exit = True
+            break
+        remaining = deadline - (time.perf_counter() - start)
+        if remaining <= 0:
+            for name in stage:
+                errors[name] = f"deadline of {deadline:.1f}s exceeded"
+            break
+        stage_results, stage_timings, stage_errors = run_rekognition_calls(
+            {name: calls[name] for name in stage}, remaining
+        )
+        results.update(stage_results)
+        timings.update(stage_timings)
+        errors.update(stage_errors)
+        calls_made.extend(stage)
+    timings['rekognition_ms'] = round((time.perf_counter() - start) * 1000, 1)
+    
+    report = {
+        'name': plan_name,
+        'stages': stages,
+        'calls': calls_made,
+        'skipped': [name for name in calls if name not in calls_made],
+        'early_exit': early_exit
+    }
+    summary = planner.record(plan_name, len(calls_made), timings['rekognition_ms'], early_exit)
+    logger.info(f"Rekognition plan {plan_name}: {json.dumps(report)} stats: {json.dumps(summary)}")
+    return results, timings, errors, report
+
 def lambda_handler(event, context):
     try:
         logger.info("Processing image analysis request")
@@ -33,61 +222,74 @@ def lambda_handler(event, context):
         
         analysis_results = {}
         
-        # Try custom labels first (if project is trained)
+        # The transcript read overlaps with preprocessing; it only feeds the call planner
+        transcript_future = io_executor.submit(session_transcript, session_id, body)
+        
+        # Normalize the stored image so every Rekognition call reads a small, clean JPEG
+        image_data, image_etag = None, None
         try:
-            if REKOGNITION_PROJECT_ARN and REKOGNITION_PROJECT_ARN != "PLACEHOLDER_PROJECT_ARN":
-                custom_response = rekognition_client.detect_custom_labels(
-                    ProjectVersionArn=REKOGNITION_PROJECT_ARN,
-                    Image={
-                        'S3Object': {
-                            'Bucket': BUCKET_NAME,
-                            'Name': image_key
-                        }
-                    },
-                    MinConfidence=70
-                )
-                analysis_results['custom_labels'] = custom_response.get('CustomLabels', [])
+            analysis_results['preprocessing'], image_data, image_etag = preprocess_session_image(session_id, image_key)
         except Exception as e:
-            print(f"Custom labels detection failed: {e}")
-            analysis_results['custom_labels'] = []
+            print(f"Image preprocessing failed, analyzing original: {e}")
         
-        # Fallback to standard label detection
-        labels_response = rekognition_client.detect_labels(
-            Image={
-                'S3Object': {
-                    'Bucket': BUCKET_NAME,
-                    'Name': image_key
-                }
-            },
-            MaxLabels=20,
-            MinConfidence=70
-        )
-        analysis_results['labels'] = labels_response.get('Labels', [])
+        # Near-identical photos reuse earlier Rekognition results
+        cached, cache_info, missing = None, None, {}
+        if image_data is not None or image_etag:
+            try:
+                cached, cache_info = analysis_cache.lookup(image_data, image_etag)
+                analysis_results['cache'] = cache_info
+                logger.info(f"Image cache {cache_info['source']} for session {session_id}: {json.dumps(analysis_cache.stats)}")
+            except Exception as e:
+                print(f"Image cache lookup failed: {e}")
         
-        # Text detection for error messages
-        text_response = rekognition_client.detect_text(
-            Image={
-                'S3Object': {
-                    'Bucket': BUCKET_NAME,
-                    'Name': image_key
-                }
-            }
-        )
-        analysis_results['text_detections'] = text_response.get('TextDetections', [])
+        if cached is not None:
+            # A near hit reuses labels only and the text on screen is read again; calls an
+            # earlier plan skipped run now
+            calls = rekognition_calls(image_key)
+            missing = {name: call for name, call in calls.items() if name not in cached}
+            results, timings, errors = dict(cached), {'rekognition_ms': 0}, {}
+            if missing:
+                fresh, timings, errors = run_rekognition_calls(missing, rekognition_deadline(context))
+                results.update(fresh)
+        else:
+            try:
+                transcript = transcript_future.result()
+            except Exception as e:
+                print(f"Transcript unavailable for planning: {e}")
+                transcript = ''
+            
+            # Cheap signals pick the calls worth making; each stage runs its calls concurrently
+            calls = rekognition_calls(image_key)
+            signals = planner.signals(analysis_results.get('preprocessing'), transcript, image_data)
+            plan_name, stages = planner.plan(signals, calls)
+            results, timings, errors, analysis_results['plan'] = run_call_plan(
+                plan_name, stages, calls, rekognition_deadline(context)
+            )
+            analysis_results['plan']['signals'] = signals
+            if not results:
+                raise Exception(f"Rekognition analysis failed: {json.dumps(errors)}")
+        
+        # Results with failed calls are not cached; an exact hit completed with skipped calls is stored again
+        if cache_info is not None and not errors and (cached is None or (missing and cache_info['source'] == 'exact')):
+            try:
+                analysis_cache.store(cache_info, results)
+            except Exception as e:
+                print(f"Image cache store failed: {e}")
         
-        # Extract meaningful text
-        detected_text = []
-        for text_detection in analysis_results['text_detections']:
-            if text_detection['Type'] == 'LINE' and text_detection['Confidence'] > 80:
-                detected_text.append(text_detection['DetectedText'])
+        analysis_results['timings'] = timings
+        if errors:
+            # Partial results are kept; the failed calls are recorded instead
+            analysis_results['errors'] = errors
         
-        analysis_results['extracted_text'] = detected_text
+        # Compact projection for storage and the response; raw Rekognition output only when debugging
+        debug = IMAGE_ANALYSIS_DEBUG or body.get('debug') is True
+        analysis_results = analysis_schema.project(results, analysis_results, debug)
         
         # Store analysis results
         s3_client.put_object(
             Bucket=BUCKET_NAME,
             Key=f"sessions/{session_id}/image_analysis.json",
-            Body=json.dumps(analysis_results),
+            Body=json.dumps(analysis_results, separators=(',', ':')),
             ContentType='application/json'
         )
         
@@ -99,7 +301,7 @@ def lambda_handler(event, context):
             'body': json.dumps({
                 'analysis': analysis_results,
                 'session_id': session_id
-            })
+            }, separators=(',', ':'))
         }
         
     except ValueError as e:
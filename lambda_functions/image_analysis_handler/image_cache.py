@@ -0,0 +1,232 @@
+import hashlib
+import io
+import json
+import os
+import time
+from botocore.exceptions import ClientError
+
+try:
+    from PIL import Image
+except ImportError:
+    # Without Pillow only byte-identical images share a cache entry
+    Image = None
+
+IMAGE_CACHE_PREFIX = 'image-cache/'
+# Current generation and the Rekognition model it was built with
+IMAGE_GENERATION_KEY = f"{IMAGE_CACHE_PREFIX}generation.json"
+IMAGE_CACHE_TTL_SECONDS = int(os.environ.get('IMAGE_CACHE_TTL_SECONDS', '86400'))
+# dHash bits that may differ for two photos to count as the same scene (of 64)
+IMAGE_HASH_MAX_DISTANCE = int(os.environ.get('IMAGE_HASH_MAX_DISTANCE', '6'))
+# How often a warm container re-reads the generation marker and the hash index
+IMAGE_CACHE_REFRESH_SECONDS = int(os.environ.get('IMAGE_CACHE_REFRESH_SECONDS', '60'))
+
+HASH_BITS = 64
+# 8 bands of 8 bits: two hashes within 7 bits of each other agree on at least one band
+HASH_BANDS = 8
+BAND_BITS = HASH_BITS // HASH_BANDS
+
+# Rekognition outputs worth reusing; timings, errors and preprocessing are per request
+CACHED_FIELDS = ('custom_labels', 'labels', 'text_detections')
+# A 9x8 dHash cannot tell "Error 1002" from "Error 1003": near hits only reuse what the scene looks like
+NEAR_HIT_FIELDS = ('custom_labels', 'labels')
+
+def dhash(image_bytes):
+    """64-bit difference hash: brightness gradients of a 9x8 grayscale thumbnail"""
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        pixels = list(image.convert('L').resize((9, 8), Image.LANCZOS).getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return value
+
+def hamming(a, b):
+    # int.bit_count() needs Python 3.10; CI still runs 3.9
+    return bin(a ^ b).count('1')
+
+def bands(value):
+    return [(band, (value >> (band * BAND_BITS)) & ((1 << BAND_BITS) - 1)) for band in range(HASH_BANDS)]
+
+class HashIndex:
+    """Near-duplicate lookup over 64-bit hashes, bucketed by band so only candidates are compared"""
+
+    def __init__(self, entries=None):
+        self.entries = {}
+        self.buckets = {}
+        for value, stored_at in (entries or {}).items():
+            self.add(value, stored_at)
+
+    def add(self, value, stored_at):
+        self.entries[value] = stored_at
+        for band in bands(value):
+            self.buckets.setdefault(band, set()).add(value)
+
+    def nearest(self, value, max_distance, min_stored_at=0.0):
+        """Return (hash, distance) of the closest live entry within max_distance, or (None, None)"""
+        candidates = set()
+        for band in bands(value):
+            candidates |= self.buckets.get(band, set())
+        best = (None, None)
+        for candidate in candidates:
+            if self.entries[candidate] < min_stored_at:
+                continue
+            distance = hamming(value, candidate)
+            if distance <= max_distance and (best[1] is None or distance < best[1]):
+                best = (candidate, distance)
+        return best
+
+class AnalysisCache:
+    """Rekognition results keyed by perceptual hash of the normalized image, stored in image-cache/.
+
+    Without Pillow entries are keyed by the exact bytes (or the S3 ETag of an image that
+    was not rewritten). Both kinds of key are listed in the generation's index.json, which
+    each container keeps in memory, so a miss costs no GET. Entries live under a generation; the generation is bumped automatically when
+    REKOGNITION_PROJECT_ARN changes (a new custom-labels model version) and manually
+    via invalidate(), so stale labels are never reused after a model update.
+    """
+
+    def __init__(self, s3_client, bucket, project_arn, ttl_seconds=IMAGE_CACHE_TTL_SECONDS,
+                 max_distance=IMAGE_HASH_MAX_DISTANCE):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.project_arn = project_arn or ''
+        self.ttl_seconds = ttl_seconds
+        self.max_distance = max_distance
+        self.current_generation = None
+        self.index = HashIndex()
+        self.exact_keys = {}
+        self.refreshed_at = 0.0
+        self.stats = {'exact_hits': 0, 'near_hits': 0, 'misses': 0}
+
+    def read_json(self, key):
+        try:
+            return json.loads(self.s3_client.get_object(Bucket=self.bucket, Key=key)['Body'].read())
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'NoSuchKey':
+                raise
+            return None
+
+    def index_key(self):
+        return f"{IMAGE_CACHE_PREFIX}{self.current_generation}/index.json"
+
+    def entry_key(self, hash_key):
+        return f"{IMAGE_CACHE_PREFIX}{self.current_generation}/{hash_key}.json"
+
+    def refresh(self):
+        """Re-read the generation marker and hash index at most once per refresh interval"""
+        now = time.time()
+        if self.current_generation is not None and now - self.refreshed_at < IMAGE_CACHE_REFRESH_SECONDS:
+            return
+
+        marker = self.read_json(IMAGE_GENERATION_KEY)
+        if marker is None or marker.get('project_arn', '') != self.project_arn:
+            # Invalidation hook: results from another model version must not be reused
+            generation = invalidate(self.s3_client, self.bucket, self.project_arn)
+        else:
+            generation = str(marker['generation'])
+
+        self.current_generation = generation
+        index = self.read_json(self.index_key()) or {}
+        self.index = HashIndex({int(value, 16): stored_at for value, stored_at in index.get('entries', {}).items()})
+        self.exact_keys = dict(index.get('exact', {}))
+        self.refreshed_at = now
+
+    def hash_key(self, image_bytes, etag=None):
+        """Return (cache key, perceptual hash or None); without image bytes the S3 ETag identifies the image"""
+        if image_bytes is None:
+            return 'etag-' + etag.strip('"'), None
+        if Image is not None:
+            try:
+                value = dhash(image_bytes)
+                return f"dhash-{value:016x}", value
+            except Exception as e:
+                print(f"Perceptual hash failed, using exact hash: {e}")
+        return f"sha256-{hashlib.sha256(image_bytes).hexdigest()}", None
+
+    def lookup(self, image_bytes, etag=None):
+        """Return (cached analysis or None, info) for an image.
+
+        A dHash match is only exact when the stored content digest matches too; any other
+        match is a near hit, which only carries NEAR_HIT_FIELDS and leaves the caller to
+        run the other calls itself.
+        """
+        self.refresh()
+        key, value = self.hash_key(image_bytes, etag)
+        info = {'key': key, 'generation': self.current_generation}
+        min_stored_at = time.time() - self.ttl_seconds
+
+        # The in-memory index already knows whether a live entry exists; no GET on a miss
+        cached = None
+        if value is None:
+            if self.exact_keys.get(key, 0) >= min_stored_at:
+                cached = self.read_json(self.entry_key(key))
+        else:
+            info['digest'] = hashlib.sha256(image_bytes).hexdigest()
+            nearest, distance = self.index.nearest(value, self.max_distance, min_stored_at)
+            if nearest is not None:
+                info['distance'] = distance
+                key = f"dhash-{nearest:016x}"
+                cached = self.read_json(self.entry_key(key))
+
+        if cached is None or cached['stored_at'] < min_stored_at:
+            self.stats['misses'] += 1
+            info['source'] = 'miss'
+            return None, info
+
+        info['source'] = 'exact' if value is None or cached.get('digest') == info['digest'] else 'near'
+        self.stats[f"{info['source']}_hits"] += 1
+        info['matched_key'] = key
+        analysis = cached['analysis']
+        if info['source'] == 'near':
+            analysis = {field: value for field, value in analysis.items() if field in NEAR_HIT_FIELDS}
+        return analysis, info
+
+    def store(self, info, analysis):
+        """Store Rekognition results under the key computed by lookup().
+
+        Only the calls that ran are stored: a plan that exited early leaves the skipped
+        fields out, and a later hit runs those calls instead of reading them as empty.
+        """
+        stored_at = time.time()
+        self.s3_client.put_object(
+            Bucket=self.bucket,
+            Key=self.entry_key(info['key']),
+            Body=json.dumps({
+                'analysis': {field: analysis[field] for field in CACHED_FIELDS if field in analysis},
+                'digest': info.get('digest'),
+                'stored_at': stored_at
+            }),
+            ContentType='application/json'
+        )
+
+        # Merge into the shared index; concurrent writers may drop an entry, which only costs a miss
+        index = self.read_json(self.index_key()) or {}
+        min_stored_at = stored_at - self.ttl_seconds
+        entries = {k: t for k, t in index.get('entries', {}).items() if t >= min_stored_at}
+        exact_keys = {k: t for k, t in index.get('exact', {}).items() if t >= min_stored_at}
+        if info['key'].startswith('dhash-'):
+            value = int(info['key'][len('dhash-'):], 16)
+            entries[f"{value:016x}"] = stored_at
+            self.index.add(value, stored_at)
+        else:
+            exact_keys[info['key']] = stored_at
+            self.exact_keys[info['key']] = stored_at
+        self.s3_client.put_object(
+            Bucket=self.bucket,
+            Key=self.index_key(),
+            Body=json.dumps({'entries': entries, 'exact': exact_keys}),
+            ContentType='application/json'
+        )
+
+def invalidate(s3_client, bucket, project_arn, generation=None):
+    """Start a new cache generation for the given Rekognition model"""
+    # The model digest keeps generations distinct even when two are started in the same millisecond
+    model_digest = hashlib.sha256((project_arn or '').encode()).hexdigest()[:8]
+    generation = generation or f"{int(time.time() * 1000)}-{model_digest}"
+    s3_client.put_object(
+        Bucket=bucket,
+        Key=IMAGE_GENERATION_KEY,
+        Body=json.dumps({'generation': generation, 'project_arn': project_arn or ''}),
+        ContentType='application/json'
+    )
+    return generation
@@ -0,0 +1,219 @@
+import io
+import os
+import struct
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    # Pillow is optional: without it JPEG metadata is still stripped, but nothing is resized
+    Image = None
+
+# Enough of the file to see the format, the metadata segments and the dimensions
+HEADER_BYTES = 64 * 1024
+IMAGE_MAX_DIMENSION = int(os.environ.get('IMAGE_MAX_DIMENSION', '1600'))
+IMAGE_JPEG_QUALITY = int(os.environ.get('IMAGE_JPEG_QUALITY', '85'))
+
+CONTENT_TYPES = {
+    'jpeg': 'image/jpeg',
+    'png': 'image/png',
+    'gif': 'image/gif',
+    'webp': 'image/webp',
+    'bmp': 'image/bmp',
+}
+EXTENSIONS = {'jpeg': 'jpg', 'png': 'png', 'gif': 'gif', 'webp': 'webp', 'bmp': 'bmp'}
+
+# APPn segments that affect how pixels are decoded: JFIF, ICC profile, Adobe colour transform
+KEPT_APP_MARKERS = {0xE0, 0xE2, 0xEE}
+# Markers that carry no length field
+STANDALONE_MARKERS = {0x01} | set(range(0xD0, 0xD8))
+SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+EXIF_ORIENTATION_TAG = 0x0112
+
+def sniff_format(data):
+    """Identify the real image format from its magic bytes, or None"""
+    if data[:3] == b'\xff\xd8\xff':
+        return 'jpeg'
+    if data[:8] == b'\x89PNG\r\n\x1a\n':
+        return 'png'
+    if data[:6] in (b'GIF87a', b'GIF89a'):
+        return 'gif'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'webp'
+    if data[:2] == b'BM':
+        return 'bmp'
+    return None
+
+def iter_jpeg_segments(data):
+    """Yield (marker, segment bytes) up to SOS; the SOS segment includes all remaining data"""
+    position = 2
+    while position + 4 <= len(data):
+        if data[position] != 0xFF:
+            raise ValueError("Corrupt JPEG segment")
+        marker = data[position + 1]
+        if marker == 0xFF:
+            position += 1
+            continue
+        if marker in STANDALONE_MARKERS:
+            yield marker, data[position:position + 2]
+            position += 2
+            continue
+        length = struct.unpack('>H', data[position + 2:position + 4])[0]
+        if marker == 0xDA:
+            yield marker, data[position:]
+            return
+        yield marker, data[position:position + 2 + length]
+        position += 2 + length
+
+def exif_orientation(segment):
+    """Orientation tag from an APP1 Exif segment, or None"""
+    payload = segment[4:]
+    if not payload.startswith(b'Exif\x00\x00'):
+        return None
+    tiff = payload[6:]
+    endian = {b'II': '<', b'MM': '>'}.get(tiff[:2])
+    if endian is None or len(tiff) < 8:
+        return None
+    offset = struct.unpack(endian + 'I', tiff[4:8])[0]
+    if offset + 2 > len(tiff):
+        return None
+    count = struct.unpack(endian + 'H', tiff[offset:offset + 2])[0]
+    for index in range(count):
+        entry = tiff[offset + 2 + index * 12:offset + 14 + index * 12]
+        if len(entry) < 12:
+            break
+        tag = struct.unpack(endian + 'H', entry[:2])[0]
+        if tag == EXIF_ORIENTATION_TAG:
+            return struct.unpack(endian + 'H', entry[8:10])[0]
+    return None
+
+def orientation_segment(orientation):
+    """Minimal APP1 Exif segment carrying only the orientation tag"""
+    tiff = b'MM\x00\x2a\x00\x00\x00\x08' + struct.pack('>HHHIHHI', 1, EXIF_ORIENTATION_TAG, 3, 1, orientation, 0, 0)
+    payload = b'Exif\x00\x00' + tiff
+    return b'\xff\xe1' + struct.pack('>H', len(payload) + 2) + payload
+
+def is_stripped_segment(marker):
+    """EXIF, XMP, IPTC and other APPn segments, and comments"""
+    return (0xE0 <= marker <= 0xEF and marker not in KEPT_APP_MARKERS) or marker == 0xFE
+
+def strip_jpeg_metadata(data):
+    """Drop EXIF, XMP, IPTC and comments from a JPEG without re-encoding it.
+
+    A non-default orientation is kept in a minimal Exif segment so the image is not
+    analysed sideways. Returns (data, (width, height) or None).
+    """
+    kept = [b'\xff\xd8']
+    size = None
+    orientation = None
+    for marker, segment in iter_jpeg_segments(data):
+        if marker in SOF_MARKERS and size is None:
+            height, width = struct.unpack('>HH', segment[5:9])
+            size = (width, height)
+        if marker == 0xE1:
+            orientation = orientation or exif_orientation(segment)
+            continue
+        if is_stripped_segment(marker):
+            continue
+        kept.append(segment)
+    if orientation not in (None, 1):
+        kept.insert(1, orientation_segment(orientation))
+    return b''.join(kept), size
+
+def header_info(header):
+    """(format, (width, height) or None, has strippable metadata) from the start of an image file"""
+    source_format = sniff_format(header)
+    size, has_metadata = None, False
+    try:
+        if source_format == 'jpeg':
+            for marker, segment in iter_jpeg_segments(header):
+                has_metadata = has_metadata or is_stripped_segment(marker)
+                if marker in SOF_MARKERS and len(segment) >= 9:
+                    height, width = struct.unpack('>HH', segment[5:9])
+                    size = (width, height)
+                    break
+        elif source_format == 'png' and len(header) >= 24:
+            size = png_size(header)
+    except (ValueError, struct.error):
+        pass
+    return source_format, size, has_metadata
+
+def needs_normalizing(header):
+    """Whether the full image is worth downloading and rewriting before analysis.
+
+    With Pillow every recognised image may be downsized; without it only a JPEG
+    carrying metadata changes, everything else would be rewritten byte for byte.
+    """
+    source_format, _, has_metadata = header_info(header)
+    if Image is not None:
+        return source_format is not None
+    return source_format == 'jpeg' and has_metadata
+
+def passthrough_report(header, total_bytes=None):
+    """Preprocessing report for an image analysed as uploaded"""
+    source_format, size, _ = header_info(header)
+    report = {
+        'source_format': source_format,
+        'original_bytes': total_bytes,
+        'engine': 'pillow' if Image is not None else 'stdlib',
+        'resized': False,
+        'skipped': True,
+        'format': source_format,
+        'bytes': total_bytes
+    }
+    if size:
+        report['width'], report['height'] = size
+    return report
+
+def png_size(data):
+    width, height = struct.unpack('>II', data[16:24])
+    return width, height
+
+def reencode(data, max_dimension, quality):
+    """Apply EXIF orientation, downsize and re-encode as baseline JPEG without metadata"""
+    with Image.open(io.BytesIO(data)) as opened:
+        image = ImageOps.exif_transpose(opened)
+        original_size = image.size
+        if max(image.size) > max_dimension:
+            image.thumbnail((max_dimension, max_dimension))
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        output = io.BytesIO()
+        image.save(output, 'JPEG', quality=quality, optimize=True)
+        return output.getvalue(), original_size, image.size
+
+def normalize_image(data, max_dimension=IMAGE_MAX_DIMENSION, quality=IMAGE_JPEG_QUALITY):
+    """Return (data, format, report) for an image ready for Rekognition.
+
+    With Pillow the image is downsized to max_dimension and re-encoded as JPEG; without
+    it JPEG metadata is stripped in place and other formats are passed through, labelled
+    with their real format.
+    """
+    source_format = sniff_format(data)
+    report = {
+        'source_format': source_format,
+        'original_bytes': len(data),
+        'engine': 'pillow' if Image is not None else 'stdlib',
+        'resized': False,
+    }
+
+    result, result_format, size = data, source_format, None
+    if source_format == 'jpeg':
+        result, size = strip_jpeg_metadata(data)
+    elif source_format == 'png':
+        size = png_size(data)
+
+    if Image is not None and source_format is not None:
+        encoded, original_size, new_size = reencode(data, max_dimension, quality)
+        report['resized'] = new_size != original_size
+        # Small JPEGs and flat PNG screenshots can grow when re-encoded; Rekognition reads
+        # both formats, so they are kept unless re-encoding actually helps
+        if report['resized'] or source_format not in ('jpeg', 'png') or len(encoded) < len(result):
+            result, result_format, size = encoded, 'jpeg', new_size
+        else:
+            size = original_size
+
+    report['format'] = result_format
+    report['bytes'] = len(result)
+    if size:
+        report['width'], report['height'] = size
+    return result, result_format, report
@@ -0,0 +1,76 @@
+import io
+import os
+
+try:
+    from faster_whisper import WhisperModel
+except ImportError:
+    # The local engine is optional; without it every clip goes to Amazon Transcribe
+    WhisperModel = None
+
+import transcription_jobs
+
+BACKEND_TRANSCRIBE = 'transcribe'
+BACKEND_LOCAL = 'local'
+
+# int8-quantized Whisper; tiny.en transcribes a few seconds of speech in well under a
+# second on one Lambda vCPU, which beats Transcribe's job start-up for short clips.
+# The model is loaded from a packaged directory (e.g. a converted tiny.en in a layer):
+# Lambda can only write to /tmp, so it is never downloaded from the model hub at runtime
+LOCAL_ASR_MODEL_PATH = os.environ.get('LOCAL_ASR_MODEL_PATH', '/opt/models/faster-whisper-tiny.en')
+LOCAL_ASR_COMPUTE_TYPE = os.environ.get('LOCAL_ASR_COMPUTE_TYPE', 'int8')
+# Off until the stack packages faster-whisper and the model and raises the function's memory
+LOCAL_ASR_ENABLED = os.environ.get('LOCAL_ASR_ENABLED', 'false').lower() == 'true'
+# Clips up to this length are transcribed in-process
+LOCAL_ASR_MAX_SECONDS = float(os.environ.get('LOCAL_ASR_MAX_SECONDS', '15'))
+# Longer clips still fall back to the local engine when a Transcribe job fails
+LOCAL_ASR_FALLBACK_MAX_SECONDS = float(os.environ.get('LOCAL_ASR_FALLBACK_MAX_SECONDS', '45'))
+
+class LocalWhisperBackend:
+    """In-process CPU speech recognition; the model loads once per container"""
+
+    name = BACKEND_LOCAL
+
+    def __init__(self, model_path=LOCAL_ASR_MODEL_PATH, compute_type=LOCAL_ASR_COMPUTE_TYPE):
+        self.model_path = model_path
+        self.compute_type = compute_type
+        self.model = None
+
+    def available(self):
+        return LOCAL_ASR_ENABLED and WhisperModel is not None and os.path.isdir(self.model_path)
+
+    def transcribe(self, audio_bytes):
+        """Transcribe a WAV clip; returns the same projection as transcription_jobs.project_transcript"""
+        if self.model is None:
+            self.model = WhisperModel(
+                self.model_path, device='cpu', compute_type=self.compute_type, local_files_only=True
+            )
+        segments, _ = self.model.transcribe(
+            io.BytesIO(audio_bytes), language='en', beam_size=1, word_timestamps=True
+        )
+        segments = list(segments)
+        words = [
+            [word.word.strip(), round(word.start, 2), round(word.end, 2), round(word.probability, 3)]
+            for segment in segments for word in (segment.words or [])
+        ]
+        confidence = round(sum(word[3] for word in words) / len(words), 3) if words else 0.0
+        return {
+            'text': ''.join(segment.text for segment in segments).strip(),
+            'confidence': confidence,
+            'word_fields': transcription_jobs.WORD_FIELDS,
+            'words': words
+        }
+
+def choose_backend(seconds, local_backend):
+    """Return (backend name, reason) for a clip of the given length in seconds (None if unknown)"""
+    if local_backend is None or not local_backend.available():
+        return BACKEND_TRANSCRIBE, 'local_unavailable'
+    if seconds is None:
+        return BACKEND_TRANSCRIBE, 'unknown_duration'
+    if seconds <= LOCAL_ASR_MAX_SECONDS:
+        return BACKEND_LOCAL, 'short_clip'
+    return BACKEND_TRANSCRIBE, 'long_clip'
+
+def can_fall_back(seconds, local_backend):
+    """Whether a failed Transcribe job should be retried with the local engine"""
+    return (local_backend is not None and local_backend.available()
+            and seconds is not None and seconds <= LOCAL_ASR_FALLBACK_MAX_SECONDS)
@@ -0,0 +1,122 @@
+import io
+import os
+import warnings
+import wave
+
+try:
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', DeprecationWarning)
+        # C sample operations, available in the Python 3.11 Lambda runtime (removed in 3.13)
+        import audioop
+except ImportError:
+    audioop = None
+
+TARGET_SAMPLE_RATE = int(os.environ.get('AUDIO_TARGET_SAMPLE_RATE', '16000'))
+VAD_FRAME_MS = 30
+# A frame is voiced when its RMS clears both the absolute floor and a multiple of the noise floor
+VAD_MIN_RMS = int(os.environ.get('AUDIO_VAD_MIN_RMS', '300'))
+VAD_NOISE_FACTOR = 3.0
+# Frames this far above the absolute floor are always voiced, whatever the noise estimate
+VAD_SPEECH_RMS = VAD_MIN_RMS * 2
+# Audio kept around speech so word onsets and tails are not clipped
+VAD_PAD_MS = 200
+# Pauses longer than this inside the recording are shortened to it
+MAX_SILENCE_MS = int(os.environ.get('AUDIO_MAX_SILENCE_MS', '700'))
+
+SAMPLE_WIDTH = 2
+
+def read_wav(data):
+    """Return (16-bit frames, channels, sample rate) for a PCM WAV file"""
+    with wave.open(io.BytesIO(data)) as wav:
+        channels = wav.getnchannels()
+        width = wav.getsampwidth()
+        rate = wav.getframerate()
+        frames = wav.readframes(wav.getnframes())
+    if width == 1:
+        # 8-bit WAV is unsigned
+        frames = audioop.bias(frames, 1, -128)
+    if width != SAMPLE_WIDTH:
+        frames = audioop.lin2lin(frames, width, SAMPLE_WIDTH)
+    return frames, channels, rate
+
+def write_wav(frames, rate):
+    output = io.BytesIO()
+    with wave.open(output, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(SAMPLE_WIDTH)
+        wav.setframerate(rate)
+        wav.writeframes(frames)
+    return output.getvalue()
+
+def voiced_frames(frames, rate):
+    """Per-frame voice decisions from RMS energy against an adaptive noise floor"""
+    frame_bytes = rate * VAD_FRAME_MS // 1000 * SAMPLE_WIDTH
+    energies = [audioop.rms(frames[i:i + frame_bytes], SAMPLE_WIDTH) for i in range(0, len(frames), frame_bytes)]
+    if not energies:
+        return [], frame_bytes
+    # The floor comes from quiet frames only: in a clip with little silence the low
+    # percentiles of all frames are speech, and quieter words would be cut as pauses
+    quiet = sorted(energy for energy in energies if energy < VAD_SPEECH_RMS)
+    noise_floor = quiet[len(quiet) // 10] if quiet else 0
+    threshold = min(VAD_SPEECH_RMS, max(VAD_MIN_RMS, noise_floor * VAD_NOISE_FACTOR))
+    return [energy >= threshold for energy in energies], frame_bytes
+
+def trim_silence(frames, rate):
+    """Drop leading and trailing silence and shorten long pauses; silent audio is returned as is"""
+    voiced, frame_bytes = voiced_frames(frames, rate)
+    if not any(voiced):
+        return frames
+
+    pad = VAD_PAD_MS // VAD_FRAME_MS
+    max_gap = MAX_SILENCE_MS // VAD_FRAME_MS
+    keep = [False] * len(voiced)
+    for index, is_voiced in enumerate(voiced):
+        if is_voiced:
+            for neighbour in range(max(0, index - pad), min(len(voiced), index + pad + 1)):
+                keep[neighbour] = True
+
+    first = keep.index(True)
+    last = len(keep) - 1 - keep[::-1].index(True)
+    kept = []
+    gap = 0
+    for index in range(first, last + 1):
+        gap = 0 if keep[index] else gap + 1
+        if gap <= max_gap:
+            kept.append(frames[index * frame_bytes:(index + 1) * frame_bytes])
+    return b''.join(kept)
+
+def normalize_wav(data):
+    """Downmix to mono, resample to TARGET_SAMPLE_RATE and trim silence.
+
+    Returns (data, report). Input that is not PCM WAV, or a runtime without audioop,
+    is returned unchanged with report['skipped'] set.
+    """
+    report = {'original_bytes': len(data)}
+    if audioop is None:
+        return data, dict(report, skipped='audioop unavailable')
+    try:
+        frames, channels, rate = read_wav(data)
+    except (wave.Error, EOFError) as e:
+        return data, dict(report, skipped=f"unsupported audio: {e}")
+    if channels > 2:
+        return data, dict(report, skipped=f"{channels} channels")
+
+    report['original_seconds'] = round(len(frames) / (SAMPLE_WIDTH * channels * rate), 2)
+    report['original_sample_rate'] = rate
+    report['original_channels'] = channels
+
+    if channels == 2:
+        frames = audioop.tomono(frames, SAMPLE_WIDTH, 0.5, 0.5)
+    # Never upsample: it adds bytes without adding information
+    target_rate = min(rate, TARGET_SAMPLE_RATE)
+    if target_rate != rate:
+        frames, _ = audioop.ratecv(frames, SAMPLE_WIDTH, 1, rate, target_rate, None)
+    frames = trim_silence(frames, target_rate)
+
+    normalized = write_wav(frames, target_rate)
+    report['sample_rate'] = target_rate
+    report['seconds'] = round(len(frames) / (SAMPLE_WIDTH * target_rate), 2)
+    report['bytes'] = len(normalized)
+    report['seconds_saved'] = round(report['original_seconds'] - report['seconds'], 2)
+    report['bytes_saved'] = len(data) - len(normalized)
+    return normalized, report
@@ -1,83 +1,295 @@
 import json
 import boto3
 import os
+import re
 import time
+from datetime import datetime
+from botocore.exceptions import ClientError
+import audio_preprocess
+import asr_backends
+import transcription_jobs
 
 transcribe_client = boto3.client('transcribe')
 s3_client = boto3.client('s3')
 BUCKET_NAME = os.environ['STORAGE_BUCKET']
 
+# 'local' swaps Amazon Transcribe for the in-memory stand-in, for offline runs
+TRANSCRIBE_JOB_SERVICE = os.environ.get('TRANSCRIBE_JOB_SERVICE', 'transcribe')
+if TRANSCRIBE_JOB_SERVICE == 'local':
+    job_service = transcription_jobs.LocalJobService()
+else:
+    job_service = transcription_jobs.TranscribeJobService(transcribe_client, s3_client, BUCKET_NAME)
+
+# In-process engine for short clips and failed jobs; unavailable when not packaged
+local_asr = asr_backends.LocalWhisperBackend()
+
+# Synchronous mode only; async requests return as soon as the job starts
+POLL_ATTEMPTS = 30
+POLL_INTERVAL_SECONDS = 2
+# Polling stops early so a local fallback still fits in the Lambda timeout
+POLL_RESERVE_MS = 10000
+
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*'
+}
+
+def sanitize_session_id(session_id):
+    """Sanitize session_id to prevent path traversal attacks"""
+    if not isinstance(session_id, str) or not re.match(r'^[a-zA-Z0-9-]+$', session_id):
+        raise ValueError("Invalid session ID format")
+    return session_id
+
+def preprocess_session_audio(session_id, audio_key):
+    """Store a normalized copy of the session audio; returns (key to transcribe, report, audio bytes)"""
+    original = s3_client.get_object(Bucket=BUCKET_NAME, Key=audio_key)['Body'].read()
+    normalized, report = audio_preprocess.normalize_wav(original)
+    print(f"Audio preprocessing for session {session_id}: {json.dumps(report)}")
+
+    if 'skipped' in report or report['bytes_saved'] <= 0:
+        return audio_key, report, original
+
+    normalized_key = f"sessions/{session_id}/audio_normalized.wav"
+    s3_client.put_object(
+        Bucket=BUCKET_NAME,
+        Key=normalized_key,
+        Body=normalized,
+        ContentType='audio/wav'
+    )
+    return normalized_key, report, normalized
+
+def load_job_record(session_id):
+    """Transcription status record for the session, or None if no job was started"""
+    try:
+        obj = s3_client.get_object(Bucket=BUCKET_NAME, Key=f"sessions/{session_id}/transcription.json")
+        return json.loads(obj['Body'].read())
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'NoSuchKey':
+            raise
+        return None
+
+def save_job_record(session_id, record):
+    s3_client.put_object(
+        Bucket=BUCKET_NAME,
+        Key=f"sessions/{session_id}/transcription.json",
+        Body=json.dumps(record),
+        ContentType='application/json'
+    )
+
+def elapsed_ms_since(timestamp):
+    return round((datetime.utcnow() - datetime.fromisoformat(timestamp)).total_seconds() * 1000, 1)
+
+def store_transcript(session_id, transcript, record, asr):
+    """Write transcript.json and mark the job record completed; returns the text"""
+    transcript['audio_preprocessing'] = record.get('audio_preprocessing', {})
+    transcript['asr'] = asr
+    s3_client.put_object(
+        Bucket=BUCKET_NAME,
+        Key=f"sessions/{session_id}/transcript.json",
+        Body=json.dumps(transcript, separators=(',', ':')),
+        ContentType='application/json'
+    )
+
+    record.update({
+        'status': transcription_jobs.STATUS_COMPLETED,
+        'completed_at': datetime.utcnow().isoformat(),
+        'transcript': transcript['text'],
+        'asr': asr
+    })
+    save_job_record(session_id, record)
+    print(f"ASR for session {session_id}: {json.dumps(asr)}")
+    return transcript['text']
+
+def complete_transcription(session_id, job_name, record):
+    """Store the result of a finished Transcribe job; returns the text"""
+    transcript = transcription_jobs.project_transcript(job_service.fetch_result(job_name))
+    asr = dict(record.get('asr', {}), backend=asr_backends.BACKEND_TRANSCRIBE,
+               latency_ms=elapsed_ms_since(record['started_at']))
+    return store_transcript(session_id, transcript, record, asr)
+
+def transcribe_locally(session_id, audio_bytes, record, reason):
+    """Run the in-process engine and store its transcript; returns the text"""
+    start = time.perf_counter()
+    transcript = local_asr.transcribe(audio_bytes)
+    asr = {
+        'backend': asr_backends.BACKEND_LOCAL,
+        'reason': reason,
+        'latency_ms': round((time.perf_counter() - start) * 1000, 1)
+    }
+    return store_transcript(session_id, transcript, record, asr)
+
+def fall_back_or_fail(session_id, job_name, record, reason):
+    """Retry a failed or timed-out job with the local engine; returns the text or None.
+
+    A timed-out job is still running, so without a fallback its record stays in
+    progress and the job's state change event completes it later.
+    """
+    if asr_backends.can_fall_back(record.get('audio_seconds'), local_asr):
+        try:
+            audio_bytes = s3_client.get_object(Bucket=BUCKET_NAME, Key=record['audio_key'])['Body'].read()
+            return transcribe_locally(session_id, audio_bytes, record, reason)
+        except Exception as e:
+            print(f"Local ASR fallback failed for session {session_id}: {e}")
+
+    if reason == 'transcribe_timeout':
+        record['sync_timed_out_at'] = datetime.utcnow().isoformat()
+        save_job_record(session_id, record)
+        return None
+
+    record.update({
+        'status': transcription_jobs.STATUS_FAILED,
+        'completed_at': datetime.utcnow().isoformat(),
+        'failure_reason': job_service.failure_reason(job_name) if reason == 'transcribe_failed' else reason
+    })
+    save_job_record(session_id, record)
+    return None
+
+def handle_job_state_change(event):
+    """EventBridge target for 'Transcribe Job State Change' events"""
+    job_name = event['detail']['TranscriptionJobName']
+    status = event['detail']['TranscriptionJobStatus']
+    session_id = sanitize_session_id(transcription_jobs.session_id_for(job_name))
+
+    record = load_job_record(session_id) or {'job_name': job_name}
+    if record.get('status') in (transcription_jobs.STATUS_COMPLETED, transcription_jobs.STATUS_FAILED):
+        # Already finished by a synchronous request or an earlier delivery of this event
+        return {'session_id': session_id, 'status': record['status']}
+
+    if status == transcription_jobs.STATUS_COMPLETED:
+        complete_transcription(session_id, job_name, record)
+    elif status == transcription_jobs.STATUS_FAILED:
+        fall_back_or_fail(session_id, job_name, record, 'transcribe_failed')
+    print(f"Transcription job {job_name} finished with status {status}")
+    return {'session_id': session_id, 'status': status}
+
+def transcription_status(session_id):
+    """GET /transcribe/{session_id}: one S3 read, no Transcribe API call"""
+    record = load_job_record(session_id)
+    if record is None:
+        return {
+            'statusCode': 404,
+            'headers': CORS_HEADERS,
+            'body': json.dumps({'error': 'No transcription for session', 'session_id': session_id})
+        }
+
+    payload = {'session_id': session_id, 'status': record['status'], 'job_name': record['job_name']}
+    if 'transcript' in record:
+        payload['transcript'] = record['transcript']
+    if 'failure_reason' in record:
+        payload['failure_reason'] = record['failure_reason']
+    return {
+        'statusCode': 200,
+        'headers': CORS_HEADERS,
+        'body': json.dumps(payload)
+    }
+
+def transcript_response(session_id, transcript_text):
+    return {
+        'statusCode': 200,
+        'headers': CORS_HEADERS,
+        'body': json.dumps({
+            'transcript': transcript_text,
+            'session_id': session_id
+        })
+    }
+
+def job_started_response(session_id, job_name):
+    return {
+        'statusCode': 202,
+        'headers': CORS_HEADERS,
+        'body': json.dumps({
+            'session_id': session_id,
+            'job_name': job_name,
+            'status': transcription_jobs.STATUS_IN_PROGRESS,
+            'status_path': f"/transcribe/{session_id}"
+        })
+    }
+
 def lambda_handler(event, context):
+    if event.get('source') == 'aws.transcribe':
+        return handle_job_state_change(event)
+
     try:
+        if event.get('httpMethod') == 'GET':
+            return transcription_status(sanitize_session_id(event['pathParameters']['session_id']))
+
         body = json.loads(event['body'])
-        session_id = body['session_id']
-        
+        session_id = sanitize_session_id(body['session_id'])
+
+        # Transcribe a compact mono 16 kHz copy with the dead air removed
+        audio_key = f"sessions/{session_id}/audio.wav"
+        audio_bytes = None
+        try:
+            audio_key, preprocessing, audio_bytes = preprocess_session_audio(session_id, audio_key)
+        except Exception as e:
+            print(f"Audio preprocessing failed, transcribing original: {e}")
+            preprocessing = {'skipped': str(e)}
+
+        seconds = preprocessing.get('seconds', preprocessing.get('original_seconds'))
+        backend, reason = asr_backends.choose_backend(seconds if audio_bytes else None, local_asr)
+        job_name = transcription_jobs.job_name_for(session_id)
+        record = {
+            'job_name': job_name,
+            'status': transcription_jobs.STATUS_IN_PROGRESS,
+            'started_at': datetime.utcnow().isoformat(),
+            'audio_key': audio_key,
+            'audio_seconds': seconds,
+            'audio_preprocessing': preprocessing,
+            'asr': {'backend': backend, 'reason': reason}
+        }
+
+        # Short clips are transcribed in-process, skipping the job round trip entirely
+        if backend == asr_backends.BACKEND_LOCAL:
+            try:
+                return transcript_response(session_id, transcribe_locally(session_id, audio_bytes, record, reason))
+            except Exception as e:
+                print(f"Local ASR failed for session {session_id}, starting Transcribe job: {e}")
+                record['asr'] = {'backend': asr_backends.BACKEND_TRANSCRIBE, 'reason': 'local_failed'}
+
         # Start transcription job
-        job_name = f"transcribe-{session_id}"
-        audio_uri = f"s3://{BUCKET_NAME}/sessions/{session_id}/audio.wav"
-        
-        transcribe_client.start_transcription_job(
-            TranscriptionJobName=job_name,
-            Media={'MediaFileUri': audio_uri},
-            MediaFormat='wav',
-            LanguageCode='en-US'
-        )
-        
+        job_service.start(job_name, f"s3://{BUCKET_NAME}/{audio_key}")
+        save_job_record(session_id, record)
+
+        # Async mode: completion arrives as a job state change event, clients poll the status endpoint
+        if body.get('mode') == 'async':
+            return job_started_response(session_id, job_name)
+
         # Poll for completion (simplified for demo)
-        max_attempts = 30
-        for attempt in range(max_attempts):
-            response = transcribe_client.get_transcription_job(
-                TranscriptionJobName=job_name
-            )
-            
-            status = response['TranscriptionJob']['TranscriptionJobStatus']
-            
-            if status == 'COMPLETED':
-                transcript_uri = response['TranscriptionJob']['Transcript']['TranscriptFileUri']
-                
-                # Get transcript content
-                import urllib.request
-                with urllib.request.urlopen(transcript_uri) as response:
-                    transcript_data = json.loads(response.read())
-                
-                transcript_text = transcript_data['results']['transcripts'][0]['transcript']
-                
-                # Store transcript
-                s3_client.put_object(
-                    Bucket=BUCKET_NAME,
-                    Key=f"sessions/{session_id}/transcript.json",
-                    Body=json.dumps({
-                        'text': transcript_text,
-                        'confidence': transcript_data['results']['transcripts'][0].get('confidence', 0.9)
-                    }),
-                    ContentType='application/json'
-                )
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {
-                        'Access-Control-Allow-Origin': '*'
-                    },
-                    'body': json.dumps({
-                        'transcript': transcript_text,
-                        'session_id': session_id
-                    })
-                }
-                
-            elif status == 'FAILED':
-                raise Exception("Transcription job failed")
-            
-            time.sleep(2)
-        
-        raise Exception("Transcription job timed out")
-        
+        get_remaining_ms = getattr(context, 'get_remaining_time_in_millis', None)
+        for attempt in range(POLL_ATTEMPTS):
+            status = job_service.status(job_name)
+
+            if status == transcription_jobs.STATUS_COMPLETED:
+                return transcript_response(session_id, complete_transcription(session_id, job_name, record))
+
+            elif status == transcription_jobs.STATUS_FAILED:
+                transcript_text = fall_back_or_fail(session_id, job_name, record, 'transcribe_failed')
+                if transcript_text is None:
+                    raise Exception("Transcription job failed")
+                return transcript_response(session_id, transcript_text)
+
+            if get_remaining_ms and get_remaining_ms() < POLL_RESERVE_MS:
+                break
+            time.sleep(POLL_INTERVAL_SECONDS)
+
+        transcript_text = fall_back_or_fail(session_id, job_name, record, 'transcribe_timeout')
+        if transcript_text is None:
+            # The job keeps running; the client polls for it like an async request
+            return job_started_response(session_id, job_name)
+        return transcript_response(session_id, transcript_text)
+
+    except ValueError as e:
+        return {
+            'statusCode': 400,
+            'headers': CORS_HEADERS,
+            'body': json.dumps({
+                'error': str(e)
+            })
+        }
     except Exception as e:
         return {
             'statusCode': 500,
-            'headers': {
-                'Access-Control-Allow-Origin': '*'
-            },
+            'headers': CORS_HEADERS,
             'body': json.dumps({
                 'error': str(e)
             })
-        }
\ No newline at end of file
+        }
@@ -0,0 +1,134 @@
+import json
+
+JOB_PREFIX = 'transcribe-'
+# Field order of each entry in a projected transcript's 'words' list
+WORD_FIELDS = ['word', 'start', 'end', 'confidence']
+
+STATUS_IN_PROGRESS = 'IN_PROGRESS'
+STATUS_COMPLETED = 'COMPLETED'
+STATUS_FAILED = 'FAILED'
+
+def job_name_for(session_id):
+    return f"{JOB_PREFIX}{session_id}"
+
+def session_id_for(job_name):
+    if not job_name.startswith(JOB_PREFIX):
+        raise ValueError(f"Not a session transcription job: {job_name}")
+    return job_name[len(JOB_PREFIX):]
+
+def output_key_for(session_id):
+    """Where Transcribe writes its full result inside our bucket"""
+    return f"sessions/{session_id}/transcribe_output.json"
+
+def project_transcript(result):
+    """Compact transcript.json fields from Transcribe output, keeping word confidences.
+
+    Words are [word, start, end, confidence] lists; punctuation is folded into the text
+    only. Transcript confidence is the mean word confidence.
+    """
+    words = []
+    for item in result['results'].get('items', []):
+        if item.get('type') != 'pronunciation':
+            continue
+        alternative = item['alternatives'][0]
+        words.append([
+            alternative['content'],
+            float(item['start_time']),
+            float(item['end_time']),
+            float(alternative.get('confidence', 0))
+        ])
+    transcript = result['results']['transcripts'][0]
+    if words:
+        confidence = round(sum(word[3] for word in words) / len(words), 3)
+    else:
+        confidence = transcript.get('confidence', 0.9)
+    return {
+        'text': transcript['transcript'],
+        'confidence': confidence,
+        'word_fields': WORD_FIELDS,
+        'words': words
+    }
+
+def job_state_change_event(job_name, status):
+    """EventBridge event Amazon Transcribe emits when a job finishes"""
+    return {
+        'source': 'aws.transcribe',
+        'detail-type': 'Transcribe Job State Change',
+        'detail': {'TranscriptionJobName': job_name, 'TranscriptionJobStatus': status}
+    }
+
+class TranscribeJobService:
+    """Amazon Transcribe batch jobs writing their output into the storage bucket"""
+
+    def __init__(self, transcribe_client, s3_client, bucket):
+        self.client = transcribe_client
+        self.s3_client = s3_client
+        self.bucket = bucket
+
+    def start(self, job_name, media_uri):
+        self.client.start_transcription_job(
+            TranscriptionJobName=job_name,
+            Media={'MediaFileUri': media_uri},
+            MediaFormat='wav',
+            LanguageCode='en-US',
+            OutputBucketName=self.bucket,
+            OutputKey=output_key_for(session_id_for(job_name))
+        )
+
+    def job(self, job_name):
+        return self.client.get_transcription_job(TranscriptionJobName=job_name)['TranscriptionJob']
+
+    def status(self, job_name):
+        return self.job(job_name)['TranscriptionJobStatus']
+
+    def failure_reason(self, job_name):
+        return self.job(job_name).get('FailureReason', 'unknown')
+
+    def fetch_result(self, job_name):
+        """Full Transcribe output JSON for a completed job, read from our bucket"""
+        obj = self.s3_client.get_object(Bucket=self.bucket, Key=output_key_for(session_id_for(job_name)))
+        return json.loads(obj['Body'].read())
+
+class LocalJobService:
+    """In-memory stand-in for Amazon Transcribe, for offline runs and tests.
+
+    Jobs stay in progress until finish() is called, which returns the state-change
+    event Transcribe would have sent through EventBridge.
+    """
+
+    def __init__(self):
+        self.jobs = {}
+
+    def start(self, job_name, media_uri):
+        if job_name in self.jobs:
+            raise ValueError(f"Job already exists: {job_name}")
+        self.jobs[job_name] = {'media_uri': media_uri, 'status': STATUS_IN_PROGRESS}
+
+    def status(self, job_name):
+        return self.jobs[job_name]['status']
+
+    def failure_reason(self, job_name):
+        return self.jobs[job_name].get('failure_reason', 'unknown')
+
+    def fetch_result(self, job_name):
+        return self.jobs[job_name]['result']
+
+    def finish(self, job_name, transcript=None, confidence=0.9, failure_reason=None):
+        job = self.jobs[job_name]
+        if transcript is None:
+            job['status'] = STATUS_FAILED
+            job['failure_reason'] = failure_reason or 'local job failed'
+        else:
+            job['status'] = STATUS_COMPLETED
+            job['result'] = {
+                'jobName': job_name,
+                'results': {
+                    'transcripts': [{'transcript': transcript}],
+                    'items': [
+                        {'type': 'pronunciation', 'start_time': str(index * 0.5), 'end_time': str(index * 0.5 + 0.4),
+                         'alternatives': [{'content': word, 'confidence': str(confidence)}]}
+                        for index, word in enumerate(transcript.split())
+                    ]
+                }
+            }
+        return job_state_change_event(job_name, job['status'])
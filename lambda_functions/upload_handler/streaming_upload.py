@@ -0,0 +1,67 @@
+import base64
+import json
+import re
+
+# API Gateway and synchronous Lambda invocations cap the request at 6 MB, so inline
+# base64 media decodes to at most ~4.5 MB: always a single put_object, never multipart.
+# Larger files go through the presigned direct upload flow instead.
+# Encoded characters decoded per step; a multiple of 4 so every slice is valid base64 on its own
+DECODE_CHUNK_CHARS = 64 * 1024
+
+NON_BASE64 = re.compile(r'[^A-Za-z0-9+/=]')
+
+def find_media_spans(raw_body, fields):
+    """Locate large base64 string values in the raw JSON body without parsing them.
+
+    Returns (body, spans): body is the parsed JSON with each located value replaced by
+    an empty string, spans maps field -> (start, end) of the value inside raw_body.
+    Values that cannot be sliced out safely (escapes, non-base64 characters) are left
+    in body and get no span, so callers fall back to the regular decode for them.
+    """
+    spans = {}
+    for field in fields:
+        match = re.search(r'"%s"\s*:\s*"' % re.escape(field), raw_body)
+        if not match:
+            continue
+        start = match.end()
+        end = raw_body.find('"', start)
+        if end == -1 or NON_BASE64.search(raw_body, start, end):
+            continue
+        spans[field] = (start, end)
+
+    if not spans:
+        return json.loads(raw_body), {}
+
+    # Only the small remainder of the body is parsed, never the media values
+    pieces = []
+    position = 0
+    for start, end in sorted(spans.values()):
+        pieces.append(raw_body[position:start])
+        position = end
+    pieces.append(raw_body[position:])
+    try:
+        body = json.loads(''.join(pieces))
+    except ValueError:
+        return json.loads(raw_body), {}
+    # A match inside another value would leave the field missing or non-empty
+    if any(body.get(field) != '' for field in spans):
+        return json.loads(raw_body), {}
+    return body, spans
+
+def iter_decoded(encoded, start, end, chunk_chars=DECODE_CHUNK_CHARS):
+    """Yield decoded bytes for encoded[start:end] one slice at a time"""
+    chunk_chars -= chunk_chars % 4
+    for position in range(start, end, chunk_chars):
+        yield base64.b64decode(encoded[position:min(position + chunk_chars, end)])
+
+def upload_chunks(s3_client, bucket, key, chunks, content_type):
+    """Upload an iterable of decoded byte chunks as one object; returns the byte count.
+
+    The chunks are collected into a single buffer that is handed to S3 as is, so the
+    decoded media exists once in memory and the base64 value is never copied whole.
+    """
+    buffer = bytearray()
+    for chunk in chunks:
+        buffer += chunk
+    s3_client.put_object(Bucket=bucket, Key=key, Body=buffer, ContentType=content_type)
+    return len(buffer)
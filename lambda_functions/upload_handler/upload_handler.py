@@ -4,7 +4,11 @@ import base64
 import uuid
 import os
 import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from botocore.exceptions import ClientError
+from streaming_upload import find_media_spans, iter_decoded, upload_chunks
 
 # Configure logging
 logger = logging.getLogger()
@@ -12,92 +16,87 @@ logger.setLevel(logging.INFO)
 
 s3_client = boto3.client('s3')
 BUCKET_NAME = os.environ['STORAGE_BUCKET']
+PRESIGNED_URL_EXPIRY = int(os.environ.get('PRESIGNED_URL_EXPIRY', '900'))
+# Session metadata plus the inline artifacts of text-only uploads; bedrock_handler only
+# reads it when a session has no transcript.json / image_analysis.json files
+SESSION_MANIFEST = 'session.json'
+
+# Independent S3 writes are issued concurrently; boto3 clients are thread-safe
+write_executor = ThreadPoolExecutor(max_workers=4)
+
+# Files a client may upload directly to S3: name -> (object name, content type)
+DIRECT_UPLOAD_TARGETS = {
+    'image': ('image.jpg', 'image/jpeg'),
+    'audio': ('audio.wav', 'audio/wav')
+}
+# Largest direct upload S3 accepts per file; the API has no auth and the analysis
+# handlers read the whole object into memory
+DIRECT_UPLOAD_MAX_BYTES = {
+    'image': int(os.environ.get('MAX_IMAGE_UPLOAD_BYTES', str(10 * 1024 * 1024))),
+    'audio': int(os.environ.get('MAX_AUDIO_UPLOAD_BYTES', str(25 * 1024 * 1024)))
+}
+
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Headers': 'Content-Type',
+    'Access-Control-Allow-Methods': 'POST'
+}
 
 def lambda_handler(event, context):
     try:
         logger.info(f"Processing upload request")
-        body = json.loads(event['body'])
+        raw_body = event['body']
+        # Base64 media values are sliced out of the raw body and decoded part by part
+        body, media_spans = find_media_spans(raw_body, DIRECT_UPLOAD_TARGETS)
+        
+        # Direct-to-S3 uploads: bytes never pass through this Lambda
+        if event.get('resource') == '/upload/complete':
+            return complete_direct_upload(body)
+        if body.get('mode') == 'presigned':
+            return create_direct_upload(body)
         
         # Generate unique session ID
         session_id = str(uuid.uuid4())
         timestamp = datetime.utcnow().isoformat()
         
-        # Handle image upload
-        image_key = None
-        if 'image' in body:
-            image_data = base64.b64decode(body['image'])
-            image_key = f"sessions/{session_id}/image.jpg"
-            s3_client.put_object(
-                Bucket=BUCKET_NAME,
-                Key=image_key,
-                Body=image_data,
-                ContentType='image/jpeg'
-            )
+        image_key = f"sessions/{session_id}/image.jpg" if 'image' in body else None
+        audio_key = f"sessions/{session_id}/audio.wav" if 'audio' in body else None
         
-        # Handle audio upload
-        audio_key = None
-        if 'audio' in body:
-            audio_data = base64.b64decode(body['audio'])
-            audio_key = f"sessions/{session_id}/audio.wav"
-            s3_client.put_object(
-                Bucket=BUCKET_NAME,
-                Key=audio_key,
-                Body=audio_data,
-                ContentType='audio/wav'
-            )
+        session_data = {
+            'session_id': session_id,
+            'timestamp': timestamp,
+            'image_key': image_key,
+            'audio_key': audio_key,
+            'status': 'uploaded'
+        }
         
-        # Handle text-only requests by creating default transcript
+        # Text-only requests carry their transcript and empty analysis inline
         if not audio_key and not image_key:
-            # Create a default transcript for text-only queries
-            default_transcript = {
+            session_data['transcript'] = {
                 'text': body.get('text', 'General troubleshooting request'),
                 'timestamp': timestamp
             }
-            s3_client.put_object(
-                Bucket=BUCKET_NAME,
-                Key=f"sessions/{session_id}/transcript.json",
-                Body=json.dumps(default_transcript),
-                ContentType='application/json'
-            )
-            
-            # Create default image analysis for consistency
-            default_analysis = {
+            session_data['image_analysis'] = {
                 'labels': [],
                 'extracted_text': [],
                 'custom_labels': [],
                 'timestamp': timestamp
             }
-            s3_client.put_object(
-                Bucket=BUCKET_NAME,
-                Key=f"sessions/{session_id}/image_analysis.json",
-                Body=json.dumps(default_analysis),
-                ContentType='application/json'
-            )
-        
-        # Store session metadata
-        session_data = {
-            'session_id': session_id,
-            'timestamp': timestamp,
-            'image_key': image_key,
-            'audio_key': audio_key,
-            'status': 'uploaded'
-        }
         
-        s3_client.put_object(
-            Bucket=BUCKET_NAME,
-            Key=f"sessions/{session_id}/metadata.json",
-            Body=json.dumps(session_data),
-            ContentType='application/json'
-        )
+        uploads = [
+            write_executor.submit(upload_media, session_id, name, raw_body, body, media_spans)
+            for name in ('image', 'audio') if name in body
+        ]
+        # Wait for every media write; the first failure fails the upload
+        for upload in uploads:
+            upload.result()
+        # The manifest only records 'uploaded' once the media it points at exists
+        put_session_manifest(session_id, session_data)
         
         logger.info(f"Upload successful for session: {session_id}")
         return {
             'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Headers': 'Content-Type',
-                'Access-Control-Allow-Methods': 'POST'
-            },
+            'headers': CORS_HEADERS,
             'body': json.dumps({
                 'session_id': session_id,
                 'message': 'Files uploaded successfully'
@@ -114,4 +113,125 @@ def lambda_handler(event, context):
             'body': json.dumps({
                 'error': 'Upload failed'
             })
-        }
\ No newline at end of file
+        }
+
+def put_session_manifest(session_id, session_data):
+    s3_client.put_object(
+        Bucket=BUCKET_NAME,
+        Key=f"sessions/{session_id}/{SESSION_MANIFEST}",
+        Body=json.dumps(session_data),
+        ContentType='application/json'
+    )
+
+def upload_media(session_id, name, raw_body, body, media_spans):
+    """Decode a base64 media field incrementally and store it in S3; returns the object key"""
+    object_name, content_type = DIRECT_UPLOAD_TARGETS[name]
+    key = f"sessions/{session_id}/{object_name}"
+    if name in media_spans:
+        chunks = iter_decoded(raw_body, *media_spans[name])
+    else:
+        chunks = [base64.b64decode(body[name])]
+    size = upload_chunks(s3_client, BUCKET_NAME, key, chunks, content_type)
+    logger.info(f"Stored {name} for session {session_id}: {size} bytes")
+    return key
+
+def create_direct_upload(body):
+    """Create a session and return presigned POST forms for the requested files.
+
+    A POST policy, unlike a presigned PUT, lets S3 itself reject files over the size limit.
+    """
+    files = body.get('files', list(DIRECT_UPLOAD_TARGETS))
+    unknown = [name for name in files if name not in DIRECT_UPLOAD_TARGETS]
+    if unknown or not files:
+        return {
+            'statusCode': 400,
+            'headers': CORS_HEADERS,
+            'body': json.dumps({'error': 'Invalid files requested'})
+        }
+    
+    session_id = str(uuid.uuid4())
+    uploads = {}
+    for name in files:
+        object_name, content_type = DIRECT_UPLOAD_TARGETS[name]
+        key = f"sessions/{session_id}/{object_name}"
+        post = s3_client.generate_presigned_post(
+            Bucket=BUCKET_NAME,
+            Key=key,
+            Fields={'Content-Type': content_type},
+            Conditions=[
+                {'Content-Type': content_type},
+                ['content-length-range', 1, DIRECT_UPLOAD_MAX_BYTES[name]]
+            ],
+            ExpiresIn=PRESIGNED_URL_EXPIRY
+        )
+        uploads[name] = {
+            'url': post['url'],
+            'method': 'POST',
+            # Sent as form fields before the file field
+            'fields': post['fields'],
+            'max_bytes': DIRECT_UPLOAD_MAX_BYTES[name],
+            'key': key
+        }
+    
+    logger.info(f"Created direct upload for session: {session_id} ({', '.join(files)})")
+    return {
+        'statusCode': 200,
+        'headers': CORS_HEADERS,
+        'body': json.dumps({
+            'session_id': session_id,
+            'uploads': uploads,
+            'expires_in': PRESIGNED_URL_EXPIRY,
+            'message': 'Upload files with the returned URLs, then call /upload/complete'
+        })
+    }
+
+def complete_direct_upload(body):
+    """Verify directly uploaded files exist and write the session metadata"""
+    session_id = body.get('session_id', '')
+    # Only allow alphanumeric characters and hyphens to prevent path traversal
+    if not re.match(r'^[a-zA-Z0-9-]+$', session_id):
+        return {
+            'statusCode': 400,
+            'headers': CORS_HEADERS,
+            'body': json.dumps({'error': 'Invalid session ID format'})
+        }
+    
+    keys = {}
+    for name in body.get('files', list(DIRECT_UPLOAD_TARGETS)):
+        if name not in DIRECT_UPLOAD_TARGETS:
+            continue
+        key = f"sessions/{session_id}/{DIRECT_UPLOAD_TARGETS[name][0]}"
+        try:
+            s3_client.head_object(Bucket=BUCKET_NAME, Key=key)
+            keys[name] = key
+        except ClientError as e:
+            if e.response['Error']['Code'] not in ('404', 'NoSuchKey', 'NotFound'):
+                raise
+            keys[name] = None
+    
+    missing = [name for name, key in keys.items() if key is None]
+    if missing or not keys:
+        return {
+            'statusCode': 400,
+            'headers': CORS_HEADERS,
+            'body': json.dumps({'error': 'Upload incomplete', 'missing': missing})
+        }
+    
+    session_data = {
+        'session_id': session_id,
+        'timestamp': datetime.utcnow().isoformat(),
+        'image_key': keys.get('image'),
+        'audio_key': keys.get('audio'),
+        'status': 'uploaded'
+    }
+    put_session_manifest(session_id, session_data)
+    
+    logger.info(f"Direct upload completed for session: {session_id}")
+    return {
+        'statusCode': 200,
+        'headers': CORS_HEADERS,
+        'body': json.dumps({
+            'session_id': session_id,
+            'message': 'Files uploaded successfully'
+        })
+    }
\ No newline at end of file
@@ -0,0 +1,93 @@
+"""Action catalog shared by bedrock_handler (detection) and action_executor (execution)"""
+
+from collections import deque
+
+# Action id -> trigger phrases and metadata. Order is the order actions are suggested in.
+ACTIONS = {
+    'restart_stb': {
+        'triggers': ['restart'],
+        'label': 'Restart set-top box',
+        'action_type': 'device_restart',
+    },
+    'reprovision_service': {
+        'triggers': ['provision'],
+        'label': 'Re-provision service',
+        'action_type': 'service_reprovision',
+    },
+    'check_subscription': {
+        'triggers': ['subscription'],
+        'label': 'Check subscription',
+        'action_type': 'subscription_check',
+    },
+}
+
+HANDLERS = {}
+
+def handler(action_id):
+    """Decorator binding an executor function to a registered action id"""
+    if action_id not in ACTIONS:
+        raise ValueError(f"Unknown action: {action_id}")
+
+    def register(func):
+        HANDLERS[action_id] = func
+        return func
+    return register
+
+class KeywordMatcher:
+    """Aho-Corasick automaton over lowercase trigger phrases.
+
+    One pass over the text finds every trigger, so detection cost does not grow with
+    the number of actions in the catalog.
+    """
+
+    def __init__(self, phrases):
+        # phrases: {phrase: action_id}
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [set()]
+
+        for phrase, action_id in phrases.items():
+            state = 0
+            for char in phrase.lower():
+                if char not in self.goto[state]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append(set())
+                    self.goto[state][char] = len(self.goto) - 1
+                state = self.goto[state][char]
+            self.output[state].add(action_id)
+
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self.goto[state].items():
+                queue.append(child)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                self.output[child] |= self.output[self.fail[child]]
+
+    def match(self, text):
+        """Return the set of action ids whose triggers occur anywhere in text"""
+        found = set()
+        state = 0
+        goto, fail, output = self.goto, self.fail, self.output
+        for char in text.lower():
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                found |= output[state]
+        return found
+
+MATCHER = KeywordMatcher({
+    trigger: action_id
+    for action_id, action in ACTIONS.items()
+    for trigger in action['triggers']
+})
+
+def extract_actions(response_text):
+    """Actions suggested by a response, in catalog order"""
+    found = MATCHER.match(response_text)
+    return [action_id for action_id in ACTIONS if action_id in found]
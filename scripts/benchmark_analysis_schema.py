@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Size and parse-time benchmark for image_analysis.json, v1 (raw Rekognition output)
+against v2 (compact projection)
+Builds Rekognition-shaped responses for a router photo and an error screen and reports
+the stored JSON size and json.loads time of each layout, which is what bedrock_handler
+pays on every /troubleshoot request.
+"""
+
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'lambda_functions', 'image_analysis_handler'))
+
+from analysis_schema import extract_text, project
+
+PARSE_RUNS = 2000
+
+def geometry(index):
+    box = {'Width': 0.31, 'Height': 0.042, 'Left': 0.12 + index * 0.001, 'Top': 0.2 + index * 0.03}
+    return {
+        'BoundingBox': box,
+        'Polygon': [{'X': box['Left'], 'Y': box['Top']}, {'X': box['Left'] + box['Width'], 'Y': box['Top']},
+                    {'X': box['Left'] + box['Width'], 'Y': box['Top'] + box['Height']},
+                    {'X': box['Left'], 'Y': box['Top'] + box['Height']}]
+    }
+
+def labels(count):
+    """detect_labels output with MaxLabels=20: instances, parents, aliases and categories"""
+    return [{
+        'Name': f"Label {index}",
+        'Confidence': 99.123456 - index,
+        'Instances': [{'BoundingBox': geometry(index)['BoundingBox'], 'Confidence': 97.5}] * (index % 3),
+        'Parents': [{'Name': 'Electronics'}, {'Name': 'Hardware'}][:index % 3],
+        'Aliases': [{'Name': f"Alias {index}"}] if index % 4 == 0 else [],
+        'Categories': [{'Name': 'Technology and Computing'}]
+    } for index in range(count)]
+
+def text_detections(lines):
+    """detect_text output: every LINE plus one WORD entry per word, each with geometry"""
+    detections = []
+    for index, line in enumerate(lines):
+        confidence = 99.2 if index % 5 else 62.4
+        detections.append({'DetectedText': line, 'Type': 'LINE', 'Id': index, 'Confidence': confidence,
+                           'Geometry': geometry(index)})
+        for word in line.split():
+            detections.append({'DetectedText': word, 'Type': 'WORD', 'Id': len(detections), 'ParentId': index,
+                               'Confidence': confidence, 'Geometry': geometry(index)})
+    return detections
+
+def scenarios():
+    router_lines = ['PWR', 'PON', 'LOS', 'LAN1 LAN2 LAN3 LAN4', 'WPS', 'Huawei EchoLife HG8245H']
+    screen_lines = ['Error 1002', 'No signal detected.', 'Please check the cable connection',
+                    'between your decoder and the wall port.', 'If the problem persists call 100',
+                    'Channel 101', 'Menu  Back  Exit'] * 2
+    custom = [{'Name': 'RouterLOS', 'Confidence': 93.2, 'Geometry': geometry(0)}]
+    yield 'router photo', {'labels': labels(20), 'text_detections': text_detections(router_lines), 'custom_labels': custom}
+    yield 'error screen', {'labels': labels(12), 'text_detections': text_detections(screen_lines), 'custom_labels': []}
+
+def legacy_v1(results, metadata):
+    analysis = dict(results, extracted_text=extract_text(results['text_detections']))
+    analysis.update(metadata)
+    return json.dumps(analysis)
+
+def parse_us(encoded):
+    start = time.perf_counter()
+    for _ in range(PARSE_RUNS):
+        json.loads(encoded)
+    return (time.perf_counter() - start) / PARSE_RUNS * 1e6
+
+if __name__ == "__main__":
+    metadata = {'timings': {'labels_ms': 412.0, 'text_detections_ms': 388.5, 'rekognition_ms': 415.2}}
+    print(f"{'scenario':<14} {'layout':<10} {'bytes':>8} {'parse us':>10}")
+    for name, results in scenarios():
+        v1 = legacy_v1(results, metadata)
+        v2 = json.dumps(project(results, metadata), separators=(',', ':'))
+        debug = json.dumps(project(results, metadata, debug=True), separators=(',', ':'))
+        for layout, encoded in (('v1 raw', v1), ('v2', v2), ('v2 debug', debug)):
+            print(f"{name:<14} {layout:<10} {len(encoded):>8} {parse_us(encoded):>10.1f}")
+        print(f"{name:<14} v2 is {100 * (1 - len(v2) / len(v1)):.0f}% smaller than v1")
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Seconds, bytes and latency benchmark for audio normalization before Transcribe
+Builds stereo 44.1 kHz recordings with dead air around and inside the speech and
+reports what mono 16 kHz conversion plus silence trimming removes
+"""
+
+import io
+import math
+import os
+import random
+import struct
+import sys
+import time
+import wave
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'lambda_functions', 'transcribe_handler'))
+
+from audio_preprocess import normalize_wav
+
+RATE = 44100
+
+def recording(segments):
+    """segments: [(seconds, is_speech)]; speech is a modulated tone, silence is low noise"""
+    random.seed(1)
+    frames = bytearray()
+    for seconds, is_speech in segments:
+        for i in range(int(seconds * RATE)):
+            if is_speech:
+                sample = int(6000 * math.sin(2 * math.pi * 220 * i / RATE) * (0.6 + 0.4 * math.sin(2 * math.pi * 3 * i / RATE)))
+            else:
+                sample = random.randint(-60, 60)
+            frames += struct.pack('<hh', sample, sample)
+    output = io.BytesIO()
+    with wave.open(output, 'wb') as wav:
+        wav.setnchannels(2)
+        wav.setsampwidth(2)
+        wav.setframerate(RATE)
+        wav.writeframes(bytes(frames))
+    return output.getvalue()
+
+CASES = {
+    'short question, 2s lead-in': [(2, False), (4, True), (1, False)],
+    'long pauses mid-sentence': [(1, False), (3, True), (4, False), (3, True), (3, False)],
+    'continuous speech': [(0.2, False), (10, True), (0.2, False)],
+}
+
+if __name__ == "__main__":
+    print(f"{'recording':<30} {'seconds':>15} {'bytes':>20} {'ms':>7}")
+    for name, segments in CASES.items():
+        data = recording(segments)
+        start = time.perf_counter()
+        normalized, report = normalize_wav(data)
+        elapsed = (time.perf_counter() - start) * 1000
+        seconds = f"{report['original_seconds']:.1f} -> {report['seconds']:.1f}"
+        size = f"{len(data) // 1024}KB -> {len(normalized) // 1024}KB"
+        print(f"{name:<30} {seconds:>15} {size:>20} {elapsed:>7.1f}")
+    print("Transcribe bills per second of audio, so seconds saved are cost saved")
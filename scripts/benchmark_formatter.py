@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark for bedrock_handler.format_markdown_response
+Formats a large 'complex' style answer repeatedly and compares the
+single-pass formatter against the previous multi-regex implementation
+"""
+
+import os
+import re
+import sys
+import time
+
+os.environ.setdefault('STORAGE_BUCKET', 'benchmark-bucket')
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'lambda_functions', 'bedrock_handler'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'lambda_layer', 'python'))
+
+from bedrock_handler import format_markdown_response
+
+def legacy_format_markdown_response(text):
+    """Previous implementation: six regex passes plus a sentence split"""
+    text = text.strip()
+    text = re.sub(r'(\d+\.)\s*', r'\n\1 ', text)
+    text = re.sub(r'([•-])\s*', r'\n\1 ', text)
+    text = re.sub(r'\*\*(.*?)\*\*', r'\n**\1**\n', text)
+    text = re.sub(r'\n{3,}', '\n\n', text)
+    sentences = text.split('. ')
+    formatted_sentences = []
+    for i, sentence in enumerate(sentences):
+        sentence = sentence.strip()
+        if sentence:
+            if i < len(sentences) - 1:
+                sentence += '.'
+            formatted_sentences.append(sentence)
+    result = ' '.join(formatted_sentences)
+    result = re.sub(r'(\?\s*)([A-Z])', r'\1\n\n\2', result)
+    return result.strip()
+
+SAMPLE = (
+    "**Possible causes:** The set-top box may have lost its connection. "
+    "Try these steps: 1. Restart the set-top box for 30 seconds. 2. Check the HDMI cable. "
+    "3. Confirm the router LOS light is off. Firmware 2.5 or later is required. "
+    "- Use a LAN cable - Avoid HDMI switches. Is the picture back? If not, contact us. "
+)
+
+def bench(func, text, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        func(text)
+    return (time.perf_counter() - start) / rounds * 1e6
+
+if __name__ == "__main__":
+    for repeats in (1, 10, 100):
+        text = SAMPLE * repeats
+        rounds = max(10, 2000 // repeats)
+        new_us = bench(format_markdown_response, text, rounds)
+        old_us = bench(legacy_format_markdown_response, text, rounds)
+        print(f"{len(text):>7} chars: single-pass {new_us:8.1f} µs, legacy {old_us:8.1f} µs ({old_us / new_us:.1f}x)")
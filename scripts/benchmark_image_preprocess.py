@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Byte and latency benchmark for image normalization before Rekognition
+Normalizes real images from sample_data/ (placeholders are skipped) and synthetic
+phone-style photos, reporting size before/after and preprocessing time.
+Without Pillow only EXIF stripping is measured.
+"""
+
+import io
+import os
+import struct
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'lambda_functions', 'image_analysis_handler'))
+
+import image_preprocess
+from image_preprocess import IMAGE_MAX_DIMENSION, normalize_image, sniff_format
+
+SAMPLE_DIR = os.path.join(os.path.dirname(__file__), '..', 'sample_data')
+
+def synthetic_photo(width, height, image_format):
+    """Noisy gradient with phone-style EXIF, close to a router photo in entropy"""
+    from PIL import Image
+    image = Image.effect_noise((width, height), 40).convert('RGB')
+    overlay = Image.linear_gradient('L').resize((width, height)).convert('RGB')
+    image = Image.blend(image, overlay, 0.5)
+    output = io.BytesIO()
+    if image_format == 'jpeg':
+        exif = image.getexif()
+        exif[0x0112] = 6
+        exif[0x010F] = 'PhoneMaker'
+        image.save(output, 'JPEG', quality=92, exif=exif.tobytes())
+    else:
+        image.save(output, 'PNG')
+    return output.getvalue()
+
+def synthetic_jpeg_container(exif_bytes, scan_bytes):
+    """JPEG-shaped bytes with a large APP1 block, enough to measure metadata stripping"""
+    def segment(marker, payload):
+        return bytes([0xFF, marker]) + struct.pack('>H', len(payload) + 2) + payload
+    exif = b'Exif\x00\x00II\x2a\x00\x08\x00\x00\x00\x00\x00' + b'\x00' * exif_bytes
+    sof = b'\x08' + struct.pack('>HH', 3024, 4032) + b'\x03' + b'\x00' * 9
+    return (b'\xff\xd8' + segment(0xE1, exif[:65000]) + segment(0xC0, sof)
+            + segment(0xDA, b'\x03\x01\x00\x02\x11\x03\x11\x00\x3f\x00') + os.urandom(scan_bytes) + b'\xff\xd9')
+
+def inputs():
+    for name in sorted(os.listdir(SAMPLE_DIR)):
+        with open(os.path.join(SAMPLE_DIR, name), 'rb') as f:
+            data = f.read()
+        if sniff_format(data):
+            yield name, data
+    if image_preprocess.Image is not None:
+        yield 'synthetic 4032x3024 jpeg', synthetic_photo(4032, 3024, 'jpeg')
+        yield 'synthetic 2400x1080 png screenshot', synthetic_photo(2400, 1080, 'png')
+    else:
+        yield 'synthetic jpeg, 64KB EXIF', synthetic_jpeg_container(64000, 3 * 1024 * 1024)
+
+if __name__ == "__main__":
+    engine = 'pillow' if image_preprocess.Image is not None else 'stdlib (install Pillow to measure resizing)'
+    print(f"Engine: {engine}, max dimension {IMAGE_MAX_DIMENSION}px")
+    print(f"{'input':<36} {'before':>10} {'after':>10} {'saved':>7} {'ms':>8}")
+    for name, data in inputs():
+        start = time.perf_counter()
+        result, image_format, report = normalize_image(data)
+        elapsed = (time.perf_counter() - start) * 1000
+        saved = 100 * (1 - len(result) / len(data))
+        print(f"{name:<36} {len(data) / 1024:>8.0f}KB {len(result) / 1024:>8.0f}KB {saved:>6.1f}% {elapsed:>8.1f}")
+    print("Smaller objects also shorten each Rekognition call's S3 read and image decode")
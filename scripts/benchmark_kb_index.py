@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Recall and latency benchmark for the local KB retriever
+Runs a labelled query set against the packaged index and reports recall@3,
+how many queries would be answered locally, and per-query latency.
+The query file is a JSON list of [customer query, expected document id] pairs
+written against the real Knowledge Base export the index was built from.
+"""
+
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'lambda_functions', 'bedrock_handler'))
+
+from local_retriever import LocalRetriever, LOCAL_KB_INDEX_PATH, LOCAL_KB_MIN_CONFIDENCE
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python benchmark_kb_index.py <QUERIES_JSON>")
+        sys.exit(1)
+    if not os.path.exists(LOCAL_KB_INDEX_PATH):
+        print("❌ kb_index.json not found, run scripts/build_kb_index.py first")
+        sys.exit(1)
+
+    with open(LOCAL_KB_INDEX_PATH) as f:
+        retriever = LocalRetriever(json.load(f))
+    with open(sys.argv[1]) as f:
+        queries = [tuple(pair) for pair in json.load(f)]
+
+    hits = 0
+    local = 0
+    latencies = []
+    for query, expected in queries:
+        start = time.perf_counter()
+        for _ in range(100):
+            results, confidence = retriever.search(query)
+        latencies.append((time.perf_counter() - start) / 100 * 1000)
+
+        ids = [doc['id'] for _, doc in results]
+        hit = expected in ids
+        hits += hit
+        local += confidence >= LOCAL_KB_MIN_CONFIDENCE
+        print(f"{'✅' if hit else '❌'} {confidence:.2f} {query!r} -> {ids}")
+
+    print(f"\nRecall@3: {hits}/{len(queries)} ({hits / len(queries):.0%})")
+    print(f"Answered locally (confidence >= {LOCAL_KB_MIN_CONFIDENCE}): {local}/{len(queries)}")
+    print(f"Latency p50: {percentile(latencies, 50):.3f} ms, p99: {percentile(latencies, 99):.3f} ms")
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Peak memory benchmark for base64 uploads in upload_handler
+Compares decoding the whole payload at once against the incremental path
+(slice the base64 value out of the raw body, decode it in steps into one buffer).
+Payloads stay within the 6 MB API Gateway / synchronous Lambda request limit.
+"""
+
+import base64
+import json
+import os
+import sys
+import tracemalloc
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'lambda_functions', 'upload_handler'))
+
+from streaming_upload import find_media_spans, iter_decoded, upload_chunks
+
+# API Gateway and synchronous Lambda invocations reject larger request bodies
+MAX_REQUEST_BYTES = 6 * 1024 * 1024
+
+class DiscardingS3:
+    """Accepts uploads and drops the bytes, so only the handler's own memory is measured"""
+
+    def put_object(self, **kwargs):
+        return {}
+
+def legacy_upload(raw_body, s3):
+    body = json.loads(raw_body)
+    audio_data = base64.b64decode(body['audio'])
+    s3.put_object(Bucket='b', Key='audio.wav', Body=audio_data, ContentType='audio/wav')
+
+def incremental_upload(raw_body, s3):
+    body, spans = find_media_spans(raw_body, ['image', 'audio'])
+    upload_chunks(s3, 'b', 'audio.wav', iter_decoded(raw_body, *spans['audio']), 'audio/wav')
+
+def peak_mb(upload, raw_body):
+    tracemalloc.start()
+    upload(raw_body, DiscardingS3())
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak / 1024 / 1024
+
+if __name__ == "__main__":
+    print(f"{'audio':>8} {'request':>9} {'legacy':>10} {'incremental':>12} {'saved':>8}")
+    # 4.4 MB of audio is about the largest inline upload that fits in the request limit
+    for size_mb in (1, 2, 4.4):
+        raw_body = json.dumps({
+            'audio': base64.b64encode(os.urandom(int(size_mb * 1024 * 1024))).decode(),
+            'text': 'benchmark'
+        })
+        assert len(raw_body) <= MAX_REQUEST_BYTES
+        legacy = peak_mb(legacy_upload, raw_body)
+        incremental = peak_mb(incremental_upload, raw_body)
+        print(f"{size_mb:>6}MB {len(raw_body) / 1024 / 1024:>7.1f}MB {legacy:>8.1f}MB {incremental:>10.1f}MB {legacy - incremental:>6.1f}MB")
+    print("Peak excludes the event body itself, which Lambda holds in both cases")
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+Build the local BM25 index packaged with bedrock_handler
+Reads an export of the documents in the Bedrock Knowledge Base (one
+{'id', 'title', 'content'} JSON file per document) and writes
+lambda_functions/bedrock_handler/kb_index.json. The index is only used when
+the function runs with LOCAL_KB_ENABLED=true.
+"""
+
+import glob
+import json
+import os
+import sys
+
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+sys.path.append(os.path.join(ROOT, 'lambda_functions', 'bedrock_handler'))
+
+from local_retriever import build_index
+
+DEFAULT_OUTPUT = os.path.join(ROOT, 'lambda_functions', 'bedrock_handler', 'kb_index.json')
+
+def load_documents(source_dir):
+    """Load {'id', 'title', 'content'} documents from every JSON file in source_dir"""
+    documents = []
+    for path in sorted(glob.glob(os.path.join(source_dir, '*.json'))):
+        with open(path) as f:
+            documents.append(json.load(f))
+    return documents
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (2, 3):
+        print("Usage: python build_kb_index.py <KB_EXPORT_DIR> [OUTPUT_PATH]")
+        sys.exit(1)
+
+    source_dir = sys.argv[1]
+    output_path = sys.argv[2] if len(sys.argv) > 2 else DEFAULT_OUTPUT
+
+    documents = load_documents(source_dir)
+    if not documents:
+        print(f"❌ No documents found in {source_dir}")
+        sys.exit(1)
+
+    index = build_index(documents)
+    with open(output_path, 'w') as f:
+        json.dump(index, f, separators=(',', ':'))
+
+    print(f"✅ Indexed {len(index['docs'])} documents, {len(index['postings'])} terms")
+    print(f"📦 Wrote {output_path} ({os.path.getsize(output_path)} bytes)")
+    print("Set LOCAL_KB_ENABLED=true on bedrock_handler to serve confident matches from it")
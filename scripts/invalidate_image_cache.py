@@ -0,0 +1,26 @@
+#!/usr/bin/env python3
+"""
+Invalidate the image analysis cache, e.g. after retraining the custom labels model
+under the same project version ARN. Deploying a new REKOGNITION_PROJECT_ARN
+invalidates the cache automatically; this script covers everything else.
+"""
+
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'lambda_functions', 'image_analysis_handler'))
+
+import boto3
+from image_cache import invalidate
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python invalidate_image_cache.py <STORAGE_BUCKET>")
+        sys.exit(1)
+
+    bucket = sys.argv[1]
+    project_arn = os.environ.get('REKOGNITION_PROJECT_ARN', '')
+
+    generation = invalidate(boto3.client('s3'), bucket, project_arn)
+    print(f"✅ Image analysis cache generation set to {generation}")
+    print("Warm containers pick up the new generation within IMAGE_CACHE_REFRESH_SECONDS")
@@ -0,0 +1,26 @@
+#!/usr/bin/env python3
+"""
+Invalidate the Knowledge Base retrieval cache after a KB re-sync
+Run this once the ingestion job has completed so every bedrock_handler
+container stops serving retrieval results from the previous sync
+"""
+
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'lambda_functions', 'bedrock_handler'))
+
+import boto3
+from kb_cache import invalidate
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (2, 3):
+        print("Usage: python invalidate_kb_cache.py <STORAGE_BUCKET> [INGESTION_JOB_ID]")
+        sys.exit(1)
+
+    bucket = sys.argv[1]
+    generation = sys.argv[2] if len(sys.argv) == 3 else None
+
+    generation = invalidate(boto3.client('s3'), bucket, generation)
+    print(f"✅ KB retrieval cache generation set to {generation}")
+    print("Warm containers pick up the new generation within KB_GENERATION_REFRESH_SECONDS")
@@ -3,6 +3,8 @@ from aws_cdk import (
     aws_lambda as _lambda,
     aws_apigateway as apigateway,
     aws_s3 as s3,
+    aws_events as events,
+    aws_events_targets as targets,
     Duration,
     CfnOutput
 )
@@ -16,18 +18,15 @@ class ApiStack(Stack):
                  **kwargs) -> None:
         super().__init__(scope, construct_id, **kwargs)
 
-        # Lambda layer for common dependencies (optional)
-        try:
-            lambda_layer = _lambda.LayerVersion(
-                self, "CommonLayer",
-                code=_lambda.Code.from_asset("lambda_layer"),
-                compatible_runtimes=[_lambda.Runtime.PYTHON_3_11],
-                description="Common dependencies for Lambda functions"
-            )
-            layers = [lambda_layer]
-        except:
-            # If layer creation fails, continue without it
-            layers = []
+        # Lambda layer for shared modules; required, bedrock_handler and
+        # action_executor import action_registry from it
+        lambda_layer = _lambda.LayerVersion(
+            self, "CommonLayer",
+            code=_lambda.Code.from_asset("lambda_layer"),
+            compatible_runtimes=[_lambda.Runtime.PYTHON_3_11],
+            description="Shared modules for Lambda functions"
+        )
+        layers = [lambda_layer]
 
         # Environment variables for all Lambdas
         common_env = {
@@ -149,6 +148,11 @@ class ApiStack(Stack):
         )
         upload_resource.add_cors_preflight(**cors_config)
 
+        # Completion callback for presigned direct-to-S3 uploads
+        upload_complete_resource = upload_resource.add_resource("complete")
+        upload_complete_resource.add_method("POST", upload_integration)
+        upload_complete_resource.add_cors_preflight(**cors_config)
+
         transcribe_resource = api.root.add_resource("transcribe")
         transcribe_resource.add_method(
             "POST", 
@@ -162,6 +166,25 @@ class ApiStack(Stack):
         )
         transcribe_resource.add_cors_preflight(**cors_config)
 
+        # Status of async transcription jobs
+        transcribe_status_resource = transcribe_resource.add_resource("{session_id}")
+        transcribe_status_resource.add_method("GET", transcribe_integration)
+        transcribe_status_resource.add_cors_preflight(**cors_config)
+
+        # Transcribe job completion is delivered to transcribe_handler instead of being polled
+        events.Rule(
+            self, "TranscribeJobStateRule",
+            event_pattern=events.EventPattern(
+                source=["aws.transcribe"],
+                detail_type=["Transcribe Job State Change"],
+                detail={
+                    "TranscriptionJobStatus": ["COMPLETED", "FAILED"],
+                    "TranscriptionJobName": [{"prefix": "transcribe-"}]
+                }
+            ),
+            targets=[targets.LambdaFunction(transcribe_handler)]
+        )
+
         image_resource = api.root.add_resource("analyze-image")
         image_resource.add_method(
             "POST", 
@@ -207,6 +230,12 @@ class ApiStack(Stack):
         session_resource.add_method("GET", audio_integration)
         session_resource.add_cors_preflight(**cors_config)
 
+        # Streaming manifest endpoint (partial text/audio chunks)
+        stream_resource = api.root.add_resource("stream")
+        stream_session_resource = stream_resource.add_resource("{session_id}")
+        stream_session_resource.add_method("GET", audio_integration)
+        stream_session_resource.add_cors_preflight(**cors_config)
+
         self.api_url = api.url
 
         # Output API URL
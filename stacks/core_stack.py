@@ -19,7 +19,8 @@ class CoreStack(Stack):
             encryption=s3.BucketEncryption.S3_MANAGED,
             cors=[
                 s3.CorsRule(
-                    allowed_methods=[s3.HttpMethods.GET, s3.HttpMethods.HEAD],
+                    # POST for presigned direct uploads from the browser
+                    allowed_methods=[s3.HttpMethods.GET, s3.HttpMethods.HEAD, s3.HttpMethods.POST],
                     allowed_origins=["*"],
                     allowed_headers=["*"],
                     max_age=3600
@@ -99,7 +100,8 @@ class CoreStack(Stack):
                         iam.PolicyStatement(
                             effect=iam.Effect.ALLOW,
                             actions=[
-                                "bedrock:InvokeModel"
+                                "bedrock:InvokeModel",
+                                "bedrock:InvokeModelWithResponseStream"
                             ],
                             resources=["*"]
                         )
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The shared layer is mounted at /opt/python in Lambda; put it on the path the same way here
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'lambda_layer', 'python'))
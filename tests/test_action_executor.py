@@ -0,0 +1,32 @@
+import pytest
+import json
+from unittest.mock import patch
+import sys
+import os
+
+# Set required environment variables before importing
+os.environ['STORAGE_BUCKET'] = 'test-bucket'
+
+# Add lambda function to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'lambda_functions', 'action_executor'))
+import action_registry
+from action_executor import lambda_handler, execute_action
+
+def test_every_registered_action_has_a_handler():
+    assert set(action_registry.HANDLERS) == set(action_registry.ACTIONS)
+
+@patch('action_executor.s3_client')
+def test_action_executor_dispatches_through_registry(mock_s3):
+    event = {'body': json.dumps({'session_id': 'abc', 'action': 'restart_stb'})}
+
+    response = lambda_handler(event, {})
+
+    assert response['statusCode'] == 200
+    result = json.loads(response['body'])['result']
+    assert result['success'] is True
+    assert result['details']['action_type'] == 'device_restart'
+    assert mock_s3.put_object.call_count == 1
+
+def test_unknown_action_is_rejected():
+    result = execute_action('format_hard_drive', 'abc')
+    assert result == {'success': False, 'message': 'Unknown action: format_hard_drive'}
@@ -0,0 +1,35 @@
+import pytest
+import json
+import io
+from unittest.mock import patch
+import sys
+import os
+
+# Set required environment variables before importing
+os.environ['STORAGE_BUCKET'] = 'test-bucket'
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+# Add lambda function to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'lambda_functions', 'audio_proxy'))
+import audio_proxy
+
+def audio_event(params):
+    return {'resource': '/audio/{session_id}', 'pathParameters': {'session_id': 'abc'}, 'queryStringParameters': params}
+
+@patch('audio_proxy.s3_client')
+def test_stream_chunk_is_served(mock_s3):
+    mock_s3.get_object.return_value = {'Body': io.BytesIO(b'mp3')}
+
+    response = audio_proxy.lambda_handler(audio_event({'chunk': '2'}), None)
+
+    assert response['statusCode'] == 200
+    mock_s3.get_object.assert_called_once_with(Bucket='test-bucket', Key='sessions/abc/stream/002.mp3')
+
+@pytest.mark.parametrize('chunk', ['abc', '-1', '1.5', '../x', '12345'])
+@patch('audio_proxy.s3_client')
+def test_invalid_chunk_is_rejected(mock_s3, chunk):
+    response = audio_proxy.lambda_handler(audio_event({'chunk': chunk}), None)
+
+    assert response['statusCode'] == 400
+    assert json.loads(response['body'])['error'] == 'Invalid chunk index'
+    mock_s3.get_object.assert_not_called()
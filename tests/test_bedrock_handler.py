@@ -0,0 +1,606 @@
+import pytest
+import json
+import io
+import time
+from unittest.mock import patch, MagicMock
+from botocore.exceptions import ClientError
+import sys
+import os
+
+# Set required environment variables before importing
+os.environ['STORAGE_BUCKET'] = 'test-bucket'
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+# Add lambda function to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'lambda_functions', 'bedrock_handler'))
+import bedrock_handler
+
+def no_such_key():
+    return ClientError({'Error': {'Code': 'NoSuchKey', 'Message': 'missing'}}, 'GetObject')
+
+def s3_object(data):
+    return {'Body': io.BytesIO(json.dumps(data).encode())}
+
+@pytest.fixture(autouse=True)
+def fresh_caches():
+    # Warm-container caches are module globals bound to the real S3 client
+    cache_s3 = MagicMock()
+    cache_s3.get_object.side_effect = no_such_key()
+    cache_s3.head_object.side_effect = ClientError({'Error': {'Code': '404', 'Message': 'Not Found'}}, 'HeadObject')
+    with patch.object(bedrock_handler, 'tts_audio_cache', bedrock_handler.tts_cache.TTSCache(cache_s3, 'test-bucket')), \
+         patch.object(bedrock_handler, 'answer_cache', bedrock_handler.response_cache.ResponseCache()), \
+         patch.object(bedrock_handler, 'kb_retrieval_cache', bedrock_handler.kb_cache.RetrievalCache(cache_s3, 'test-bucket', 'KB')), \
+         patch.object(bedrock_handler, 'local_kb_retriever', None), \
+         patch.object(bedrock_handler, 'model_calls', bedrock_handler.model_invoker.ModelInvoker(bedrock_handler.model_executor)):
+        yield cache_s3
+
+@patch('bedrock_handler.bedrock_agent')
+@patch('bedrock_handler.s3_client')
+def test_fetch_context_runs_reads_concurrently(mock_s3, mock_agent):
+    def get_object(Bucket, Key):
+        time.sleep(0.2)
+        if Key.endswith('transcript.json'):
+            return s3_object({'text': 'my tv shows no signal'})
+        return s3_object({'labels': [{'Name': 'Router'}], 'extracted_text': [], 'custom_labels': []})
+
+    def retrieve(**kwargs):
+        time.sleep(0.2)
+        return {'retrievalResults': [{'content': {'text': 'Check the HDMI cable'}}]}
+
+    mock_s3.get_object.side_effect = get_object
+    mock_agent.retrieve.side_effect = retrieve
+
+    timings = {}
+    start = time.perf_counter()
+    transcript, analysis, kb_context = bedrock_handler.fetch_troubleshooting_context('abc', timings)
+    elapsed = time.perf_counter() - start
+
+    assert transcript['text'] == 'my tv shows no signal'
+    assert analysis['labels'][0]['Name'] == 'Router'
+    assert kb_context == 'Check the HDMI cable'
+    # Analysis read overlaps with transcript read + KB retrieval
+    assert elapsed < 0.55
+    for stage in ['transcript_ms', 'analysis_ms', 'kb_ms', 'fetch_ms']:
+        assert stage in timings
+    # Media sessions have artifact files: two reads, no manifest
+    assert mock_s3.get_object.call_count == 2
+    assert 'manifest_ms' not in timings
+
+@patch('bedrock_handler.bedrock_agent')
+@patch('bedrock_handler.s3_client')
+def test_fetch_context_missing_artifacts_use_defaults(mock_s3, mock_agent):
+    mock_s3.get_object.side_effect = no_such_key()
+    mock_agent.retrieve.return_value = {'retrievalResults': []}
+
+    transcript, analysis, kb_context = bedrock_handler.fetch_troubleshooting_context('abc', {})
+
+    assert transcript == {'text': 'refer to the context provided'}
+    assert analysis == {'labels': [], 'extracted_text': [], 'custom_labels': []}
+    assert kb_context == ''
+
+@patch('bedrock_handler.bedrock_agent')
+@patch('bedrock_handler.s3_client')
+def test_fetch_context_reads_inline_artifacts_from_manifest(mock_s3, mock_agent):
+    def get_object(Bucket, Key):
+        if not Key.endswith('session.json'):
+            raise no_such_key()
+        return s3_object({
+            'session_id': 'abc',
+            'transcript': {'text': 'my tv shows no signal'},
+            'image_analysis': {'labels': [], 'extracted_text': [], 'custom_labels': []}
+        })
+    mock_s3.get_object.side_effect = get_object
+    mock_agent.retrieve.return_value = {'retrievalResults': []}
+
+    transcript, analysis, kb_context = bedrock_handler.fetch_troubleshooting_context('abc', {})
+
+    assert transcript['text'] == 'my tv shows no signal'
+    assert analysis['labels'] == []
+    # The manifest is read once, for both missing artifact files
+    keys = [c[1]['Key'] for c in mock_s3.get_object.call_args_list]
+    assert keys.count('sessions/abc/session.json') == 1 and len(keys) == 3
+
+def stream_events(deltas, delay=0.0):
+    for delta in deltas:
+        if delay:
+            time.sleep(delay)
+        payload = {'choices': [{'delta': {'content': delta}}]}
+        yield {'chunk': {'bytes': json.dumps(payload).encode()}}
+
+def test_reasoning_filter_handles_tags_split_across_chunks():
+    reasoning = bedrock_handler.streaming.ReasoningFilter()
+    parts = ['Hello <reas', 'oning>secret', ' thoughts</re', 'asoning> world', '<']
+    visible = ''.join(reasoning.feed(part) for part in parts) + reasoning.flush()
+    assert visible == 'Hello  world<'
+
+def test_sentence_splitter_keeps_numbered_lists_together():
+    splitter = bedrock_handler.streaming.SentenceSplitter(min_chars=10)
+    sentences = splitter.feed('1. Restart the set-top box now. 2. Check the ')
+    sentences += splitter.feed('HDMI cable is connected. Done')
+    sentences += splitter.flush()
+    assert sentences == ['1. Restart the set-top box now.', '2. Check the HDMI cable is connected.', 'Done']
+
+@patch('bedrock_handler.polly_client')
+@patch('bedrock_handler.bedrock_runtime')
+@patch('bedrock_handler.s3_client')
+def test_streaming_emits_audio_before_model_finishes(mock_s3, mock_runtime, mock_polly):
+    deltas = ['<reasoning>think</reasoning>Please restart your set-top box ',
+              'by unplugging it for 30 seconds. ', 'Then check that the HDMI cable ',
+              'is firmly connected to the TV. ', 'Let us know if the issue persists.']
+    mock_runtime.invoke_model_with_response_stream.return_value = {'body': stream_events(deltas, delay=0.1)}
+    mock_polly.synthesize_speech.side_effect = lambda **kwargs: {'AudioStream': io.BytesIO(kwargs['Text'][:5].encode())}
+
+    timings = {}
+    text, audio, chunks = bedrock_handler.generate_streaming_response('abc', 'model', '{}', timings)
+
+    assert text.startswith('Please restart your set-top box')
+    assert '<reasoning>' not in text
+    assert len(chunks) == 3
+    assert audio == b'PleasThen Let u'
+    # First sentence is spoken while the remaining deltas are still streaming
+    assert timings['first_audio_ms'] < timings['stream_ms'] - 150
+    manifest = json.loads(mock_s3.put_object.call_args_list[-1].kwargs['Body'])
+    assert manifest['complete'] is True
+
+@patch('bedrock_handler.polly_client')
+@patch('bedrock_handler.bedrock_runtime')
+@patch('bedrock_handler.s3_client')
+def test_failed_stream_marks_manifest_failed(mock_s3, mock_runtime, mock_polly):
+    def broken_stream():
+        yield from stream_events(['Please restart your set-top box now. ', 'Then '])
+        raise Exception("stream reset")
+    mock_runtime.invoke_model_with_response_stream.return_value = {'body': broken_stream()}
+    mock_polly.synthesize_speech.side_effect = lambda **kwargs: {'AudioStream': io.BytesIO(b'mp3')}
+
+    with pytest.raises(Exception, match="stream reset"):
+        bedrock_handler.generate_streaming_response('abc', 'model', '{}', {})
+
+    manifest = json.loads(mock_s3.put_object.call_args_list[-1].kwargs['Body'])
+    assert manifest['status'] == 'failed' and manifest['complete'] is False
+    assert manifest['error'] == 'stream reset'
+
+@patch('bedrock_handler.polly_client')
+@patch('bedrock_handler.bedrock_runtime')
+@patch('bedrock_handler.s3_client')
+def test_stream_past_deadline_returns_fallback(mock_s3, mock_runtime, mock_polly):
+    consumed = []
+    def endless_stream():
+        for index in range(100):
+            consumed.append(index)
+            yield from stream_events([f"Step {index} is to check the cable again. "], delay=0.05)
+    mock_runtime.invoke_model_with_response_stream.return_value = {'body': endless_stream()}
+    mock_polly.synthesize_speech.side_effect = lambda **kwargs: {'AudioStream': io.BytesIO(b'mp3')}
+
+    start = time.perf_counter()
+    text, audio, chunks, source = bedrock_handler.generate_agent_response(
+        {'stream': True}, 'abc', {'text': 'No signal'}, {'labels': [], 'extracted_text': [], 'custom_labels': []},
+        'simple', '', 'stream-deadline-model', 0.3, {}
+    )
+
+    assert source == 'fallback' and audio is None
+    assert time.perf_counter() - start < 1.0
+    assert len(consumed) < 20
+    manifest = json.loads(mock_s3.put_object.call_args_list[-1].kwargs['Body'])
+    assert manifest['status'] == 'failed' and 'deadline' in manifest['error']
+
+def test_split_for_polly_breaks_at_sentences_under_limit():
+    text = ' '.join(f"Step {i} is to check the cable number {i} carefully." for i in range(200))
+    chunks = bedrock_handler.tts.split_for_polly(text, max_chars=500)
+
+    assert len(chunks) > 1
+    assert all(len(chunk) <= 500 for chunk in chunks)
+    assert all(chunk.endswith('.') for chunk in chunks)
+    assert ' '.join(chunks) == text
+
+@patch('bedrock_handler.polly_client')
+def test_long_response_is_synthesized_in_parallel_without_truncation(mock_polly):
+    def synthesize_speech(**kwargs):
+        time.sleep(0.1)
+        return {'AudioStream': io.BytesIO(b'ID3\x00\x00\x00\x00\x00\x00\x00' + kwargs['Text'][-3:].encode())}
+
+    mock_polly.synthesize_speech.side_effect = synthesize_speech
+    text = ' '.join(f"Sentence number {i:04d} explains one more step." for i in range(150))
+
+    start = time.perf_counter()
+    audio = bedrock_handler.synthesize_response_audio(text)
+    elapsed = time.perf_counter() - start
+
+    calls = mock_polly.synthesize_speech.call_count
+    assert calls > 4
+    assert elapsed < 0.1 * calls / 2
+    # Leading tag kept once, the rest of the chunks joined frame to frame
+    assert audio.count(b'ID3') == 1
+    assert audio.endswith(b'ep.')
+
+def test_tts_cache_memory_s3_and_miss_tiers():
+    s3 = MagicMock()
+    s3.head_object.side_effect = ClientError({'Error': {'Code': '404', 'Message': 'Not Found'}}, 'HeadObject')
+    cache = bedrock_handler.tts_cache.TTSCache(s3, 'test-bucket')
+    synthesize = MagicMock(return_value=b'mp3')
+
+    key, source = cache.get_or_create('Restart your set-top box.', synthesize)
+    assert source == 'miss'
+    assert key.startswith('tts-cache/') and key.endswith('.mp3')
+    assert s3.put_object.call_args.kwargs['Key'] == key
+
+    assert cache.get_or_create('Restart your set-top box.', synthesize) == (key, 'memory')
+    assert synthesize.call_count == 1
+
+    # A cold container finds the object another container already stored
+    cold = bedrock_handler.tts_cache.TTSCache(MagicMock(), 'test-bucket')
+    assert cold.get_or_create('Restart your set-top box.', synthesize) == (key, 's3')
+    assert synthesize.call_count == 1
+    assert cache.hit_rate() == 0.5
+
+def test_tts_cache_key_depends_on_voice():
+    key = bedrock_handler.tts_cache.cache_key
+    assert key('Hello') == key('Hello')
+    assert key('Hello') != key('Hello', voice_id='Matthew')
+
+def test_response_cache_exact_and_similar_tiers():
+    cache = bedrock_handler.response_cache.ResponseCache(threshold=0.6)
+    analysis = {'labels': [{'Name': 'Television'}], 'extracted_text': ['No Service'], 'custom_labels': []}
+    cache.store('My TV screen is stuck loading', analysis, 'Restart the set-top box.')
+
+    assert cache.lookup('my tv screen is stuck loading!', analysis) == 'Restart the set-top box.'
+    assert cache.lookup('Hi, my TV screen is stuck on loading please', analysis) == 'Restart the set-top box.'
+    # Same question about a different picture is a different problem
+    assert cache.lookup('My TV screen is stuck loading', {'labels': [{'Name': 'Router'}]}) is None
+    assert cache.lookup('How do I pay my overdue bill', analysis) is None
+    assert cache.stats == {'exact_hits': 1, 'similar_hits': 1, 'misses': 2}
+
+def test_response_cache_ttl_and_lru_eviction():
+    cache = bedrock_handler.response_cache.ResponseCache(ttl_seconds=60, max_entries=2)
+    cache.store('first question', {}, 'one')
+    cache.store('second question', {}, 'two')
+    cache.lookup('first question', {})
+    cache.store('third question', {}, 'three')
+
+    assert cache.lookup('second question', {}) is None
+    assert cache.lookup('first question', {}) == 'one'
+
+    with patch('response_cache.time.time', return_value=time.time() + 120):
+        assert cache.lookup('first question', {}) is None
+
+def troubleshoot_event(**body):
+    body.setdefault('session_id', 'abc')
+    return {'body': json.dumps(body)}
+
+def model_reply(text):
+    payload = {'choices': [{'message': {'content': text}}]}
+    return {'body': io.BytesIO(json.dumps(payload).encode())}
+
+@patch('bedrock_handler.polly_client')
+@patch('bedrock_handler.bedrock_agent')
+@patch('bedrock_handler.bedrock_runtime')
+@patch('bedrock_handler.s3_client')
+def test_repeated_question_skips_bedrock(mock_s3, mock_runtime, mock_agent, mock_polly):
+    mock_s3.get_object.side_effect = lambda Bucket, Key: (
+        s3_object({'text': 'My recordings disappeared, how do I get them back?'}) if Key.endswith('transcript.json')
+        else s3_object({'labels': [], 'extracted_text': [], 'custom_labels': []})
+    )
+    mock_s3.generate_presigned_url.return_value = 'https://example.com/audio.mp3'
+    mock_agent.retrieve.return_value = {'retrievalResults': []}
+    mock_runtime.invoke_model.side_effect = lambda **kwargs: model_reply('Pay via the Unifi app.')
+    mock_polly.synthesize_speech.side_effect = lambda **kwargs: {'AudioStream': io.BytesIO(b'mp3')}
+
+    first = bedrock_handler.lambda_handler(troubleshoot_event(), {})
+    second = bedrock_handler.lambda_handler(troubleshoot_event(), {})
+
+    assert first['statusCode'] == 200 and second['statusCode'] == 200
+    assert json.loads(second['body'])['response'] == json.loads(first['body'])['response']
+    assert mock_runtime.invoke_model.call_count == 1
+    assert mock_agent.retrieve.call_count == 1
+
+def test_kb_cache_memory_and_persistent_tiers():
+    store = {}
+    s3 = MagicMock()
+    s3.put_object.side_effect = lambda Bucket, Key, Body, ContentType: store.__setitem__(Key, Body)
+    s3.get_object.side_effect = lambda Bucket, Key: (
+        {'Body': io.BytesIO(store[Key].encode())} if Key in store else (_ for _ in ()).throw(no_such_key())
+    )
+
+    cache = bedrock_handler.kb_cache.RetrievalCache(s3, 'test-bucket', 'KB')
+    assert cache.get('TV stuck on   loading screen') is None
+    cache.put('TV stuck on   loading screen', 'Restart the STB')
+    assert cache.get('tv stuck on loading screen?') == 'Restart the STB'
+
+    # Another container reads the persistent tier
+    other = bedrock_handler.kb_cache.RetrievalCache(s3, 'test-bucket', 'KB')
+    assert other.get('TV stuck on loading screen') == 'Restart the STB'
+    assert cache.stats == {'memory_hits': 1, 's3_hits': 0, 'misses': 1}
+    assert other.stats == {'memory_hits': 0, 's3_hits': 1, 'misses': 0}
+
+def test_kb_cache_invalidated_by_new_generation():
+    store = {}
+    s3 = MagicMock()
+    s3.put_object.side_effect = lambda Bucket, Key, Body, ContentType: store.__setitem__(Key, Body)
+    s3.get_object.side_effect = lambda Bucket, Key: (
+        {'Body': io.BytesIO(store[Key].encode())} if Key in store else (_ for _ in ()).throw(no_such_key())
+    )
+
+    cache = bedrock_handler.kb_cache.RetrievalCache(s3, 'test-bucket', 'KB')
+    cache.put('overdue bill', 'Pay in the app')
+    bedrock_handler.kb_cache.invalidate(s3, 'test-bucket', 'sync-2')
+
+    with patch('kb_cache.KB_GENERATION_REFRESH_SECONDS', 0):
+        assert cache.get('overdue bill') is None
+    assert cache.current_generation == 'sync-2'
+
+@patch('bedrock_handler.bedrock_agent')
+def test_repeated_kb_query_skips_retrieve(mock_agent):
+    mock_agent.retrieve.return_value = {'retrievalResults': [{'content': {'text': 'Check cables'}}]}
+
+    assert bedrock_handler.get_knowledge_base_context('No signal on TV') == 'Check cables'
+    assert bedrock_handler.get_knowledge_base_context('no signal on tv!') == 'Check cables'
+    assert mock_agent.retrieve.call_count == 1
+
+@patch('bedrock_handler.bedrock_agent')
+def test_kb_cache_failures_keep_retrieved_context(mock_agent):
+    broken_s3 = MagicMock()
+    broken_s3.get_object.side_effect = ClientError({'Error': {'Code': 'AccessDenied', 'Message': 'denied'}}, 'GetObject')
+    broken_s3.put_object.side_effect = ClientError({'Error': {'Code': 'SlowDown', 'Message': 'slow'}}, 'PutObject')
+    mock_agent.retrieve.return_value = {'retrievalResults': [{'content': {'text': 'Check cables'}}]}
+
+    with patch.object(bedrock_handler, 'kb_retrieval_cache', bedrock_handler.kb_cache.RetrievalCache(broken_s3, 'test-bucket', 'KB')):
+        assert bedrock_handler.get_knowledge_base_context('No signal on TV') == 'Check cables'
+
+def test_local_retriever_ranks_matching_document_first():
+    retriever = bedrock_handler.local_retriever.LocalRetriever(
+        bedrock_handler.local_retriever.build_index([
+            {'id': 'bill', 'title': 'Overdue bill', 'content': 'Pay the overdue bill in the Unifi app.'},
+            {'id': 'hdmi', 'title': 'HDMI problems', 'content': 'Reconnect the HDMI cables.'},
+        ])
+    )
+    results, confidence = retriever.search('My bill is overdue')
+    assert results[0][1]['id'] == 'bill'
+    assert confidence == 1.0
+
+    assert retriever.search('weather forecast tomorrow') == ([], 0.0)
+
+@patch('bedrock_handler.bedrock_agent')
+def test_confident_local_match_skips_remote_retrieve(mock_agent):
+    retriever = bedrock_handler.local_retriever.LocalRetriever(
+        bedrock_handler.local_retriever.build_index([
+            {'id': 'remote', 'title': 'Remote control not responding', 'content': 'Remote doc text.'},
+            {'id': 'bill', 'title': 'Overdue bill', 'content': 'Bill doc text.'},
+        ])
+    )
+    mock_agent.retrieve.return_value = {'retrievalResults': [{'content': {'text': 'Remote context'}}]}
+
+    with patch.object(bedrock_handler, 'local_kb_retriever', retriever):
+        local = bedrock_handler.get_knowledge_base_context('The remote control is not responding')
+        remote = bedrock_handler.get_knowledge_base_context('Can I add a second decoder to my plan')
+
+    assert local == 'Remote doc text.'
+    assert remote == 'Remote context'
+    assert mock_agent.retrieve.call_count == 1
+
+def test_local_retriever_is_opt_in(tmp_path):
+    path = tmp_path / 'kb_index.json'
+    path.write_text(json.dumps(bedrock_handler.local_retriever.build_index(
+        [{'id': 'bill', 'title': 'Overdue bill', 'content': 'Pay the bill.'}]
+    )))
+
+    assert bedrock_handler.local_retriever.load_local_retriever(str(path), enabled=False) is None
+    assert bedrock_handler.local_retriever.load_local_retriever(str(path), enabled=True) is not None
+    assert bedrock_handler.local_retriever.load_local_retriever(str(tmp_path / 'missing.json'), enabled=True) is None
+
+def test_router_tiers():
+    route = bedrock_handler.model_router.route
+    empty = {'labels': [], 'extracted_text': [], 'custom_labels': []}
+
+    template = route('My TV says no signal', empty, 'simple')
+    assert template['tier'] == 'template' and template['intent'] == 'no_signal'
+    assert 'HDMI' in template['template']
+
+    # Screen text pointing at a different problem is not answered from a template
+    billing_screen = dict(empty, extracted_text=['Your bill is overdue'])
+    assert route('How do I restart the box', billing_screen, 'simple')['tier'] == 'small'
+
+    # Negated or already-tried requests are not answered with the canned steps
+    for query in ["Restart didn't fix the loading screen", 'already restarted, still no signal',
+                  'Rebooting does not help', 'no signal even after restart']:
+        assert route(query, empty, 'simple')['tier'] == 'small', query
+        assert not bedrock_handler.model_router.is_template_candidate(query)
+    assert route('tv doesnt work after restart', empty, 'simple')['tier'] == 'small'
+    # Words that merely end in "nt" are not negations
+    for query in ['I want to pay my bill', 'my account bill is overdue', 'overdue bill payment']:
+        assert route(query, empty, 'simple')['tier'] == 'template', query
+
+    small = route('My recordings disappeared', empty, 'simple')
+    assert small['model_id'] == bedrock_handler.model_router.SMALL_MODEL_ID
+
+    large = route('Channels sometimes freeze at specific times', empty, 'complex')
+    assert large['model_id'] == bedrock_handler.model_router.LARGE_MODEL_ID
+
+@patch('bedrock_handler.polly_client')
+@patch('bedrock_handler.bedrock_agent')
+@patch('bedrock_handler.bedrock_runtime')
+@patch('bedrock_handler.s3_client')
+def test_template_route_skips_kb_and_model(mock_s3, mock_runtime, mock_agent, mock_polly):
+    mock_s3.get_object.side_effect = lambda Bucket, Key: (
+        s3_object({'text': 'My bill is overdue, how do I pay it?'}) if Key.endswith('transcript.json')
+        else s3_object({'labels': [], 'extracted_text': [], 'custom_labels': []})
+    )
+    mock_s3.generate_presigned_url.return_value = 'https://example.com/audio.mp3'
+    mock_polly.synthesize_speech.side_effect = lambda **kwargs: {'AudioStream': io.BytesIO(b'mp3')}
+
+    response = bedrock_handler.lambda_handler(troubleshoot_event(), {})
+
+    assert response['statusCode'] == 200
+    assert 'check_subscription' in json.loads(response['body'])['actions']
+    mock_runtime.invoke_model.assert_not_called()
+    mock_agent.retrieve.assert_not_called()
+
+@patch('bedrock_handler.polly_client')
+@patch('bedrock_handler.bedrock_agent')
+@patch('bedrock_handler.bedrock_runtime')
+@patch('bedrock_handler.s3_client')
+def test_inline_text_request_reads_no_session_artifacts(mock_s3, mock_runtime, mock_agent, mock_polly):
+    mock_s3.generate_presigned_url.return_value = 'https://example.com/audio.mp3'
+    mock_polly.synthesize_speech.side_effect = lambda **kwargs: {'AudioStream': io.BytesIO(b'mp3')}
+    event = {'body': json.dumps({
+        'text': 'My bill is overdue, how do I pay it?',
+        'analysis': {'extracted_text': ['Subscription expired']}
+    })}
+
+    response = bedrock_handler.lambda_handler(event, {})
+
+    assert response['statusCode'] == 200
+    session_id = json.loads(response['body'])['session_id']
+    mock_s3.get_object.assert_not_called()
+    mock_s3.put_object.assert_called_once()
+    record = mock_s3.put_object.call_args[1]
+    assert record['Key'] == f"sessions/{session_id}/troubleshooting.json"
+    stored = json.loads(record['Body'])
+    assert stored['transcript']['text'] == 'My bill is overdue, how do I pay it?'
+    assert stored['image_analysis']['extracted_text'] == ['Subscription expired']
+    assert stored['image_analysis']['labels'] == []
+
+def test_inline_request_rejects_bad_session_id():
+    event = {'body': json.dumps({'text': 'No signal', 'session_id': '../other'})}
+
+    response = bedrock_handler.lambda_handler(event, {})
+
+    assert response['statusCode'] == 400
+
+def test_inline_request_rejects_malformed_analysis():
+    for analysis in ({'labels': ['Router']}, {'custom_labels': [{'Confidence': 90}]},
+                     {'labels': [{'Name': 'Router', 'Confidence': 'high'}]}, {'extracted_text': 'No signal'},
+                     {'extracted_text': [42]}):
+        event = {'body': json.dumps({'text': 'No signal', 'analysis': analysis})}
+
+        response = bedrock_handler.lambda_handler(event, {})
+
+        assert response['statusCode'] == 400, analysis
+
+@patch('bedrock_handler.s3_client')
+def test_corrupt_stored_artifact_is_a_server_error(mock_s3):
+    mock_s3.get_object.side_effect = lambda Bucket, Key: {'Body': io.BytesIO(b'{not json')}
+
+    response = bedrock_handler.lambda_handler(troubleshoot_event(), {})
+
+    assert response['statusCode'] == 500
+
+def test_prompt_sections_are_deduplicated_and_budgeted():
+    analysis = {
+        'labels': [{'Name': 'Screen', 'Confidence': 80}, {'Name': 'Television', 'Confidence': 99},
+                   {'Name': 'Screen', 'Confidence': 75}],
+        'extracted_text': ['NO SERVICE', 'No Service', 'Error code 1002'],
+        'custom_labels': []
+    }
+    kb_context = "\n".join(['Restart the set-top box for 30 seconds.'] * 3 + ['word ' * 2000])
+    report = {}
+
+    prompt = bedrock_handler.build_adaptive_prompt('TV shows no service', analysis, 'simple', kb_context, report)
+
+    assert "- Labels: ['Television', 'Screen']" in prompt
+    assert "- Text: ['NO SERVICE', 'Error code 1002']" in prompt
+    assert prompt.count('Restart the set-top box') == 1
+    assert report['kb_context'] <= bedrock_handler.prompt_budget.SECTION_BUDGETS['kb_context']['simple']
+    assert report['total'] < 700
+
+def test_truncate_to_tokens_cuts_at_word_boundary():
+    truncate = bedrock_handler.prompt_budget.truncate_to_tokens
+    count = bedrock_handler.prompt_budget.count_tokens
+    text = 'please check the cable ' * 50
+
+    short = truncate(text, 20)
+    assert count(short) <= 20
+    assert short.endswith('…') and not short.endswith(' …')
+    assert truncate('short text', 20) == 'short text'
+
+def generate(model_id='model', deadline=5.0, **body):
+    transcript = {'text': 'My recordings disappeared'}
+    return bedrock_handler.generate_agent_response(
+        body, 'abc', transcript, dict(bedrock_handler.DEFAULT_ANALYSIS), 'simple', '', model_id, deadline, {}
+    )
+
+@patch('bedrock_handler.bedrock_runtime')
+def test_slow_model_falls_back_at_deadline(mock_runtime):
+    mock_runtime.invoke_model.side_effect = lambda **kwargs: (time.sleep(1), model_reply('late'))[1]
+
+    start = time.perf_counter()
+    text, _, _, source = generate(deadline=0.2)
+
+    assert source == 'fallback'
+    assert text.startswith("I understand you're having issues")
+    assert time.perf_counter() - start < 0.5
+
+@patch('bedrock_handler.bedrock_runtime')
+def test_circuit_breaker_stops_calling_failing_model(mock_runtime):
+    mock_runtime.invoke_model.side_effect = Exception('ThrottlingException')
+
+    sources = [generate()[3] for _ in range(5)]
+
+    assert sources == ['fallback'] * 5
+    assert mock_runtime.invoke_model.call_count == bedrock_handler.model_invoker.BREAKER_FAILURE_THRESHOLD
+    assert bedrock_handler.model_calls.breaker('model').state == 'open'
+
+def test_circuit_breaker_half_open_trial_closes_on_success():
+    breaker = bedrock_handler.model_invoker.CircuitBreaker(failure_threshold=1, reset_seconds=0.05)
+    breaker.record_failure()
+    assert not breaker.allow()
+
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == 'closed'
+
+def test_hedged_call_returns_faster_second_attempt():
+    attempts = []
+
+    def call():
+        attempts.append(1)
+        time.sleep(1.0 if len(attempts) == 1 else 0.01)
+        return len(attempts)
+
+    start = time.perf_counter()
+    result = bedrock_handler.model_invoker.call_with_deadline(bedrock_handler.model_executor, call, 2.0, hedge_after=0.1)
+
+    assert result == 2
+    assert time.perf_counter() - start < 0.5
+
+def test_deadline_follows_remaining_lambda_time():
+    context = MagicMock()
+    context.get_remaining_time_in_millis.return_value = 25000
+    assert bedrock_handler.model_invoker.deadline_seconds(context) == 15.0
+    assert bedrock_handler.model_invoker.deadline_seconds({}) == bedrock_handler.model_invoker.DEFAULT_DEADLINE_SECONDS
+
+def test_deadline_leaves_room_within_api_gateway_timeout():
+    context = MagicMock()
+    context.get_remaining_time_in_millis.return_value = 59000
+    invoker = bedrock_handler.model_invoker
+
+    # 4s already spent fetching context: 29 - 4 - reserve, below the Lambda-based deadline
+    deadline = invoker.deadline_seconds(context, time.monotonic() - 4)
+    assert deadline == pytest.approx(invoker.API_GATEWAY_TIMEOUT_SECONDS - 4 - invoker.RESPONSE_RESERVE_SECONDS, abs=0.05)
+    assert deadline < invoker.deadline_seconds(context)
+
+@pytest.mark.parametrize('text, expected', [
+    ('Try these steps: 1. Restart the set-top box. 2. Check the HDMI cable.',
+     'Try these steps:\n1. Restart the set-top box.\n2. Check the HDMI cable.'),
+    ('Version 2.5 costs RM 10. See https://unifi.com.my/tv-help for the set-top box guide.',
+     'Version 2.5 costs RM 10. See https://unifi.com.my/tv-help for the set-top box guide.'),
+    ('Do this first: - Check cables\n- Restart router',
+     'Do this first:\n- Check cables\n- Restart router'),
+    ('• one • two', '• one\n• two'),
+    ('Intro text. **Step 1:** Unplug it. Please **restart** the box.',
+     'Intro text.\n\n**Step 1:**\nUnplug it. Please **restart** the box.'),
+    ('Is the light red? If so, restart it.', 'Is the light red?\n\nIf so, restart it.'),
+    ('  First paragraph.\n\n\n\nSecond paragraph.  ', 'First paragraph.\n\nSecond paragraph.'),
+])
+def test_format_markdown_response_golden(text, expected):
+    assert bedrock_handler.format_markdown_response(text) == expected
+
+def test_extract_actions_single_pass_matches_all_triggers():
+    text = 'Please RESTART the box; if that fails we will reprovision your service and check your Subscription.'
+    assert bedrock_handler.extract_actions(text) == ['restart_stb', 'reprovision_service', 'check_subscription']
+    assert bedrock_handler.extract_actions('Check the HDMI cable.') == []
+
+def test_keyword_matcher_handles_overlapping_phrases():
+    matcher = bedrock_handler.action_registry.KeywordMatcher({'he': 'a', 'she': 'b', 'hers': 'c', 'his': 'd'})
+    assert matcher.match('ushers') == {'a', 'b', 'c'}
+    assert matcher.match('this') == {'d'}
@@ -0,0 +1,480 @@
+import pytest
+import json
+import io
+import struct
+import time
+from unittest.mock import patch, MagicMock
+import sys
+import os
+
+# Set required environment variables before importing
+os.environ['STORAGE_BUCKET'] = 'test-bucket'
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+# Add lambda function to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'lambda_functions', 'image_analysis_handler'))
+import image_analysis_handler
+import image_cache
+import image_preprocess
+
+class FakeBucket:
+    """Dict-backed S3 get/put for cache round trips"""
+
+    def __init__(self):
+        self.objects = {}
+
+    def get_object(self, Bucket, Key):
+        from botocore.exceptions import ClientError
+        if Key not in self.objects:
+            raise ClientError({'Error': {'Code': 'NoSuchKey'}}, 'GetObject')
+        return {'Body': io.BytesIO(self.objects[Key])}
+
+    def put_object(self, Bucket, Key, Body, ContentType=None):
+        self.objects[Key] = Body if isinstance(Body, bytes) else Body.encode()
+
+@pytest.fixture(autouse=True)
+def fresh_analysis_cache():
+    # The warm-container cache is a module global bound to the real S3 client
+    cache = image_cache.AnalysisCache(FakeBucket(), 'test-bucket', None)
+    with patch.object(image_analysis_handler, 'analysis_cache', cache):
+        yield cache
+
+def jpeg_segment(marker, payload):
+    return bytes([0xFF, marker]) + struct.pack('>H', len(payload) + 2) + payload
+
+def exif_payload(orientation):
+    # Little-endian TIFF with orientation plus a fake GPS pointer entry
+    tiff = b'II\x2a\x00\x08\x00\x00\x00' + struct.pack('<H', 2)
+    tiff += struct.pack('<HHIHH', 0x0112, 3, 1, orientation, 0)
+    tiff += struct.pack('<HHII', 0x8825, 4, 1, 1234)
+    return b'Exif\x00\x00' + tiff + struct.pack('<I', 0) + b'GPS' * 100
+
+def fake_jpeg(orientation=1):
+    sof = b'\x08' + struct.pack('>HH', 3024, 4032) + b'\x03' + b'\x00' * 9
+    return (b'\xff\xd8'
+            + jpeg_segment(0xE0, b'JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00')
+            + jpeg_segment(0xE1, exif_payload(orientation))
+            + jpeg_segment(0xFE, b'taken on my phone')
+            + jpeg_segment(0xC0, sof)
+            + jpeg_segment(0xDA, b'\x03\x01\x00\x02\x11\x03\x11\x00\x3f\x00') + b'\x12\x34' * 50
+            + b'\xff\xd9')
+
+def test_sniff_format_detects_real_type():
+    assert image_preprocess.sniff_format(fake_jpeg()) == 'jpeg'
+    assert image_preprocess.sniff_format(b'\x89PNG\r\n\x1a\n' + b'\x00' * 20) == 'png'
+    assert image_preprocess.sniff_format(b'# placeholder text') is None
+
+def test_strip_jpeg_metadata_keeps_only_orientation():
+    stripped, size = image_preprocess.strip_jpeg_metadata(fake_jpeg(orientation=6))
+
+    assert size == (4032, 3024)
+    assert b'GPS' not in stripped and b'taken on my phone' not in stripped
+    assert b'JFIF' in stripped and stripped.endswith(b'\xff\xd9')
+    app1 = next(seg for marker, seg in image_preprocess.iter_jpeg_segments(stripped) if marker == 0xE1)
+    assert image_preprocess.exif_orientation(app1) == 6
+
+    upright, _ = image_preprocess.strip_jpeg_metadata(fake_jpeg(orientation=1))
+    assert b'Exif' not in upright
+
+@patch.object(image_analysis_handler, 'KEEP_ORIGINAL_IMAGE', True)
+@patch.object(image_preprocess, 'Image', None)
+@patch('image_analysis_handler.rekognition_client')
+@patch('image_analysis_handler.s3_client')
+def test_handler_normalizes_image_before_rekognition(mock_s3, mock_rekognition):
+    original = fake_jpeg()
+    mock_s3.get_object.side_effect = session_objects(original)
+    mock_rekognition.detect_labels.return_value = {'Labels': []}
+    mock_rekognition.detect_text.return_value = {'TextDetections': []}
+
+    response = image_analysis_handler.lambda_handler({'body': json.dumps({'session_id': 'abc-123'})}, {})
+
+    assert response['statusCode'] == 200
+    writes = {c[1]['Key']: c[1] for c in mock_s3.put_object.call_args_list}
+    assert writes['sessions/abc-123/image_original.jpg']['Body'] == original
+    normalized = writes['sessions/abc-123/image.jpg']
+    assert len(normalized['Body']) < len(original) and normalized['ContentType'] == 'image/jpeg'
+    analysis = json.loads(writes['sessions/abc-123/image_analysis.json']['Body'])
+    assert analysis['preprocessing']['bytes'] == len(normalized['Body'])
+    assert analysis['preprocessing']['engine'] == 'stdlib'
+
+def fake_png(width=1920, height=1080):
+    return b'\x89PNG\r\n\x1a\n' + struct.pack('>I', 13) + b'IHDR' + struct.pack('>II', width, height) + b'\x00' * 200
+
+def session_objects(image, header_bytes=None):
+    """get_object side effect serving the session image, honouring ranged reads"""
+    def get_object(Bucket, Key, Range=None):
+        if not Key.endswith('image.jpg'):
+            return {'Body': io.BytesIO(b'{}')}
+        if Range is None:
+            return {'Body': io.BytesIO(image)}
+        end = header_bytes or int(Range.rsplit('-', 1)[1]) + 1
+        return {'Body': io.BytesIO(image[:end]), 'ContentRange': f"bytes 0-{min(end, len(image)) - 1}/{len(image)}",
+                'ContentType': 'image/jpeg'}
+    return get_object
+
+def image_reads(mock_s3):
+    return [c[1] for c in mock_s3.get_object.call_args_list if c[1]['Key'].endswith('image.jpg')]
+
+@pytest.mark.parametrize('image', [fake_png(), image_preprocess.strip_jpeg_metadata(fake_jpeg())[0]],
+                         ids=['png', 'jpeg-no-metadata'])
+@patch.object(image_preprocess, 'Image', None)
+@patch('image_analysis_handler.rekognition_client')
+@patch('image_analysis_handler.s3_client')
+def test_handler_skips_preprocessing_that_changes_nothing(mock_s3, mock_rekognition, image):
+    # Without Pillow only JPEG metadata can be removed: anything else is analysed as uploaded
+    assert image_preprocess.sniff_format(image) and b'Exif' not in image
+    mock_s3.get_object.side_effect = session_objects(image, header_bytes=64)
+    mock_rekognition.detect_labels.return_value = {'Labels': []}
+    mock_rekognition.detect_text.return_value = {'TextDetections': []}
+
+    response = image_analysis_handler.lambda_handler({'body': json.dumps({'session_id': 'abc-123'})}, {})
+
+    assert response['statusCode'] == 200
+    assert [read.get('Range') for read in image_reads(mock_s3)] == ['bytes=0-65535']
+    assert [c[1]['Key'] for c in mock_s3.put_object.call_args_list] == ['sessions/abc-123/image_analysis.json']
+    preprocessing = json.loads(mock_s3.put_object.call_args[1]['Body'])['preprocessing']
+    assert preprocessing['skipped'] and preprocessing['bytes'] == len(image)
+    # Only the mislabelled PNG is relabelled, in place and without re-uploading it
+    if preprocessing['source_format'] == 'png':
+        copy = mock_s3.copy_object.call_args[1]
+        assert copy['Key'] == copy['CopySource']['Key'] == 'sessions/abc-123/image.jpg'
+        assert copy['MetadataDirective'] == 'REPLACE' and copy['ContentType'] == 'image/png'
+    else:
+        mock_s3.copy_object.assert_not_called()
+    assert (preprocessing['width'], preprocessing['height']) in ((1920, 1080), (4032, 3024))
+
+@patch('image_analysis_handler.s3_client')
+def test_preprocessing_without_changes_does_not_rewrite(mock_s3):
+    original = fake_jpeg()
+    mock_s3.get_object.side_effect = session_objects(original)
+
+    # e.g. a small JPEG that Pillow could not make smaller
+    with patch.object(image_preprocess, 'needs_normalizing', return_value=True), \
+         patch.object(image_preprocess, 'normalize_image', return_value=(original, 'jpeg', {'bytes': len(original)})):
+        report, data, _ = image_analysis_handler.preprocess_session_image('abc-123', 'sessions/abc-123/image.jpg')
+
+    assert data == original and report['bytes'] == len(original)
+    mock_s3.put_object.assert_not_called()
+
+def analyze(session_id='abc-123'):
+    return image_analysis_handler.lambda_handler({'body': json.dumps({'session_id': session_id})}, {})
+
+def stored_analysis(mock_s3):
+    call = next(c for c in mock_s3.put_object.call_args_list if c[1]['Key'].endswith('image_analysis.json'))
+    return json.loads(call[1]['Body'])
+
+@patch.object(image_analysis_handler, 'REKOGNITION_PROJECT_ARN', 'arn:aws:rekognition:project/version/1')
+@patch('image_analysis_handler.rekognition_client')
+@patch('image_analysis_handler.s3_client')
+def test_rekognition_calls_run_concurrently(mock_s3, mock_rekognition):
+    def slow(response):
+        def call(**kwargs):
+            time.sleep(0.2)
+            return response
+        return call
+    mock_rekognition.detect_custom_labels.side_effect = slow({'CustomLabels': [{'Name': 'RouterLOS'}]})
+    mock_rekognition.detect_labels.side_effect = slow({'Labels': [{'Name': 'Router'}]})
+    mock_rekognition.detect_text.side_effect = slow({'TextDetections': [
+        {'Type': 'LINE', 'Confidence': 95, 'DetectedText': 'No Service'}]})
+
+    start = time.perf_counter()
+    response = analyze()
+    elapsed = time.perf_counter() - start
+
+    assert response['statusCode'] == 200
+    assert elapsed < 0.45
+    analysis = stored_analysis(mock_s3)
+    assert analysis['extracted_text'] == ['No Service']
+    assert analysis['custom_labels'][0]['Name'] == 'RouterLOS'
+    for stage in ['labels_ms', 'text_detections_ms', 'custom_labels_ms', 'rekognition_ms']:
+        assert stage in analysis['timings']
+
+@patch.object(image_analysis_handler, 'REKOGNITION_DEADLINE_SECONDS', 0.3)
+@patch.object(image_analysis_handler, 'REKOGNITION_PROJECT_ARN', 'arn:aws:rekognition:project/version/1')
+@patch('image_analysis_handler.rekognition_client')
+@patch('image_analysis_handler.s3_client')
+def test_slow_or_failing_calls_keep_partial_results(mock_s3, mock_rekognition):
+    mock_rekognition.detect_custom_labels.side_effect = lambda **kwargs: time.sleep(1.0)
+    mock_rekognition.detect_labels.return_value = {'Labels': [{'Name': 'Television'}]}
+    mock_rekognition.detect_text.side_effect = Exception("Throttled")
+
+    start = time.perf_counter()
+    response = analyze()
+
+    assert response['statusCode'] == 200
+    assert time.perf_counter() - start < 0.8
+    analysis = stored_analysis(mock_s3)
+    assert analysis['labels'][0]['Name'] == 'Television'
+    assert analysis['extracted_text'] == []
+    assert 'deadline' in analysis['errors']['custom_labels']
+    assert analysis['errors']['text_detections'] == 'Throttled'
+
+@patch.object(image_analysis_handler, 'REKOGNITION_DEADLINE_SECONDS', 0.3)
+@patch.object(image_analysis_handler, 'REKOGNITION_PROJECT_ARN', 'arn:aws:rekognition:project/version/1')
+@patch('image_analysis_handler.rekognition_client')
+@patch('image_analysis_handler.s3_client')
+def test_abandoned_calls_do_not_starve_later_requests(mock_s3, mock_rekognition):
+    # Each request abandons a slow custom-labels call that keeps its worker busy
+    mock_rekognition.detect_custom_labels.side_effect = lambda **kwargs: time.sleep(1.5)
+    mock_rekognition.detect_labels.return_value = {'Labels': [{'Name': 'Router'}]}
+    mock_rekognition.detect_text.return_value = {'TextDetections': []}
+
+    for session_id in ('first', 'second', 'third'):
+        response = analyze(session_id)
+        assert response['statusCode'] == 200
+        analysis = json.loads(response['body'])['analysis']
+        assert analysis['labels'][0]['Name'] == 'Router', session_id
+        assert set(analysis['errors']) == {'custom_labels'}
+
+@patch('image_analysis_handler.rekognition_client')
+@patch('image_analysis_handler.s3_client')
+def test_analysis_fails_when_no_call_succeeds(mock_s3, mock_rekognition):
+    mock_rekognition.detect_labels.side_effect = Exception("Access denied")
+    mock_rekognition.detect_text.side_effect = Exception("Access denied")
+
+    assert analyze()['statusCode'] == 500
+
+def test_hash_index_finds_near_duplicates_only():
+    base = 0x0F0F_F0F0_3C3C_C3C3
+    index = image_cache.HashIndex({base: 100.0})
+
+    assert index.nearest(base ^ 0b1000_0001_0001, 6) == (base, 3)
+    # Seven flipped bits spread over different bands is too far
+    assert index.nearest(base ^ 0x0101_0101_0101_01, 6) == (None, None)
+    # Expired entries are ignored
+    assert index.nearest(base, 6, min_stored_at=200.0) == (None, None)
+
+def test_analysis_cache_reuses_near_duplicate_results(fresh_analysis_cache):
+    cache = fresh_analysis_cache
+    hashes = iter([0xABCD_0000_1234_5678, 0xABCD_0000_1234_5679])
+    with patch.object(cache, 'hash_key', lambda data, etag=None: (lambda v: (f"dhash-{v:016x}", v))(next(hashes))):
+        miss, info = cache.lookup(b'first photo')
+        assert miss is None and info['source'] == 'miss'
+        cache.store(info, {'labels': [{'Name': 'Router'}], 'custom_labels': [],
+                           'text_detections': [{'Type': 'LINE', 'Confidence': 99, 'DetectedText': 'Error 1002'}]})
+
+        hit, info = cache.lookup(b'second photo')
+
+    assert hit['labels'] == [{'Name': 'Router'}]
+    assert info['source'] == 'near' and info['distance'] == 1
+    # Another customer's error code must never be reused for a merely similar photo
+    assert 'text_detections' not in hit
+
+def test_analysis_cache_same_dhash_is_only_exact_for_same_bytes(fresh_analysis_cache):
+    cache = fresh_analysis_cache
+    same_hash = lambda data, etag=None: ('dhash-abcd000012345678', 0xABCD_0000_1234_5678)
+    with patch.object(cache, 'hash_key', same_hash):
+        _, info = cache.lookup(b'Error 1002 screen')
+        cache.store(info, {'labels': [{'Name': 'Television'}],
+                           'text_detections': [{'Type': 'LINE', 'Confidence': 99, 'DetectedText': 'Error 1002'}]})
+
+        other, other_info = cache.lookup(b'Error 1003 screen')
+        same, same_info = cache.lookup(b'Error 1002 screen')
+
+    assert other_info['distance'] == 0 and other_info['source'] == 'near'
+    assert 'text_detections' not in other
+    assert same_info['source'] == 'exact' and same['text_detections'][0]['DetectedText'] == 'Error 1002'
+
+def test_analysis_cache_exact_miss_costs_no_get(fresh_analysis_cache):
+    cache = fresh_analysis_cache
+    cache.lookup(b'first image')
+    reads = []
+    with patch.object(cache.s3_client, 'get_object', side_effect=lambda **kwargs: reads.append(kwargs['Key'])):
+        cached, info = cache.lookup(b'another image')
+
+    assert cached is None and info['key'].startswith('sha256-')
+    assert reads == []
+
+def test_analysis_cache_keys_untouched_images_by_etag(fresh_analysis_cache):
+    cache = fresh_analysis_cache
+    _, info = cache.lookup(None, '"9b2cf535f27731c974343645a3985328"')
+    cache.store(info, {'labels': [{'Name': 'Television'}], 'text_detections': [], 'custom_labels': []})
+
+    cached, info = cache.lookup(None, '"9b2cf535f27731c974343645a3985328"')
+
+    assert info['key'] == 'etag-9b2cf535f27731c974343645a3985328' and info['source'] == 'exact'
+    assert cached['labels'] == [{'Name': 'Television'}]
+
+@patch.object(image_preprocess, 'Image', None)
+@patch('image_analysis_handler.rekognition_client')
+@patch('image_analysis_handler.s3_client')
+def test_near_hit_reads_text_again(mock_s3, mock_rekognition, fresh_analysis_cache):
+    first, second = session_objects(fake_jpeg()), session_objects(fake_jpeg(orientation=6))
+    mock_s3.get_object.side_effect = lambda **kwargs: (first if 'first-session' in kwargs['Key'] else second)(**kwargs)
+    mock_rekognition.detect_labels.return_value = {'Labels': [{'Name': 'Television', 'Confidence': 99}]}
+    mock_rekognition.detect_text.side_effect = [
+        {'TextDetections': [{'Type': 'LINE', 'Confidence': 95, 'DetectedText': 'Error 1002'}]},
+        {'TextDetections': [{'Type': 'LINE', 'Confidence': 95, 'DetectedText': 'Error 1003'}]},
+    ]
+    hashes = iter([0xABCD_0000_1234_5678, 0xABCD_0000_1234_5679])
+    near_hash = lambda data, etag=None: (lambda v: (f"dhash-{v:016x}", v))(next(hashes))
+
+    with patch.object(fresh_analysis_cache, 'hash_key', near_hash):
+        analyze('first-session')
+        response = analyze('second-session')
+
+    analysis = json.loads(response['body'])['analysis']
+    assert analysis['cache']['source'] == 'near'
+    assert analysis['extracted_text'] == ['Error 1003']
+    assert analysis['labels'] == [{'Name': 'Television', 'Confidence': 99}]
+    assert mock_rekognition.detect_labels.call_count == 1 and mock_rekognition.detect_text.call_count == 2
+
+def test_analysis_cache_invalidates_on_model_change():
+    bucket = FakeBucket()
+    old_model = image_cache.AnalysisCache(bucket, 'test-bucket', 'arn:project/version/1')
+    _, info = old_model.lookup(b'same image bytes')
+    old_model.store(info, {'labels': [{'Name': 'Router'}]})
+    assert old_model.lookup(b'same image bytes')[0] is not None
+
+    new_model = image_cache.AnalysisCache(bucket, 'test-bucket', 'arn:project/version/2')
+    cached, info = new_model.lookup(b'same image bytes')
+
+    assert cached is None
+    assert info['generation'] != old_model.current_generation
+    assert json.loads(bucket.objects['image-cache/generation.json'])['project_arn'] == 'arn:project/version/2'
+
+@patch.object(image_preprocess, 'Image', None)
+@patch('image_analysis_handler.rekognition_client')
+@patch('image_analysis_handler.s3_client')
+def test_repeated_image_skips_rekognition(mock_s3, mock_rekognition):
+    mock_s3.get_object.side_effect = lambda **kwargs: {'Body': io.BytesIO(fake_jpeg())}
+    mock_rekognition.detect_labels.return_value = {'Labels': [{'Name': 'Router'}]}
+    mock_rekognition.detect_text.return_value = {'TextDetections': [
+        {'Type': 'LINE', 'Confidence': 95, 'DetectedText': 'No Service'}]}
+
+    analyze('first-session')
+    response = analyze('second-session')
+
+    assert mock_rekognition.detect_labels.call_count == 1
+    analysis = json.loads(response['body'])['analysis']
+    assert analysis['extracted_text'] == ['No Service']
+    assert analysis['cache']['source'] == 'exact'
+
+def test_planner_picks_plan_from_cheap_signals():
+    planner = image_analysis_handler.call_planner.CallPlanner()
+    available = ['labels', 'text_detections', 'custom_labels']
+
+    screen = planner.signals({'width': 1920, 'height': 1080}, 'the TV shows an error', None)
+    assert planner.plan(screen, available) == ('screen', [['text_detections'], ['labels', 'custom_labels']])
+
+    device = planner.signals({'width': 1600, 'height': 1200}, 'the router has a red light blinking', None)
+    assert planner.plan(device, available) == ('device', [['custom_labels'], ['labels', 'text_detections']])
+
+    # Mixed or missing signals keep the full concurrent fan-out
+    unsure = planner.signals({'width': 1600, 'height': 1200}, '', None)
+    assert planner.plan(unsure, available) == ('full', [['custom_labels', 'labels', 'text_detections']])
+    assert planner.plan(device, ['labels', 'text_detections']) == ('device', [['labels', 'text_detections']])
+
+def analyze_with_transcript(transcript):
+    return image_analysis_handler.lambda_handler(
+        {'body': json.dumps({'session_id': 'abc-123', 'transcript': transcript})}, {}
+    )
+
+@patch.object(image_analysis_handler, 'planner', image_analysis_handler.call_planner.CallPlanner())
+@patch('image_analysis_handler.rekognition_client')
+@patch('image_analysis_handler.s3_client')
+def test_screen_plan_stops_after_text(mock_s3, mock_rekognition):
+    mock_rekognition.detect_text.return_value = {'TextDetections': [
+        {'Type': 'LINE', 'Confidence': 97, 'DetectedText': 'Error 1002: No Signal'}]}
+
+    response = analyze_with_transcript('My TV screen shows an error code')
+
+    assert response['statusCode'] == 200
+    mock_rekognition.detect_labels.assert_not_called()
+    analysis = stored_analysis(mock_s3)
+    assert analysis['extracted_text'] == ['Error 1002: No Signal']
+    assert analysis['plan']['name'] == 'screen' and analysis['plan']['early_exit']
+    assert analysis['plan']['skipped'] == ['labels']
+    assert image_analysis_handler.planner.stats['screen']['calls'] == 1
+
+@patch.object(image_analysis_handler, 'planner', image_analysis_handler.call_planner.CallPlanner())
+@patch.object(image_preprocess, 'Image', None)
+@patch('image_analysis_handler.rekognition_client')
+@patch('image_analysis_handler.s3_client')
+def test_early_exit_is_not_cached_as_full_analysis(mock_s3, mock_rekognition, fresh_analysis_cache):
+    mock_s3.get_object.side_effect = session_objects(fake_jpeg())
+    mock_rekognition.detect_text.return_value = {'TextDetections': [
+        {'Type': 'LINE', 'Confidence': 97, 'DetectedText': 'Error 1002: No Signal'}]}
+    mock_rekognition.detect_labels.return_value = {'Labels': [{'Name': 'Television', 'Confidence': 99}]}
+
+    analyze_with_transcript('My TV screen shows an error code')
+    entry_key = fresh_analysis_cache.entry_key(stored_analysis(mock_s3)['cache']['key'])
+    assert 'labels' not in json.loads(fresh_analysis_cache.s3_client.objects[entry_key])['analysis']
+
+    mock_s3.put_object.reset_mock()
+    analyze_with_transcript('My TV screen shows an error code')
+
+    # The skipped call runs on the hit and completes the entry; text is not read again
+    analysis = stored_analysis(mock_s3)
+    assert analysis['cache']['source'] == 'exact' and analysis['labels'][0]['Name'] == 'Television'
+    assert mock_rekognition.detect_text.call_count == 1 and mock_rekognition.detect_labels.call_count == 1
+    assert 'labels' in json.loads(fresh_analysis_cache.s3_client.objects[entry_key])['analysis']
+
+@patch.object(image_analysis_handler, 'planner', image_analysis_handler.call_planner.CallPlanner())
+@patch('image_analysis_handler.rekognition_client')
+@patch('image_analysis_handler.s3_client')
+def test_screen_plan_falls_back_to_labels_without_text(mock_s3, mock_rekognition):
+    mock_rekognition.detect_text.return_value = {'TextDetections': []}
+    mock_rekognition.detect_labels.return_value = {'Labels': [{'Name': 'Television', 'Confidence': 99}]}
+
+    analyze_with_transcript('My TV screen shows an error code')
+
+    analysis = stored_analysis(mock_s3)
+    assert analysis['labels'][0]['Name'] == 'Television'
+    assert analysis['plan']['calls'] == ['text_detections', 'labels']
+    assert not analysis['plan']['early_exit']
+
+@patch.object(image_analysis_handler, 'planner', image_analysis_handler.call_planner.CallPlanner())
+@patch.object(image_analysis_handler, 'REKOGNITION_PROJECT_ARN', 'arn:aws:rekognition:project/version/1')
+@patch('image_analysis_handler.rekognition_client')
+@patch('image_analysis_handler.s3_client')
+def test_device_plan_trusts_confident_custom_labels(mock_s3, mock_rekognition):
+    mock_rekognition.detect_custom_labels.return_value = {'CustomLabels': [{'Name': 'RouterLOS', 'Confidence': 93}]}
+
+    analyze_with_transcript('The router has a red light blinking')
+
+    mock_rekognition.detect_labels.assert_not_called()
+    mock_rekognition.detect_text.assert_not_called()
+    analysis = stored_analysis(mock_s3)
+    assert analysis['custom_labels'][0]['Name'] == 'RouterLOS'
+    assert analysis['plan']['name'] == 'device'
+
+def rekognition_text(lines):
+    geometry = {'BoundingBox': {'Width': 0.5, 'Height': 0.1, 'Left': 0.1, 'Top': 0.1},
+                'Polygon': [{'X': 0.1, 'Y': 0.1}] * 4}
+    detections = []
+    for index, (text, confidence) in enumerate(lines):
+        detections.append({'Type': 'LINE', 'Id': index, 'Confidence': confidence, 'DetectedText': text, 'Geometry': geometry})
+        detections.extend({'Type': 'WORD', 'ParentId': index, 'Confidence': confidence, 'DetectedText': word, 'Geometry': geometry}
+                          for word in text.split())
+    return detections
+
+@patch('image_analysis_handler.rekognition_client')
+@patch('image_analysis_handler.s3_client')
+def test_analysis_is_stored_in_compact_schema(mock_s3, mock_rekognition):
+    mock_rekognition.detect_labels.return_value = {'Labels': [{
+        'Name': 'Router', 'Confidence': 98.7654, 'Instances': [{'BoundingBox': {}}],
+        'Parents': [{'Name': 'Electronics'}], 'Aliases': [], 'Categories': [{'Name': 'Technology'}]}]}
+    mock_rekognition.detect_text.return_value = {'TextDetections': rekognition_text(
+        [('LOS', 96.0), ('blurry smudge', 41.0)])}
+
+    response = analyze()
+
+    analysis = stored_analysis(mock_s3)
+    assert analysis['schema_version'] == 2
+    assert analysis['labels'] == [{'Name': 'Router', 'Confidence': 98.8}]
+    assert analysis['extracted_text'] == ['LOS']
+    assert 'text_detections' not in analysis and 'raw' not in analysis
+    assert json.loads(response['body'])['analysis'] == analysis
+
+@patch('image_analysis_handler.rekognition_client')
+@patch('image_analysis_handler.s3_client')
+def test_debug_flag_keeps_raw_rekognition_output(mock_s3, mock_rekognition):
+    mock_rekognition.detect_labels.return_value = {'Labels': [{'Name': 'Router', 'Confidence': 99, 'Parents': []}]}
+    mock_rekognition.detect_text.return_value = {'TextDetections': rekognition_text([('LOS', 96.0)])}
+
+    image_analysis_handler.lambda_handler({'body': json.dumps({'session_id': 'abc-123', 'debug': True})}, {})
+
+    raw = stored_analysis(mock_s3)['raw']
+    assert raw['labels'][0]['Parents'] == []
+    assert len(raw['text_detections']) == 2
@@ -0,0 +1,243 @@
+import pytest
+import json
+import io
+import math
+import struct
+import wave
+from unittest.mock import patch, MagicMock
+import sys
+import os
+
+# Set required environment variables before importing
+os.environ['STORAGE_BUCKET'] = 'test-bucket'
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+# Add lambda function to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'lambda_functions', 'transcribe_handler'))
+import transcribe_handler
+import audio_preprocess
+
+def stereo_wav(silence_before, speech, silence_after, rate=44100):
+    """Stereo 16-bit WAV: silence, a 440 Hz tone standing in for speech, silence"""
+    samples = [0] * int(silence_before * rate)
+    samples += [int(8000 * math.sin(2 * math.pi * 440 * i / rate)) for i in range(int(speech * rate))]
+    samples += [0] * int(silence_after * rate)
+    output = io.BytesIO()
+    with wave.open(output, 'wb') as wav:
+        wav.setnchannels(2)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(b''.join(struct.pack('<hh', s, s) for s in samples))
+    return output.getvalue()
+
+def test_normalize_wav_downmixes_resamples_and_trims():
+    normalized, report = audio_preprocess.normalize_wav(stereo_wav(2.0, 1.0, 3.0))
+
+    with wave.open(io.BytesIO(normalized)) as wav:
+        assert wav.getnchannels() == 1
+        assert wav.getframerate() == 16000
+    assert report['original_seconds'] == 6.0
+    # Speech plus padding on both sides survives
+    assert 1.0 <= report['seconds'] <= 1.5
+    assert report['seconds_saved'] >= 4.5
+    assert report['bytes_saved'] > 0.9 * report['original_bytes']
+
+def test_normalize_wav_keeps_quiet_speech_between_loud_speech():
+    # Almost no silence: the quiet middle must not be mistaken for a pause
+    rate = 16000
+    tone = lambda seconds, amplitude: [int(amplitude * math.sin(2 * math.pi * 440 * i / rate)) for i in range(int(seconds * rate))]
+    samples = [0] * int(0.3 * rate) + tone(3.0, 8000) + tone(2.0, 1500) + tone(3.0, 8000)
+    output = io.BytesIO()
+    with wave.open(output, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(b''.join(struct.pack('<h', s) for s in samples))
+
+    _, report = audio_preprocess.normalize_wav(output.getvalue())
+
+    assert report['seconds'] >= 8.0
+
+def test_normalize_wav_skips_non_wav_input():
+    data = b'# This is a placeholder for sample audio file'
+
+    normalized, report = audio_preprocess.normalize_wav(data)
+
+    assert normalized == data
+    assert 'skipped' in report
+
+@patch('transcribe_handler.s3_client')
+def test_preprocess_session_audio_stores_compact_copy(mock_s3):
+    mock_s3.get_object.return_value = {'Body': io.BytesIO(stereo_wav(1.0, 1.0, 1.0))}
+
+    key, report, audio = transcribe_handler.preprocess_session_audio('abc', 'sessions/abc/audio.wav')
+
+    assert key == 'sessions/abc/audio_normalized.wav'
+    assert mock_s3.put_object.call_args[1]['Key'] == key
+    assert mock_s3.put_object.call_args[1]['Body'] == audio
+    assert report['bytes_saved'] > 0
+
+class FakeBucket:
+    """Dict-backed S3 get/put so job records round-trip between handler calls"""
+
+    def __init__(self, objects=None):
+        self.objects = dict(objects or {})
+
+    def get_object(self, Bucket, Key):
+        from botocore.exceptions import ClientError
+        if Key not in self.objects:
+            raise ClientError({'Error': {'Code': 'NoSuchKey'}}, 'GetObject')
+        return {'Body': io.BytesIO(self.objects[Key])}
+
+    def put_object(self, Bucket, Key, Body, ContentType=None):
+        self.objects[Key] = Body if isinstance(Body, bytes) else Body.encode()
+
+@patch.object(transcribe_handler, 'job_service', transcribe_handler.transcription_jobs.LocalJobService())
+def test_async_transcription_completes_through_job_event():
+    bucket = FakeBucket({'sessions/abc/audio.wav': stereo_wav(0.5, 1.0, 0.5)})
+    with patch.object(transcribe_handler, 's3_client', bucket):
+        started = transcribe_handler.lambda_handler({'body': json.dumps({'session_id': 'abc', 'mode': 'async'})}, {})
+        assert started['statusCode'] == 202
+        assert json.loads(started['body'])['status_path'] == '/transcribe/abc'
+
+        status_event = {'httpMethod': 'GET', 'pathParameters': {'session_id': 'abc'}}
+        assert json.loads(transcribe_handler.lambda_handler(status_event, {})['body'])['status'] == 'IN_PROGRESS'
+        assert 'sessions/abc/transcript.json' not in bucket.objects
+
+        event = transcribe_handler.job_service.finish('transcribe-abc', 'My TV shows no signal')
+        transcribe_handler.lambda_handler(event, {})
+
+        status = json.loads(transcribe_handler.lambda_handler(status_event, {})['body'])
+        assert status['status'] == 'COMPLETED'
+        assert status['transcript'] == 'My TV shows no signal'
+        transcript = json.loads(bucket.objects['sessions/abc/transcript.json'])
+        assert transcript['text'] == 'My TV shows no signal'
+        assert transcript['audio_preprocessing']['seconds_saved'] > 0
+
+@patch.object(transcribe_handler, 'POLL_ATTEMPTS', 1)
+@patch.object(transcribe_handler, 'POLL_INTERVAL_SECONDS', 0)
+@patch.object(transcribe_handler, 'job_service', transcribe_handler.transcription_jobs.LocalJobService())
+def test_sync_poll_timeout_leaves_job_to_complete_through_event():
+    bucket = FakeBucket({'sessions/abc/audio.wav': stereo_wav(0.5, 1.0, 0.5)})
+    with patch.object(transcribe_handler, 's3_client', bucket):
+        timed_out = transcribe_handler.lambda_handler({'body': json.dumps({'session_id': 'abc'})}, {})
+        assert timed_out['statusCode'] == 202
+
+        status_event = {'httpMethod': 'GET', 'pathParameters': {'session_id': 'abc'}}
+        assert json.loads(transcribe_handler.lambda_handler(status_event, {})['body'])['status'] == 'IN_PROGRESS'
+
+        event = transcribe_handler.job_service.finish('transcribe-abc', 'My TV shows no signal')
+        transcribe_handler.lambda_handler(event, {})
+
+        status = json.loads(transcribe_handler.lambda_handler(status_event, {})['body'])
+        assert status['status'] == 'COMPLETED' and status['transcript'] == 'My TV shows no signal'
+        assert 'sessions/abc/transcript.json' in bucket.objects
+
+@patch.object(transcribe_handler, 'job_service', transcribe_handler.transcription_jobs.LocalJobService())
+def test_failed_job_event_records_reason():
+    bucket = FakeBucket()
+    with patch.object(transcribe_handler, 's3_client', bucket):
+        transcribe_handler.lambda_handler({'body': json.dumps({'session_id': 'abc', 'mode': 'async'})}, {})
+        event = transcribe_handler.job_service.finish('transcribe-abc', failure_reason='Unsupported media')
+        transcribe_handler.lambda_handler(event, {})
+
+        status = json.loads(transcribe_handler.lambda_handler(
+            {'httpMethod': 'GET', 'pathParameters': {'session_id': 'abc'}}, {})['body'])
+        assert status['status'] == 'FAILED'
+        assert status['failure_reason'] == 'Unsupported media'
+
+def test_status_rejects_bad_session_id():
+    response = transcribe_handler.lambda_handler({'httpMethod': 'GET', 'pathParameters': {'session_id': '../x'}}, {})
+
+    assert response['statusCode'] == 400
+
+def test_project_transcript_keeps_word_confidences():
+    result = {'results': {
+        'transcripts': [{'transcript': 'No signal.'}],
+        'items': [
+            {'type': 'pronunciation', 'start_time': '0.1', 'end_time': '0.4',
+             'alternatives': [{'content': 'No', 'confidence': '0.99'}]},
+            {'type': 'pronunciation', 'start_time': '0.4', 'end_time': '0.9',
+             'alternatives': [{'content': 'signal', 'confidence': '0.81'}]},
+            {'type': 'punctuation', 'alternatives': [{'content': '.', 'confidence': '0.0'}]}
+        ]
+    }}
+
+    transcript = transcribe_handler.transcription_jobs.project_transcript(result)
+
+    assert transcript['text'] == 'No signal.'
+    assert transcript['words'] == [['No', 0.1, 0.4, 0.99], ['signal', 0.4, 0.9, 0.81]]
+    assert transcript['confidence'] == 0.9
+
+def test_transcribe_jobs_write_to_and_read_from_storage_bucket():
+    mock_transcribe = MagicMock()
+    bucket = FakeBucket({'sessions/abc/transcribe_output.json': json.dumps(
+        {'results': {'transcripts': [{'transcript': 'hello'}], 'items': []}}).encode()})
+    service = transcribe_handler.transcription_jobs.TranscribeJobService(mock_transcribe, bucket, 'test-bucket')
+
+    service.start('transcribe-abc', 's3://test-bucket/sessions/abc/audio.wav')
+    result = service.fetch_result('transcribe-abc')
+
+    kwargs = mock_transcribe.start_transcription_job.call_args[1]
+    assert kwargs['OutputBucketName'] == 'test-bucket'
+    assert kwargs['OutputKey'] == 'sessions/abc/transcribe_output.json'
+    assert result['results']['transcripts'][0]['transcript'] == 'hello'
+    mock_transcribe.get_transcription_job.assert_not_called()
+
+class FakeLocalASR:
+    """Local engine double; the real one needs faster-whisper and a packaged model"""
+
+    name = 'local'
+
+    def __init__(self, text='restart my set top box'):
+        self.text = text
+        self.calls = 0
+
+    def available(self):
+        return True
+
+    def transcribe(self, audio_bytes):
+        self.calls += 1
+        return {'text': self.text, 'confidence': 0.8, 'word_fields': [], 'words': []}
+
+@patch.object(transcribe_handler, 'local_asr', FakeLocalASR())
+@patch.object(transcribe_handler, 'job_service', transcribe_handler.transcription_jobs.LocalJobService())
+def test_short_clip_is_transcribed_in_process():
+    bucket = FakeBucket({'sessions/abc/audio.wav': stereo_wav(0.5, 2.0, 0.5)})
+    with patch.object(transcribe_handler, 's3_client', bucket):
+        response = transcribe_handler.lambda_handler({'body': json.dumps({'session_id': 'abc', 'mode': 'async'})}, {})
+
+    assert response['statusCode'] == 200
+    assert json.loads(response['body'])['transcript'] == 'restart my set top box'
+    assert transcribe_handler.job_service.jobs == {}
+    asr = json.loads(bucket.objects['sessions/abc/transcript.json'])['asr']
+    assert asr['backend'] == 'local' and asr['reason'] == 'short_clip'
+    assert 'latency_ms' in asr
+
+def test_local_engine_needs_opt_in_and_packaged_model(tmp_path):
+    backend = transcribe_handler.asr_backends.LocalWhisperBackend(model_path=str(tmp_path))
+    with patch.object(transcribe_handler.asr_backends, 'WhisperModel', MagicMock()):
+        assert not backend.available()
+        with patch.object(transcribe_handler.asr_backends, 'LOCAL_ASR_ENABLED', True):
+            assert backend.available()
+            missing = transcribe_handler.asr_backends.LocalWhisperBackend(model_path=str(tmp_path / 'missing'))
+            assert not missing.available()
+
+@patch.object(transcribe_handler.asr_backends, 'LOCAL_ASR_MAX_SECONDS', 1.0)
+@patch.object(transcribe_handler, 'local_asr', FakeLocalASR())
+@patch.object(transcribe_handler, 'job_service', transcribe_handler.transcription_jobs.LocalJobService())
+def test_failed_job_falls_back_to_local_engine():
+    bucket = FakeBucket({'sessions/abc/audio.wav': stereo_wav(0.5, 3.0, 0.5)})
+    with patch.object(transcribe_handler, 's3_client', bucket):
+        started = transcribe_handler.lambda_handler({'body': json.dumps({'session_id': 'abc', 'mode': 'async'})}, {})
+        assert started['statusCode'] == 202
+        record = json.loads(bucket.objects['sessions/abc/transcription.json'])
+        assert record['asr'] == {'backend': 'transcribe', 'reason': 'long_clip'}
+
+        event = transcribe_handler.job_service.finish('transcribe-abc', failure_reason='Internal failure')
+        transcribe_handler.lambda_handler(event, {})
+
+    record = json.loads(bucket.objects['sessions/abc/transcription.json'])
+    assert record['status'] == 'COMPLETED'
+    assert record['asr']['backend'] == 'local' and record['asr']['reason'] == 'transcribe_failed'
+    assert transcribe_handler.local_asr.calls == 1
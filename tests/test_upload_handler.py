@@ -38,7 +38,36 @@ def test_upload_handler_success(mock_s3):
     assert response_body['message'] == 'Files uploaded successfully'
     
     # Verify S3 calls
-    assert mock_s3.put_object.call_count == 3  # image, audio, metadata
+    assert mock_s3.put_object.call_count == 3  # image, audio, session manifest
+
+@patch('upload_handler.s3_client')
+def test_text_only_upload_writes_single_manifest(mock_s3):
+    response = lambda_handler({'body': json.dumps({'text': 'My TV shows no signal'})}, {})
+    
+    assert response['statusCode'] == 200
+    mock_s3.put_object.assert_called_once()
+    call = mock_s3.put_object.call_args[1]
+    assert call['Key'].endswith('/session.json')
+    manifest = json.loads(call['Body'])
+    assert manifest['transcript']['text'] == 'My TV shows no signal'
+    assert manifest['image_analysis']['labels'] == []
+
+@patch('upload_handler.s3_client')
+def test_failed_media_upload_writes_no_manifest(mock_s3):
+    def put_object(**kwargs):
+        if kwargs['Key'].endswith('audio.wav'):
+            raise Exception("S3 Error")
+        return {}
+    mock_s3.put_object.side_effect = put_object
+    
+    response = lambda_handler({'body': json.dumps({
+        'image': base64.b64encode(b'fake_image_data').decode(),
+        'audio': base64.b64encode(b'fake_audio_data').decode()
+    })}, {})
+    
+    assert response['statusCode'] == 500
+    written = [c[1]['Key'] for c in mock_s3.put_object.call_args_list]
+    assert not any(key.endswith('/session.json') for key in written)
 
 @patch('upload_handler.s3_client')
 def test_upload_handler_error(mock_s3):
@@ -55,4 +84,77 @@ def test_upload_handler_error(mock_s3):
     
     assert response['statusCode'] == 500
     response_body = json.loads(response['body'])
-    assert 'error' in response_body
\ No newline at end of file
+    assert 'error' in response_body
+
+@patch('upload_handler.s3_client')
+def test_presigned_upload_returns_size_limited_post_forms(mock_s3):
+    mock_s3.generate_presigned_post.side_effect = lambda Bucket, Key, Fields, Conditions, ExpiresIn: {
+        'url': 'https://s3/test-bucket', 'fields': dict(Fields, key=Key, policy='signed')
+    }
+    
+    response = lambda_handler({'body': json.dumps({'mode': 'presigned'})}, {})
+    
+    assert response['statusCode'] == 200
+    body = json.loads(response['body'])
+    session_id = body['session_id']
+    image = body['uploads']['image']
+    assert image['method'] == 'POST' and image['fields']['key'] == f"sessions/{session_id}/image.jpg"
+    assert body['uploads']['audio']['fields']['Content-Type'] == 'audio/wav'
+    # S3 rejects oversized files itself: the API has no auth
+    conditions = {c[1]['Key'].rsplit('/', 1)[1]: c[1]['Conditions'] for c in mock_s3.generate_presigned_post.call_args_list}
+    assert ['content-length-range', 1, 10 * 1024 * 1024] in conditions['image.jpg']
+    assert ['content-length-range', 1, 25 * 1024 * 1024] in conditions['audio.wav']
+    # No bytes pass through the Lambda and no metadata until completion
+    mock_s3.put_object.assert_not_called()
+
+@patch('upload_handler.s3_client')
+def test_complete_upload_writes_metadata(mock_s3):
+    event = {
+        'resource': '/upload/complete',
+        'body': json.dumps({'session_id': 'abc-123', 'files': ['image']})
+    }
+    
+    response = lambda_handler(event, {})
+    
+    assert response['statusCode'] == 200
+    metadata = json.loads(mock_s3.put_object.call_args[1]['Body'])
+    assert metadata['image_key'] == 'sessions/abc-123/image.jpg'
+    assert metadata['audio_key'] is None
+
+@patch('upload_handler.s3_client')
+def test_complete_upload_rejects_missing_file(mock_s3):
+    from botocore.exceptions import ClientError
+    mock_s3.head_object.side_effect = ClientError({'Error': {'Code': '404'}}, 'HeadObject')
+    event = {
+        'resource': '/upload/complete',
+        'body': json.dumps({'session_id': 'abc-123', 'files': ['audio']})
+    }
+    
+    response = lambda_handler(event, {})
+    
+    assert response['statusCode'] == 400
+    assert json.loads(response['body'])['missing'] == ['audio']
+    mock_s3.put_object.assert_not_called()
+
+def test_upload_chunks_stores_one_object():
+    from streaming_upload import iter_decoded, upload_chunks
+    mock_s3 = MagicMock()
+    data = bytes(range(256)) * 4
+    encoded = base64.b64encode(data).decode()
+    
+    size = upload_chunks(mock_s3, 'test-bucket', 'k', iter_decoded(encoded, 0, len(encoded), chunk_chars=100), 'audio/wav')
+    
+    assert size == len(data)
+    call = mock_s3.put_object.call_args[1]
+    assert bytes(call['Body']) == data and call['Key'] == 'k' and call['ContentType'] == 'audio/wav'
+
+def test_find_media_spans_slices_base64_values():
+    from streaming_upload import find_media_spans
+    raw = json.dumps({'text': 'my "audio": "x" is broken', 'audio': 'QUJD', 'image': 'a\\/b'})
+    
+    body, spans = find_media_spans(raw, ['image', 'audio'])
+    
+    assert raw[slice(*spans['audio'])] == 'QUJD'
+    # Escaped values are left to the regular JSON decode
+    assert 'image' not in spans and body['image'] == 'a\\/b'
+    assert body['text'] == 'my "audio": "x" is broken'